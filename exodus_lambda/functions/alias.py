@@ -0,0 +1,177 @@
+import json
+import re
+from typing import Any, Optional
+
+# Characters with special meaning in a regular expression.
+_REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+# Flags of a pattern compiled without any inline flags.
+_DEFAULT_FLAGS = re.compile("").flags
+
+
+def _required_literal(pattern: str) -> str:
+    # Given a pattern containing at least one special character, returns
+    # a substring which must be present in any string matched by the
+    # pattern, or an empty string if none could be determined.
+    #
+    # This only looks at the literal text leading up to the first special
+    # character, which covers typical patterns such as "/rhel[89]/".
+    if "|" in pattern:
+        return ""
+
+    end = next(i for i, char in enumerate(pattern) if char in _REGEX_META)
+    literal = pattern[:end]
+    if pattern[end] in "*?{":
+        # The preceding character is optional.
+        literal = literal[:-1]
+    return literal
+
+
+class Exclusions:
+    """The exclude_paths of a single alias, compiled for fast matching.
+
+    Patterns without any special characters are matched as plain
+    substrings. Everything else is combined into a single compiled
+    alternation where possible, which is only run if the URI contains a
+    literal required by at least one of those patterns.
+    """
+
+    __slots__ = ("literals", "regexes", "prefilter")
+
+    def __init__(self, patterns: list[str]):
+        self.literals: tuple[str, ...] = tuple(
+            p for p in patterns if not _REGEX_META.intersection(p)
+        )
+        compiled = [
+            re.compile(p) for p in patterns if _REGEX_META.intersection(p)
+        ]
+
+        # Only patterns without groups (whose numbering backreferences
+        # could be thrown off by) or inline global flags (which are only
+        # allowed at the start of a pattern) are safe to combine.
+        combinable = [
+            c for c in compiled if not c.groups and c.flags == _DEFAULT_FLAGS
+        ]
+        if len(combinable) > 1:
+            compiled = [
+                re.compile("|".join(f"(?:{c.pattern})" for c in combinable))
+            ] + [c for c in compiled if c not in combinable]
+        self.regexes: tuple[re.Pattern[str], ...] = tuple(compiled)
+
+        self.prefilter: tuple[str, ...] = ()
+        required = [
+            _required_literal(p)
+            for p in patterns
+            if _REGEX_META.intersection(p)
+        ]
+        if all(required):
+            self.prefilter = tuple(required)
+
+    def search(self, uri: str) -> bool:
+        for literal in self.literals:
+            if literal in uri:
+                return True
+
+        if not self.regexes:
+            return False
+
+        if self.prefilter and not any(lit in uri for lit in self.prefilter):
+            return False
+
+        return any(regex.search(uri) for regex in self.regexes)
+
+
+class _Node:
+    __slots__ = ("children", "aliases")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.aliases: list[int] = []
+
+
+class AliasIndex:
+    """A list of aliases (as found in cdn-definitions) compiled into a
+    prefix trie keyed by path segment.
+
+    Resolving a URI against the index gives exactly the same result as
+    repeatedly scanning the alias list until no more aliases apply, but
+    each step only has to look at the aliases whose 'src' is a prefix of
+    the URI, so the cost doesn't grow with the number of aliases.
+    """
+
+    def __init__(self, aliases: Optional[list[dict[str, Any]]]):
+        self.aliases = list(aliases or [])
+        self._root = _Node()
+
+        # Compiled once here and used for every lookup, whether or not
+        # exclusions are being ignored.
+        self.exclusions = [
+            Exclusions(alias.get("exclude_paths") or [])
+            for alias in self.aliases
+        ]
+
+        # Equal aliases are treated as one when deciding what has
+        # already been applied, so keep track of which indexes are
+        # duplicates of each other.
+        groups: dict[str, list[int]] = {}
+        self._same: list[list[int]] = []
+
+        for idx, alias in enumerate(self.aliases):
+            node = self._root
+            for segment in alias["src"].split("/"):
+                node = node.children.setdefault(segment, _Node())
+            node.aliases.append(idx)
+
+            group = groups.setdefault(
+                json.dumps(alias, sort_keys=True, default=str), []
+            )
+            group.append(idx)
+            self._same.append(group)
+
+    def _candidates(self, uri: str) -> list[int]:
+        # Indexes of all aliases whose src is a prefix of uri at a path
+        # boundary, i.e. uri == src or uri.startswith(src + "/").
+        node = self._root
+        out: list[int] = []
+        for segment in uri.split("/"):
+            next_node = node.children.get(segment)
+            if next_node is None:
+                break
+            node = next_node
+            out.extend(node.aliases)
+        return out
+
+    def _next(
+        self, uri: str, after: int, applied: set[int], ignore_exclusions: bool
+    ) -> Optional[int]:
+        # Find the first alias, in definition order, following 'after'
+        # which can be applied to uri.
+        for idx in sorted(self._candidates(uri)):
+            if idx <= after or idx in applied:
+                continue
+            if ignore_exclusions or not self.exclusions[idx].search(uri):
+                return idx
+        return None
+
+    def resolve(self, uri: str, ignore_exclusions: bool = False) -> str:
+        applied: set[int] = set()
+
+        # Each pass walks the aliases in the order they're defined (as
+        # the URI changes along the way); passes are repeated so that
+        # nested aliases are resolved regardless of definition order.
+        # Each alias is only ever applied once.
+        while True:
+            processed: list[int] = []
+            idx = self._next(uri, -1, applied, ignore_exclusions)
+
+            while idx is not None:
+                src = self.aliases[idx]["src"]
+                uri = self.aliases[idx]["dest"] + uri[len(src) :]
+                processed.append(idx)
+                idx = self._next(uri, idx, applied, ignore_exclusions)
+
+            if not processed:
+                return uri
+
+            for idx in processed:
+                applied.update(self._same[idx])
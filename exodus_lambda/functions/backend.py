@@ -0,0 +1,265 @@
+import json
+import os
+from bisect import bisect_right
+from typing import Any, Iterable, Optional, Protocol
+
+from .db import QueryHelper
+
+# An item as stored in a table, in DynamoDB JSON format, e.g.
+# {"web_uri": {"S": "/some/path"}, "object_key": {"S": "abc123"}, ...}
+Item = dict[str, Any]
+
+# from_date used for fixture items which don't specify one.
+DEFAULT_FROM_DATE = "1970-01-01T00:00:00.000+00:00"
+
+
+class Backend(Protocol):
+    """Source of items from the content and config tables.
+
+    In each table, there may be several items with the same key but a
+    different from_date; the item in effect at any given time is the one
+    with the latest from_date not in the future. Dates are ISO 8601
+    strings and are compared as strings, as DynamoDB does.
+    """
+
+    def latest_item(
+        self, table: str, web_uri: str, as_of: str
+    ) -> Optional[Item]:
+        """Returns the content item for web_uri with the latest from_date
+        <= as_of, if any."""
+
+    def next_from_date(
+        self, table: str, web_uri: str, after: str
+    ) -> Optional[str]:
+        """Returns the earliest from_date > after of any content item for
+        web_uri, if any."""
+
+    def latest_config(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[Item]:
+        """Returns the config item for config_id with the latest from_date
+        <= as_of, if any."""
+
+    def latest_config_date(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[str]:
+        """Returns the from_date of the item latest_config would return,
+        if any, without fetching the config itself."""
+
+
+class DynamoDbBackend:
+    """Backend querying DynamoDB tables via a QueryHelper."""
+
+    def __init__(self, db: QueryHelper):
+        self._db = db
+
+    def latest_item(
+        self, table: str, web_uri: str, as_of: str
+    ) -> Optional[Item]:
+        result = self._db.query(
+            TableName=table,
+            Limit=1,
+            ConsistentRead=True,
+            ScanIndexForward=False,
+            KeyConditionExpression="web_uri = :u and from_date <= :d",
+            ExpressionAttributeValues={
+                ":u": {"S": web_uri},
+                ":d": {"S": as_of},
+            },
+        )
+        return result["Items"][0] if result["Items"] else None
+
+    def next_from_date(
+        self, table: str, web_uri: str, after: str
+    ) -> Optional[str]:
+        result = self._db.query(
+            TableName=table,
+            Limit=1,
+            ConsistentRead=True,
+            ScanIndexForward=True,
+            KeyConditionExpression="web_uri = :u and from_date > :d",
+            ProjectionExpression="from_date",
+            ExpressionAttributeValues={
+                ":u": {"S": web_uri},
+                ":d": {"S": after},
+            },
+        )
+        return (
+            result["Items"][0]["from_date"]["S"] if result["Items"] else None
+        )
+
+    def latest_config(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[Item]:
+        result = self._db.query(
+            TableName=table,
+            Limit=1,
+            ScanIndexForward=False,
+            KeyConditionExpression="config_id = :id and from_date <= :d",
+            ExpressionAttributeValues={
+                ":id": {"S": config_id},
+                ":d": {"S": as_of},
+            },
+        )
+        return result["Items"][0] if result["Items"] else None
+
+    def latest_config_date(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[str]:
+        result = self._db.query(
+            TableName=table,
+            Limit=1,
+            ScanIndexForward=False,
+            KeyConditionExpression="config_id = :id and from_date <= :d",
+            ProjectionExpression="from_date",
+            ExpressionAttributeValues={
+                ":id": {"S": config_id},
+                ":d": {"S": as_of},
+            },
+        )
+        return (
+            result["Items"][0]["from_date"]["S"] if result["Items"] else None
+        )
+
+
+class InMemoryBackend:
+    """Backend serving items held in memory, e.g. for benchmarks and tests.
+
+    Items of each table are kept in a single list sorted by (key,
+    from_date), so lookups are O(log n) via bisect however many items
+    are loaded.
+    """
+
+    def __init__(self) -> None:
+        self._keys: dict[str, list[tuple[str, str]]] = {}
+        self._items: dict[str, list[Item]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._keys.values())
+
+    def put_item(self, table: str, key: str, item: Item) -> None:
+        """Add a single item, with the given key, to a table.
+
+        For adding many items, load_items is much faster.
+        """
+        keys = self._keys.setdefault(table, [])
+        items = self._items.setdefault(table, [])
+        entry = (key, item["from_date"]["S"])
+        idx = bisect_right(keys, entry)
+        keys.insert(idx, entry)
+        items.insert(idx, item)
+
+    def load_items(
+        self, table: str, key_name: str, items: Iterable[Item]
+    ) -> None:
+        """Add items to a table, keyed by their key_name attribute."""
+        entries = [
+            ((item[key_name]["S"], item["from_date"]["S"]), item)
+            for item in items
+        ]
+        entries.extend(
+            zip(self._keys.get(table, []), self._items.get(table, []))
+        )
+        entries.sort(key=lambda entry: entry[0])
+        self._keys[table] = [key for key, _ in entries]
+        self._items[table] = [item for _, item in entries]
+
+    def items(self, table: str) -> list[Item]:
+        """Returns all items of a table, sorted by (key, from_date)."""
+        return list(self._items.get(table) or [])
+
+    def load_fixture(
+        self, data: dict[str, Any], table: str, config_table: str
+    ) -> None:
+        """Load items from fixture data, which may contain:
+
+        - "items": content items with plain values, e.g.
+          {"web_uri": "/some/path", "object_key": "abc123",
+          "content_type": "text/plain", "from_date": "2024-01-01"};
+          from_date is optional
+        - "test_data": content in the format of support/reftest/data.yml
+        - "config": an exodus-config document (as found in cdn-definitions)
+        """
+        items = [
+            {key: {"S": value} for key, value in item.items()}
+            for item in data.get("items") or []
+        ]
+        for entry in data.get("test_data") or []:
+            if not entry.get("deploy", True):
+                # Only reachable via aliases.
+                continue
+            item = {
+                "web_uri": {"S": entry["path"]},
+                "object_key": {"S": entry.get("sha256", "")},
+            }
+            if entry.get("state") == "absent":
+                item["object_key"] = {"S": "absent"}
+            elif content_type := entry.get("content-type"):
+                item["content_type"] = {"S": content_type}
+            items.append(item)
+
+        for item in items:
+            item.setdefault("from_date", {"S": DEFAULT_FROM_DATE})
+        self.load_items(table, "web_uri", items)
+
+        if (config := data.get("config")) is not None:
+            self.put_item(
+                config_table,
+                "exodus-config",
+                {
+                    "config_id": {"S": "exodus-config"},
+                    "from_date": {"S": DEFAULT_FROM_DATE},
+                    "config": {"S": json.dumps(config)},
+                },
+            )
+
+    @classmethod
+    def from_file(
+        cls, path: str, table: str, config_table: str
+    ) -> "InMemoryBackend":
+        """Returns a backend loaded from a JSON or YAML fixture file; see
+        load_fixture for the format."""
+        with open(path, "rt", encoding="utf-8") as fixture:
+            if os.path.splitext(path)[1] in (".yml", ".yaml"):
+                # Only needed here, so not required in the Lambda.
+                import yaml  # pylint: disable=import-outside-toplevel
+
+                data = yaml.safe_load(fixture)
+            else:
+                data = json.load(fixture)
+
+        out = cls()
+        out.load_fixture(data, table, config_table)
+        return out
+
+    def _latest(self, table: str, key: str, as_of: str) -> Optional[Item]:
+        keys = self._keys.get(table) or []
+        idx = bisect_right(keys, (key, as_of)) - 1
+        if idx >= 0 and keys[idx][0] == key:
+            return self._items[table][idx]
+        return None
+
+    def latest_item(
+        self, table: str, web_uri: str, as_of: str
+    ) -> Optional[Item]:
+        return self._latest(table, web_uri, as_of)
+
+    def next_from_date(
+        self, table: str, web_uri: str, after: str
+    ) -> Optional[str]:
+        keys = self._keys.get(table) or []
+        idx = bisect_right(keys, (web_uri, after))
+        if idx < len(keys) and keys[idx][0] == web_uri:
+            return keys[idx][1]
+        return None
+
+    def latest_config(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[Item]:
+        return self._latest(table, config_id, as_of)
+
+    def latest_config_date(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[str]:
+        item = self._latest(table, config_id, as_of)
+        return item["from_date"]["S"] if item else None
@@ -6,6 +6,15 @@ import re
 
 from .json_logging import JsonFormatter
 
+# Patterns matching paths of files which are expected to change in place,
+# such as repository entry points.
+MUTABLE_PATH_PATTERNS = [
+    ".+/PULP_MANIFEST",
+    ".+/listing",
+    ".+/repodata/repomd.xml",
+    ".+/ostree/repo/refs/heads/.*/.*",
+]
+
 
 class LambdaBase(object):
     def __init__(self, logger_name="default", conf_file="lambda_config.json"):
@@ -74,14 +83,7 @@ class LambdaBase(object):
         ]
 
     def set_cache_control(self, uri, response):
-        max_age_pattern_whitelist = [
-            ".+/PULP_MANIFEST",
-            ".+/listing",
-            ".+/repodata/repomd.xml",
-            ".+/ostree/repo/refs/heads/.*/.*",
-        ]
-
-        for pattern in max_age_pattern_whitelist:
+        for pattern in MUTABLE_PATH_PATTERNS:
             if re.match(pattern, uri):
                 response["headers"]["cache-control"] = [
                     {
@@ -0,0 +1,57 @@
+import threading
+from typing import Any
+
+import cachetools
+
+
+class CountingMixin:
+    """Mixin for cachetools caches keeping count of lookup hits and misses,
+    so that cache effectiveness can be reported in logs.
+
+    The lookup, store and clear methods are thread-safe.
+    """
+
+    hits = 0
+    misses = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def lookup(self, key, default=None):
+        """Like get(), but counts the outcome as a hit or miss."""
+        with self._lock:
+            try:
+                value = self[key]  # type: ignore[index]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def store(self, key, value) -> None:
+        """Like __setitem__, but silently does nothing if the cache is
+        disabled (has a maxsize of 0)."""
+        if self.maxsize:  # type: ignore[attr-defined]
+            with self._lock:
+                self[key] = value  # type: ignore[index]
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()  # type: ignore[misc]
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class LRUCache(CountingMixin, cachetools.LRUCache):  # type: ignore[type-arg]
+    pass
+
+
+class TTLCache(CountingMixin, cachetools.TTLCache):  # type: ignore[type-arg]
+    pass
+
+
+class TLRUCache(CountingMixin, cachetools.TLRUCache):  # type: ignore[type-arg]
+    pass
@@ -0,0 +1,126 @@
+import gzip
+import json
+import os
+import sys
+from tempfile import NamedTemporaryFile
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+from .alias import AliasIndex
+
+# Keys of exodus-config holding lists of aliases.
+ALIAS_KEYS = ("origin_alias", "rhui_alias", "releasever_alias")
+
+
+def decode_config(item: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Returns the config held in an item from the config table, or an
+    empty config if there's no item."""
+    if not item:
+        # Provide dict with expected keys when no config is found.
+        return {
+            "origin_alias": [],
+            "rhui_alias": [],
+            "releasever_alias": [],
+            "listing": {},
+        }
+
+    if item_bytes := item["config"].get("B"):
+        # new-style: config is compressed and stored as bytes
+        item_json = gzip.decompress(item_bytes).decode()
+    else:
+        # old-style, config was stored as JSON string.
+        # Consider deleting this code path in 2025
+        item_json = item["config"]["S"]
+    return json.loads(item_json)
+
+
+def write_config_file(
+    path: str, definitions: dict[str, Any], from_date: Optional[str]
+) -> None:
+    """Write a config and its from_date to path.
+
+    The file is replaced atomically, so a concurrent reader never sees it
+    partially written.
+    """
+    with NamedTemporaryFile(
+        mode="wt",
+        encoding="utf-8",
+        dir=os.path.dirname(path) or ".",
+        prefix=".exodus-config",
+        delete=False,
+    ) as tmp:
+        try:
+            json.dump({"from_date": from_date, "config": definitions}, tmp)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+
+
+def read_config_file(path: str) -> tuple[dict[str, Any], Optional[str]]:
+    """Returns the config and its from_date from a file written by
+    write_config_file."""
+    with open(path, "rt", encoding="utf-8") as config_file:
+        data = json.load(config_file)
+    if not isinstance(data, dict) or not isinstance(data.get("config"), dict):
+        raise ValueError(f"Not a config file: {path}")
+    return data["config"], data.get("from_date")
+
+
+class ConfigSnapshot:
+    """An exodus-config, compiled into the structures used when handling
+    requests.
+
+    A snapshot is built once for each loaded config and can't be modified
+    afterwards, so it can be shared freely between threads. A request
+    which holds on to a single snapshot sees one consistent config
+    throughout, even if a newer config is loaded in the meantime.
+
+    Each snapshot has a generation, which increases with every config
+    loaded, and so may be used in cache keys for anything derived from
+    the config.
+    """
+
+    __slots__ = ("generation", "definitions", "aliases", "listings")
+
+    generation: int
+    definitions: dict[str, Any]
+    aliases: Mapping[str, AliasIndex]
+    listings: Mapping[str, str]
+
+    def __init__(self, definitions: dict[str, Any], generation: int):
+        init = super().__setattr__
+        init("generation", generation)
+        # The raw config, as loaded. Not copied, so this is immutable only
+        # by convention.
+        init("definitions", definitions)
+        init(
+            "aliases",
+            MappingProxyType(
+                {key: AliasIndex(definitions.get(key)) for key in ALIAS_KEYS}
+            ),
+        )
+        # Listing responses are rendered up front, keyed by the path the
+        # listing is for.
+        init(
+            "listings",
+            MappingProxyType(
+                {
+                    sys.intern(target): "\n".join(listing["values"]) + "\n"
+                    for target, listing in (
+                        definitions.get("listing") or {}
+                    ).items()
+                    if listing
+                }
+            ),
+        )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def listing(self, target: str) -> Optional[str]:
+        """Returns the body of the listing response for target, if any."""
+        return self.listings.get(target)
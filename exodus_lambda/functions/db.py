@@ -1,44 +1,896 @@
+import contextlib
+import contextvars
+import functools
+import hashlib
+import hmac
+import http.client
+import json
 import logging
-from typing import Any, Optional
+import math
+import os
+import socket
+import threading
+import time
+import zlib
+from base64 import b64decode, b64encode
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import wait
+from datetime import datetime, timezone
+from typing import Any, Callable, Hashable, Iterator, Optional
+from urllib.parse import urlsplit
 
-import boto3
-import botocore
+from .health import RegionHealth
+from .metrics import Metrics
+from .regions import estimated_latency
+from .singleflight import SingleFlight, WaitTimeout
 
 LOG = logging.getLogger("exodus_lambda")
 
 
+class DeadlineExceeded(Exception):
+    """Raised when a query couldn't be completed before the deadline of the
+    request it was made for."""
+
+
+class RequestStats:
+    """Stats on the queries made while handling a single request.
+
+    Also holds the request's deadline (in terms of time.monotonic), if any.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.deadline = deadline
+        self.queries = 0
+        self.hedges = 0
+        self.attempts = 0
+        self.retries = 0
+        self.backoff = 0.0
+        # Queries which shared the result of an identical query in progress.
+        self.coalesced = 0
+        # Read capacity units consumed, by table and region.
+        self.consumed_capacity: dict[str, dict[str, float]] = {}
+
+    def add(self, name: str, value: float = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def add_capacity(self, table: str, region: str, units: float):
+        with self._lock:
+            by_region = self.consumed_capacity.setdefault(table, {})
+            by_region[region] = by_region.get(region, 0) + units
+
+    def remaining(self) -> Optional[float]:
+        """Seconds remaining until the deadline, or None if there is no
+        deadline."""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+# Stats for the request currently being handled, if any.
+#
+# A context variable is used so that lookups made on behalf of a request from
+# other threads (see copy_context) are accounted to that request.
+CURRENT_REQUEST: contextvars.ContextVar[Optional[RequestStats]] = (
+    contextvars.ContextVar("exodus_lambda_request", default=None)
+)
+
+# Whether the query currently being made could fail over to another region
+# if it fails.
+_CAN_FAIL_OVER: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "exodus_lambda_can_fail_over", default=False
+)
+
+# Time (per time.monotonic) by which the query attempt currently being made
+# must complete, if limited by a request's deadline.
+_ATTEMPT_DEADLINE: contextvars.ContextVar[Optional[float]] = (
+    contextvars.ContextVar("exodus_lambda_attempt_deadline", default=None)
+)
+
+# Key in botocore request context holding the time at which a retry was
+# allowed, used to measure the backoff before the retry is sent.
+_RETRY_CONTEXT_KEY = "exodus_lambda_retry_at"
+
+# Key in botocore request context holding the time at which the request was
+# sent, used to measure its latency.
+_SENT_CONTEXT_KEY = "exodus_lambda_sent_at"
+
+
+def _attempt_timeout(limit: float) -> float:
+    # Returns limit, or the time left for the current attempt if less.
+    # Raises TimeoutError if no time is left.
+    deadline = _ATTEMPT_DEADLINE.get()
+    if deadline is None:
+        return limit
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("No time left for query attempt")
+    return min(limit, remaining)
+
+
+class DynamoDbError(Exception):
+    """An error response from DynamoDB, as raised by LiteDynamoDbClient."""
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(f"{code} ({status}): {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _decode_value(value: dict[str, Any]) -> dict[str, Any]:
+    # Decode a DynamoDB JSON attribute value in the same way as botocore,
+    # i.e. binary values become bytes.
+    if "B" in value:
+        return {"B": b64decode(value["B"])}
+    if "BS" in value:
+        return {"BS": [b64decode(v) for v in value["BS"]]}
+    if "M" in value:
+        return {"M": {k: _decode_value(v) for k, v in value["M"].items()}}
+    if "L" in value:
+        return {"L": [_decode_value(v) for v in value["L"]]}
+    return value
+
+
+def _encode_bytes(value: Any) -> str:
+    # JSON encoder fallback for binary attribute values.
+    if isinstance(value, bytes):
+        return b64encode(value).decode()
+    raise TypeError(f"Can't encode {type(value).__name__} for DynamoDB")
+
+
+def _urllib3_connection_stats(client: Any) -> Optional[dict[str, int]]:
+    # Counts of new and reused connections for a boto3 client, taken from the
+    # underlying urllib3 connection pools. These are botocore internals, so
+    # returns None if they're not as expected.
+    try:
+        pools = client._endpoint.http_session._manager.pools
+    except AttributeError:
+        return None
+
+    new = reused = 0
+    for key in pools.keys():
+        pool = pools[key]
+        new += pool.num_connections
+        reused += max(pool.num_requests - pool.num_connections, 0)
+    return {"new": new, "reused": reused}
+
+
+class LiteDynamoDbClient:
+    """A minimal DynamoDB client, implementing only what QueryHelper needs.
+
+    This supports the same API as a boto3 DynamoDB client for the query
+    parameters used by exodus-lambda, but is much cheaper to import and
+    create, and does less work per query. Requests are signed with SigV4
+    using credentials from the environment, as provided to Lambda
+    functions, and sent over a small pool of keep-alive connections.
+
+    Failed requests are not retried, other than when a pooled connection
+    turns out to have been closed by the server.
+
+    Connect and read timeouts are shortened as needed for a query to
+    complete within the deadline of the current attempt, if any.
+    """
+
+    TARGET_PREFIX = "DynamoDB_20120810"
+
+    QUERY_PARAMS = frozenset(
+        [
+            "TableName",
+            "Limit",
+            "ConsistentRead",
+            "ScanIndexForward",
+            "KeyConditionExpression",
+            "ExpressionAttributeValues",
+            "ProjectionExpression",
+            "ReturnConsumedCapacity",
+        ]
+    )
+
+    def __init__(
+        self,
+        region: str,
+        endpoint_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_pool_connections: Optional[int] = None,
+        tcp_keepalive: bool = False,
+        idle_timeout: Optional[float] = None,
+        observer: Optional[Callable[[float, Optional[str]], None]] = None,
+    ):
+        self.region = region
+        # Called with the latency and error code (if any) of each response.
+        self._observer = observer
+        url = urlsplit(
+            endpoint_url or f"https://dynamodb.{region}.amazonaws.com"
+        )
+        self._connection_class = (
+            http.client.HTTPConnection
+            if url.scheme == "http"
+            else http.client.HTTPSConnection
+        )
+        self._host = url.netloc
+        # Same defaults as botocore.
+        self._connect_timeout = connect_timeout or 60
+        self._read_timeout = read_timeout or 60
+        self._max_idle = max_pool_connections or 10
+        self._tcp_keepalive = tcp_keepalive
+        self._idle_timeout = idle_timeout
+        # Idle connections, with the time each was last used.
+        self._idle: list[tuple[http.client.HTTPConnection, float]] = []
+        self._lock = threading.Lock()
+        self._signing_keys: dict[tuple[str, str], bytes] = {}
+
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    @property
+    def connection_stats(self) -> dict[str, int]:
+        """Counts of new and reused connections used for requests."""
+        return {
+            "new": self.connections_created,
+            "reused": self.connections_reused,
+        }
+
+    def query(self, **kwargs) -> dict[str, Any]:
+        unsupported = set(kwargs) - self.QUERY_PARAMS
+        if unsupported:
+            raise TypeError(
+                "Unsupported Query parameter(s): "
+                + ", ".join(sorted(unsupported))
+            )
+
+        out = self._call("Query", kwargs)
+        out["Items"] = [
+            {name: _decode_value(value) for name, value in item.items()}
+            for item in out.get("Items") or []
+        ]
+        return out
+
+    def describe_endpoints(self) -> dict[str, Any]:
+        return self._call("DescribeEndpoints", {})
+
+    def _signing_key(self, secret_key: str, date: str) -> bytes:
+        # The signing key only changes daily, so is cached.
+        cache_key = (secret_key, date)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            key = ("AWS4" + secret_key).encode()
+            for part in (date, self.region, "dynamodb", "aws4_request"):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self._signing_keys = {cache_key: key}
+        return key
+
+    def _headers(self, target: str, payload: bytes) -> dict[str, str]:
+        # Returns headers for a request, signed using AWS Signature Version 4.
+        try:
+            access_key = os.environ["AWS_ACCESS_KEY_ID"]
+            secret_key = os.environ["AWS_SECRET_ACCESS_KEY"]
+        except KeyError:
+            raise RuntimeError(
+                "AWS credentials are not available in environment"
+            ) from None
+
+        amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+
+        headers = {
+            "content-type": "application/x-amz-json-1.0",
+            "host": self._host,
+            "x-amz-date": amz_date,
+            "x-amz-target": f"{self.TARGET_PREFIX}.{target}",
+        }
+        if token := os.environ.get("AWS_SESSION_TOKEN"):
+            headers["x-amz-security-token"] = token
+
+        signed_headers = ";".join(sorted(headers))
+        canonical_request = "\n".join(
+            [
+                "POST",
+                "/",
+                "",
+                "".join(f"{k}:{headers[k]}\n" for k in sorted(headers)),
+                signed_headers,
+                hashlib.sha256(payload).hexdigest(),
+            ]
+        )
+        scope = f"{date}/{self.region}/dynamodb/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signature = hmac.new(
+            self._signing_key(secret_key, date),
+            string_to_sign.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+
+    def _connection(self) -> tuple[http.client.HTTPConnection, bool]:
+        # Returns a connection from the pool if any, or a new one, along
+        # with whether the connection is being reused.
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if self._idle_timeout and now - last_used > self._idle_timeout:
+                    # Likely to have been closed by the server by now.
+                    conn.close()
+                    continue
+                self.connections_reused += 1
+                return conn, True
+            self.connections_created += 1
+
+        conn = self._connection_class(
+            self._host, timeout=_attempt_timeout(self._connect_timeout)
+        )
+        conn.connect()
+        assert conn.sock
+        if self._tcp_keepalive:
+            conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return conn, False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        # Return a connection to the pool, if there's room.
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _send(
+        self, payload: bytes, headers: dict[str, str]
+    ) -> tuple[int, Optional[str], bytes]:
+        # Send a request, returning the status, CRC32 header and body of the
+        # response.
+        while True:
+            conn, reused = self._connection()
+            if stats := CURRENT_REQUEST.get():
+                stats.add("attempts")
+            try:
+                assert conn.sock
+                conn.sock.settimeout(_attempt_timeout(self._read_timeout))
+                conn.request("POST", "/", body=payload, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except ConnectionError:
+                conn.close()
+                if reused:
+                    # Server closed an idle connection, try again on a
+                    # fresh one.
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+
+            return response.status, response.getheader("x-amz-crc32"), body
+
+    def _call(self, target: str, params: dict[str, Any]) -> dict[str, Any]:
+        payload = json.dumps(params, default=_encode_bytes).encode()
+        start = time.monotonic()
+        status, crc32, body = self._send(
+            payload, self._headers(target, payload)
+        )
+        latency = time.monotonic() - start
+
+        if crc32 is not None and zlib.crc32(body) != int(crc32):
+            raise DynamoDbError(
+                status, "ChecksumError", "CRC32 of response did not match"
+            )
+
+        code = None
+        if status == 200:
+            out = json.loads(body) if body else {}
+        else:
+            try:
+                out = json.loads(body) if body else {}
+            except ValueError:
+                # Not from DynamoDB, e.g. an error page from a proxy.
+                out = {}
+            code = out.get("__type", "").rsplit("#", 1)[-1] or "Unknown"
+        if self._observer:
+            self._observer(latency, code)
+        if code:
+            raise DynamoDbError(
+                status, code, out.get("message") or out.get("Message") or ""
+            )
+
+        return out
+
+
+def _query_key(params: dict[str, Any]) -> str:
+    # Key identifying equivalent queries, e.g. for matching a query to
+    # recorded queries. The ":d" value is the time of the query, and
+    # ReturnConsumedCapacity doesn't affect the items found, so they don't
+    # take part.
+    values = {
+        name: value
+        for name, value in (
+            params.get("ExpressionAttributeValues") or {}
+        ).items()
+        if name != ":d"
+    }
+    params = {
+        name: value
+        for name, value in params.items()
+        if name != "ReturnConsumedCapacity"
+    }
+    return json.dumps(
+        {**params, "ExpressionAttributeValues": values},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=_encode_bytes,
+    )
+
+
+class QueryRecorder:
+    """Appends every query made, with its outcome, to a log file.
+
+    Each line of the log is a JSON object with the region, latency in
+    seconds, parameters of the query, and either the response or error.
+    The log can be replayed by Cassette.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        # Kept open for the lifetime of the process, which is as long as
+        # there may be queries to record.
+        self._file = open(  # pylint: disable=consider-using-with
+            path, "at", encoding="utf-8"
+        )
+
+    def record(
+        self,
+        region: str,
+        latency: float,
+        params: dict[str, Any],
+        response: Optional[dict[str, Any]] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        entry: dict[str, Any] = {
+            "region": region,
+            "latency": round(latency, 6),
+            "params": params,
+        }
+        if error is not None:
+            response_meta = getattr(error, "response", None) or {}
+            entry["error"] = {
+                "status": getattr(error, "status", None)
+                or response_meta.get("ResponseMetadata", {}).get(
+                    "HTTPStatusCode", 0
+                ),
+                "code": getattr(error, "code", None)
+                or response_meta.get("Error", {}).get("Code")
+                or type(error).__name__,
+                "message": str(error),
+            }
+        else:
+            entry["response"] = {
+                key: value
+                for key, value in (response or {}).items()
+                if key != "ResponseMetadata"
+            }
+
+        line = json.dumps(entry, separators=(",", ":"), default=_encode_bytes)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+class Cassette:
+    """Queries and their outcomes as recorded by QueryRecorder.
+
+    Recorded queries are matched to new queries by their parameters,
+    ignoring the ":d" value, which is the time of the query. When the same
+    query was recorded several times, the outcomes are replayed in the
+    order recorded, with the last repeated once all have been used.
+    Outcomes recorded in the same region as the new query are preferred.
+    """
+
+    def __init__(self, entries: list[dict[str, Any]]):
+        self._lock = threading.Lock()
+        self._entries: dict[
+            tuple[str, Optional[str]], list[dict[str, Any]]
+        ] = {}
+        self._used: dict[tuple[str, Optional[str]], int] = {}
+        for entry in entries:
+            key = _query_key(entry["params"])
+            self._entries.setdefault((key, entry["region"]), []).append(entry)
+            self._entries.setdefault((key, None), []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(
+            len(entries)
+            for (_, region), entries in self._entries.items()
+            if region is None
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "Cassette":
+        with open(path, "rt", encoding="utf-8") as log:
+            return cls([json.loads(line) for line in log if line.strip()])
+
+    def next_entry(
+        self, region: str, params: dict[str, Any]
+    ) -> Optional[dict[str, Any]]:
+        """Returns the next recorded outcome for a query, or None if the
+        query wasn't recorded."""
+        key = _query_key(params)
+        for entries_key in ((key, region), (key, None)):
+            if entries := self._entries.get(entries_key):
+                with self._lock:
+                    idx = self._used.get(entries_key, 0)
+                    self._used[entries_key] = idx + 1
+                return entries[min(idx, len(entries) - 1)]
+        return None
+
+
+class ReplayDynamoDbClient:
+    """A DynamoDB client answering queries from a Cassette, without any
+    network access.
+
+    If replay_latency is true, each query takes as long as it did when
+    recorded, or raises TimeoutError if that's beyond the deadline of the
+    current attempt.
+    """
+
+    def __init__(
+        self, cassette: Cassette, region: str, replay_latency: bool = False
+    ):
+        self.cassette = cassette
+        self.region = region
+        self.replay_latency = replay_latency
+
+    def query(self, **kwargs) -> dict[str, Any]:
+        entry = self.cassette.next_entry(self.region, kwargs)
+        if entry is None:
+            raise LookupError(
+                f"No recorded response for query on {kwargs.get('TableName')}"
+            )
+
+        if self.replay_latency:
+            latency = _attempt_timeout(entry["latency"])
+            time.sleep(latency)
+            if latency < entry["latency"]:
+                raise TimeoutError("Replayed query timed out")
+
+        if error := entry.get("error"):
+            raise DynamoDbError(
+                error["status"], error["code"], error["message"]
+            )
+
+        out = dict(entry["response"])
+        out["Items"] = [
+            {name: _decode_value(value) for name, value in item.items()}
+            for item in out.get("Items") or []
+        ]
+        return out
+
+    def describe_endpoints(self) -> dict[str, Any]:
+        return {"Endpoints": []}
+
+
 class QueryHelper:
     """A helper to perform DynamoDB queries with failover between regions."""
 
-    def __init__(self, conf: dict[str, Any], endpoint_url: Optional[str]):
+    def __init__(
+        self,
+        conf: dict[str, Any],
+        endpoint_url: Optional[str],
+        local_region: Optional[str] = None,
+    ):
         self._conf = conf
         self._endpoint_url = endpoint_url
+        self._local_region = local_region
         self._clients: dict[str, Any] = {}
+        self._client_locks: dict[str, threading.Lock] = {}
+        # Regions whose client limits each query to the deadline of the
+        # current attempt by itself.
+        self._deadline_regions: set[str] = set()
+        self._lock = threading.Lock()
+        self._hedge_conf = conf.get("hedging") or {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._attempt_executor: Optional[ThreadPoolExecutor] = None
+        # Limits attempts run in _attempt_executor, so that attempts are
+        # never queued behind others which have timed out but are still
+        # running.
+        self._attempt_workers = conf.get("max_pool_connections") or 10
+        self._attempt_slots = threading.BoundedSemaphore(self._attempt_workers)
+        self._breaker_conf = conf.get("circuit_breaker") or {}
+        self._retry_conf = conf.get("retries") or {}
+        self._health: dict[str, RegionHealth] = {}
+
+        cassette_conf = conf.get("cassette") or {}
+        self._recorder: Optional[QueryRecorder] = None
+        self._cassette: Optional[Cassette] = None
+        if cassette_conf.get("mode") == "record":
+            self._recorder = QueryRecorder(cassette_conf["path"])
+        elif cassette_conf.get("mode") == "replay":
+            self._cassette = Cassette.from_file(cassette_conf["path"])
+        self._replay_latency = bool(cassette_conf.get("replay_latency"))
+        self._consumed_capacity = bool(conf.get("consumed_capacity"))
+        self._coalesce = conf.get("coalesce_queries", True)
+        self._flights = SingleFlight()
+
+        metrics_conf = conf.get("metrics") or {}
+        self.metrics: Optional[Metrics] = None
+        if metrics_conf.get("enabled"):
+            self.metrics = Metrics(
+                namespace=metrics_conf.get("namespace", "exodus-lambda"),
+                flush_interval=metrics_conf.get("flush_interval", 60),
+            )
+
+        # Totals across all requests.
+        self.hedges = 0
+
+    @contextlib.contextmanager
+    def request(
+        self, budget: Optional[float] = None
+    ) -> Iterator[RequestStats]:
+        """Context manager for handling of a single request.
+
+        Queries made within the context are accounted to the yielded
+        RequestStats.
+
+        If budget is provided, queries made within the context must complete
+        within that many seconds, or DeadlineExceeded is raised.
+        """
+        stats = RequestStats(
+            deadline=None if budget is None else time.monotonic() + budget
+        )
+        token = CURRENT_REQUEST.set(stats)
+        try:
+            yield stats
+        finally:
+            CURRENT_REQUEST.reset(token)
 
     def _client(self, region: str):
         # Return client for particular region
-        if region not in self._clients:
-            boto_config = botocore.config.Config(
-                region_name=region,
-                connect_timeout=self._conf.get("connect_timeout"),
-                read_timeout=self._conf.get("read_timeout"),
+        if client := self._clients.get(region):
+            return client
+
+        # Clients are slow to create, so each region has its own lock for
+        # that, rather than holding up everything else using self._lock.
+        with self._lock:
+            lock = self._client_locks.setdefault(region, threading.Lock())
+
+        with lock:
+            if client := self._clients.get(region):
+                return client
+
+            if self._cassette is not None:
+                self._deadline_regions.add(region)
+                client = ReplayDynamoDbClient(
+                    self._cassette, region, self._replay_latency
+                )
+            elif self._conf.get("dynamodb_client") == "lite":
+                self._deadline_regions.add(region)
+                client = LiteDynamoDbClient(
+                    region,
+                    endpoint_url=self._endpoint_url,
+                    connect_timeout=self._conf.get("connect_timeout"),
+                    read_timeout=self._conf.get("read_timeout"),
+                    max_pool_connections=self._conf.get(
+                        "max_pool_connections"
+                    ),
+                    tcp_keepalive=bool(self._conf.get("tcp_keepalive")),
+                    idle_timeout=self._conf.get("connection_idle_timeout"),
+                    observer=(
+                        functools.partial(self.metrics.record_response, region)
+                        if self.metrics
+                        else None
+                    ),
+                )
+            else:
+                client = self._boto3_client(region)
+
+            with self._lock:
+                self._clients[region] = client
+            return client
+
+    def _boto3_client(self, region: str):
+        # boto3 is only imported when needed, as importing it is a
+        # significant part of cold start time.
+        #
+        # pylint: disable=import-outside-toplevel
+        import boto3
+        import botocore.client
+        import botocore.config
+        import botocore.httpsession
+
+        retries = {}
+        if mode := self._retry_conf.get("mode"):
+            retries["mode"] = mode
+        if max_attempts := self._retry_conf.get("max_attempts"):
+            retries["total_max_attempts"] = max_attempts
+
+        # Only pass settings which are configured, leaving botocore's
+        # defaults in place otherwise.
+        optional = {
+            key: self._conf[key]
+            for key in ("max_pool_connections", "tcp_keepalive")
+            if self._conf.get(key) is not None
+        }
+
+        boto_config = botocore.config.Config(
+            region_name=region,
+            connect_timeout=self._conf.get("connect_timeout"),
+            read_timeout=self._conf.get("read_timeout"),
+            retries=retries or None,
+            **optional,
+        )
+        client = boto3.client(
+            "dynamodb",
+            endpoint_url=self._endpoint_url,
+            config=boto_config,
+        )
+        client.meta.events.register(
+            "before-send.dynamodb.Query",
+            functools.partial(self._on_before_send, region),
+        )
+        client.meta.events.register_first(
+            "needs-retry.dynamodb.Query", self._on_needs_retry
+        )
+        if self.metrics:
+            client.meta.events.register(
+                "response-received.dynamodb.Query",
+                functools.partial(self._on_response_received, region),
             )
-            self._clients[region] = boto3.client(
-                "dynamodb",
-                endpoint_url=self._endpoint_url,
-                config=boto_config,
+        if isinstance(client, botocore.client.BaseClient) and hasattr(
+            botocore.httpsession.URLLib3Session, "_get_request_timeout"
+        ):
+            # This botocore supports a per-request read timeout, which is
+            # set from the attempt deadline in _on_before_send.
+            self._deadline_regions.add(region)
+        return client
+
+    def connection_stats(self) -> dict[str, dict[str, int]]:
+        """Counts of new and reused connections for each region's client,
+        e.g. {"us-east-1": {"new": 1, "reused": 10}}."""
+        with self._lock:
+            clients = dict(self._clients)
+
+        out = {}
+        for region, client in clients.items():
+            if isinstance(client, LiteDynamoDbClient):
+                out[region] = client.connection_stats
+            elif stats := _urllib3_connection_stats(client):
+                out[region] = stats
+        return out
+
+    def prewarm(self, table_names: list[str]) -> list[threading.Thread]:
+        """Prepare for queries to the given tables in the background.
+
+        For every region of the tables, a thread is started to create the
+        client and open a connection to the DynamoDB endpoint, so that later
+        queries (including failover to secondary regions) don't have to.
+
+        Returns the started threads.
+        """
+        regions = dict.fromkeys(
+            region for table in table_names for region in self._regions(table)
+        )
+        threads = []
+        for region in regions:
+            thread = threading.Thread(
+                target=self._prewarm_region,
+                args=(region,),
+                name=f"prewarm-{region}",
+                daemon=True,
             )
+            thread.start()
+            threads.append(thread)
+        return threads
 
-        return self._clients[region]
+    def _prewarm_region(self, region: str):
+        start = time.monotonic()
+        try:
+            # Any request will do for resolving the endpoint and establishing
+            # a keep-alive connection; DescribeEndpoints is cheap and doesn't
+            # touch any tables. Its outcome doesn't matter.
+            self._client(region).describe_endpoints()
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOG.debug("Error prewarming region %s", region, exc_info=True)
+        LOG.debug(
+            "Prewarmed region %s in %.3fs", region, time.monotonic() - start
+        )
 
-    def _regions(self, table_name: str) -> list[str]:
-        # Return all AWS region(s) to be used for a specific table
-        out = None
+    def _on_before_send(self, region, request, **_kwargs):
+        # botocore hook called before sending each HTTP request, including
+        # retries, to account for attempts and backoff, and to limit the
+        # request to the deadline of the current attempt.
+        if _ATTEMPT_DEADLINE.get() is not None:
+            # Per-request read timeout, supported by newer botocore.
+            request.context["read_timeout"] = _attempt_timeout(
+                self._conf.get("read_timeout") or 60
+            )
+        retry_at = request.context.pop(_RETRY_CONTEXT_KEY, None)
+        request.context[_SENT_CONTEXT_KEY] = time.monotonic()
+        if stats := CURRENT_REQUEST.get():
+            stats.add("attempts")
+            if retry_at is not None:
+                stats.add("retries")
+                stats.add("backoff", time.monotonic() - retry_at)
+        if self.metrics and retry_at is not None:
+            self.metrics.increment("Retries", region)
+
+    def _on_response_received(
+        self, region, context, parsed_response, **_kwargs
+    ):
+        # botocore hook called after each HTTP request, including those which
+        # failed without a response, for metrics.
+        assert self.metrics
+        sent_at = context.pop(_SENT_CONTEXT_KEY)
+        if parsed_response is not None:
+            self.metrics.record_response(
+                region,
+                time.monotonic() - sent_at,
+                (parsed_response.get("Error") or {}).get("Code"),
+            )
+
+    def _on_needs_retry(self, request_dict, **_kwargs):
+        # botocore hook called after each HTTP request, before the retry
+        # handler decides whether to retry. Returning False prevents any
+        # retry, while None leaves the decision to the retry handler.
+        deadline = _ATTEMPT_DEADLINE.get()
+        if deadline is not None and time.monotonic() >= deadline:
+            # Out of time for this attempt.
+            return False
+
+        if self._retry_conf:
+            if _CAN_FAIL_OVER.get():
+                # Failing over to another region is expected to be quicker
+                # than backing off and retrying in this one.
+                return False
+
+            stats = CURRENT_REQUEST.get()
+            max_retries = self._retry_conf.get("max_per_request")
+            if stats and max_retries is not None:
+                if stats.retries >= max_retries:
+                    return False
+
+        request_dict["context"][_RETRY_CONTEXT_KEY] = time.monotonic()
+        return None
+
+    def _table_conf(self, table_name: str) -> dict[str, Any]:
+        # Return config for a specific table, if any
         for conf_key in ("table", "config_table"):
             table_conf = self._conf.get(conf_key) or {}
             if table_conf.get("name") == table_name:
-                out = table_conf.get("available_regions")
-                break
+                return table_conf
+        return {}
+
+    def _table_label(self, table_name: str) -> str:
+        # Name for a table in stats: "content" or "config" for the configured
+        # tables, otherwise the table name.
+        for conf_key, label in (
+            ("table", "content"),
+            ("config_table", "config"),
+        ):
+            if (self._conf.get(conf_key) or {}).get("name") == table_name:
+                return label
+        return table_name
+
+    def _regions(self, table_name: str) -> list[str]:
+        # Return all AWS region(s) to be used for a specific table
+        out = self._table_conf(table_name).get("available_regions")
 
         if not out:
             LOG.warning(
@@ -48,6 +900,310 @@ class QueryHelper:
 
         return out
 
+    def health(self, region: str) -> RegionHealth:
+        """Returns the RegionHealth tracking a particular region."""
+        with self._lock:
+            if region not in self._health:
+                self._health[region] = RegionHealth(
+                    region,
+                    failure_threshold=self._breaker_conf.get(
+                        "failure_threshold", 5
+                    ),
+                    cooldown=self._breaker_conf.get("cooldown", 30),
+                )
+            return self._health[region]
+
+    def _region_costs(self, regions: list[str]) -> dict[str, float]:
+        # Expected latency of a query to each region: the observed averages
+        # once every region has been observed, otherwise estimated from
+        # distance to local region. Estimates don't include time spent in
+        # DynamoDB itself, so can't be compared with observed latencies.
+        out: dict[str, float] = {}
+        for region in regions:
+            if (ewma := self.health(region).ewma) is None:
+                break
+            out[region] = ewma
+        else:
+            return out
+
+        out = {}
+        for region in regions:
+            estimate = estimated_latency(self._local_region, region)
+            out[region] = math.inf if estimate is None else estimate
+        return out
+
+    def _ordered_regions(self, table_name: str) -> list[str]:
+        # Return all region(s) for a table, in the order they should be
+        # tried.
+        regions = self._regions(table_name)
+
+        if self._conf.get("region_ordering") == "proximity":
+            # Sort is stable, so regions which can't be compared keep
+            # their configured order.
+            regions = sorted(
+                regions, key=self._region_costs(regions).__getitem__
+            )
+
+        primary = self._table_conf(table_name).get("primary_region")
+        if primary in regions:
+            regions = [primary] + [r for r in regions if r != primary]
+
+        return regions
+
+    def _available_regions(self, table_name: str) -> list[str]:
+        # Return region(s) to be used for a table right now, skipping any
+        # regions considered unhealthy. If every region is unhealthy, they're
+        # all returned since there's nothing better to do.
+        regions = self._ordered_regions(table_name)
+        available = [r for r in regions if self.health(r).available()]
+        return available or regions
+
+    def _query_region(
+        self, region: str, can_fail_over: bool, TableName: str, **kwargs
+    ):
+        # Query a table in a single region, recording the outcome.
+        health = self.health(region)
+        health.begin_query()
+        start = time.monotonic()
+        token = _CAN_FAIL_OVER.set(can_fail_over)
+        try:
+            out = self._client(region).query(TableName=TableName, **kwargs)
+        except Exception as error:
+            health.record_failure()
+            if self._recorder:
+                self._recorder.record(
+                    region,
+                    time.monotonic() - start,
+                    {"TableName": TableName, **kwargs},
+                    error=error,
+                )
+            raise
+        finally:
+            _CAN_FAIL_OVER.reset(token)
+        latency = time.monotonic() - start
+        health.record_success(latency)
+        if (capacity := out.get("ConsumedCapacity")) and (
+            stats := CURRENT_REQUEST.get()
+        ):
+            stats.add_capacity(
+                self._table_label(TableName),
+                region,
+                capacity.get("ReadCapacityUnits")
+                or capacity.get("CapacityUnits")
+                or 0,
+            )
+        if self._recorder:
+            self._recorder.record(
+                region, latency, {"TableName": TableName, **kwargs}, out
+            )
+        return out
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="query")
+            return self._executor
+
+    def _timed_query(
+        self, region: str, attempts_left: int, TableName: str, **kwargs
+    ):
+        # Query a table in a single region, within the current request's
+        # deadline if any.
+        #
+        # The remaining time is shared between this and any later attempts,
+        # so each successive attempt gets a shorter timeout, but there is
+        # always time left to fail over. An attempt which times out raises
+        # TimeoutError (or the client's equivalent), while DeadlineExceeded
+        # is raised if there's no time left at all.
+        stats = CURRENT_REQUEST.get()
+        remaining = stats.remaining() if stats else None
+        can_fail_over = attempts_left > 1
+        if remaining is None:
+            return self._query_region(
+                region, can_fail_over, TableName, **kwargs
+            )
+
+        if remaining <= 0:
+            raise DeadlineExceeded(
+                f"No time left to query table {TableName} in region {region}"
+            )
+
+        timeout = remaining / attempts_left
+        token = _ATTEMPT_DEADLINE.set(time.monotonic() + timeout)
+        try:
+            self._client(region)
+            if (
+                region in self._deadline_regions
+                or not self._attempt_slots.acquire(blocking=False)
+            ):
+                # If the client can't limit the attempt itself, it's run
+                # in another thread instead, unless too many attempts are
+                # running already. Either way, the attempt is still limited
+                # by the client's own timeouts.
+                return self._query_region(
+                    region, can_fail_over, TableName, **kwargs
+                )
+            context = contextvars.copy_context()
+        finally:
+            _ATTEMPT_DEADLINE.reset(token)
+
+        def run():
+            try:
+                # The attempt deadline in context prevents any retries
+                # once the attempt has timed out.
+                return context.run(
+                    self._query_region,
+                    region,
+                    can_fail_over,
+                    TableName,
+                    **kwargs,
+                )
+            finally:
+                self._attempt_slots.release()
+
+        future = self._get_attempt_executor().submit(run)
+        try:
+            return future.result(timeout)
+        except FuturesTimeoutError:
+            if future.cancel():
+                self._attempt_slots.release()
+            # The last attempt has all the time remaining, so if it timed
+            # out, so did the request.
+            error = TimeoutError if can_fail_over else DeadlineExceeded
+            raise error(
+                f"Query for table {TableName} in region {region} "
+                f"timed out after {timeout:.3f} seconds"
+            ) from None
+
+    def _get_attempt_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if not self._attempt_executor:
+                self._attempt_executor = ThreadPoolExecutor(
+                    max_workers=self._attempt_workers,
+                    thread_name_prefix="attempt",
+                )
+            return self._attempt_executor
+
+    def _hedge_delay(self, region: str) -> float:
+        # How long to wait on a query to region before hedging, in seconds.
+        delay = self._hedge_conf.get("delay_ms", 100) / 1000.0
+
+        percentile = self._hedge_conf.get("percentile")
+        samples = sorted(self.health(region).latencies)
+        if percentile and len(samples) >= 20:
+            idx = min(int(len(samples) * percentile / 100.0), len(samples) - 1)
+            delay = samples[idx]
+
+        return delay
+
+    def _hedged_query(self, TableName: str, **kwargs) -> dict[str, Any]:
+        # Like query, but if a region is slow to respond, the same query is
+        # also sent to the next region and whichever succeeds first is used.
+        stats = CURRENT_REQUEST.get() or RequestStats()
+        max_hedges = self._hedge_conf.get("max_per_request", 1)
+
+        executor = self._get_executor()
+
+        regions = self._available_regions(TableName)
+        next_idx = 0
+        pending: dict[Future[dict[str, Any]], str] = {}
+        output_error: Optional[BaseException] = None
+        last_region = ""
+        exhausted = False
+
+        def launch() -> bool:
+            nonlocal last_region, exhausted, next_idx
+            if next_idx >= len(regions):
+                exhausted = True
+                return False
+            region = regions[next_idx]
+            next_idx += 1
+            can_fail_over = next_idx < len(regions)
+            context = contextvars.copy_context()
+            future = executor.submit(
+                lambda: context.run(
+                    self._query_region,
+                    region,
+                    can_fail_over,
+                    TableName,
+                    **kwargs,
+                )
+            )
+            pending[future] = region
+            last_region = region
+            return True
+
+        launch()
+        while pending:
+            timeout = None
+            if not exhausted and stats.hedges < max_hedges:
+                timeout = self._hedge_delay(last_region)
+
+            remaining = stats.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise DeadlineExceeded(
+                        f"Query for table {TableName} did not complete "
+                        "before deadline"
+                    ) from output_error
+                timeout = min(timeout or remaining, remaining)
+
+            done, _ = wait(
+                pending, timeout=timeout, return_when=FIRST_COMPLETED
+            )
+
+            remaining = stats.remaining()
+            if not done and (remaining is None or remaining > 0):
+                # Nothing came back in time, hedge to the next region if any.
+                if launch():
+                    stats.add("hedges")
+                    with self._lock:
+                        self.hedges += 1
+                    if self.metrics:
+                        self.metrics.increment("Hedges", last_region)
+                    LOG.info(
+                        "Hedging query for table %s to region %s",
+                        TableName,
+                        last_region,
+                    )
+                continue
+
+            for future in done:
+                region = pending.pop(future)
+                try:
+                    out = future.result()
+                except (
+                    Exception  # pylint: disable=broad-exception-caught
+                ) as error:
+                    LOG.warning(
+                        "Error querying table %s in region %s",
+                        TableName,
+                        region,
+                        exc_info=True,
+                    )
+                    error.__cause__ = output_error
+                    output_error = error
+                    if not pending:
+                        launch()
+                    continue
+
+                if output_error:
+                    LOG.warning(
+                        (
+                            "Failover: query for table %s succeeded in region "
+                            "%s after prior errors"
+                        ),
+                        TableName,
+                        region,
+                    )
+                    if self.metrics:
+                        self.metrics.increment("Failovers", region)
+                return out
+
+        # If we get here, every region failed.
+        assert output_error
+        raise output_error
+
     def query(self, TableName: str, **kwargs) -> dict[str, Any]:
         """Query items from a table.
 
@@ -56,12 +1212,95 @@ class QueryHelper:
 
         ...but it will issue the query across *all* configured regions
         for that table, in the order listed, until no error occurs.
+
+        If region_ordering is "proximity", regions are instead tried in
+        order of expected latency: estimated from distance to the local
+        region at first, then from a moving average of observed query
+        latencies. A table's primary_region, if any, is always tried first.
+
+        Regions which have recently failed repeatedly are skipped for a
+        cooldown period, unless no other regions are available.
+
+        If hedging is enabled, a query which hasn't completed within the
+        hedging delay is also sent to the next region, and the first
+        successful response is used.
+
+        Queries are made using boto3, or LiteDynamoDbClient if
+        dynamodb_client is "lite". If cassette mode is "record", every
+        query is also logged to the cassette file; if "replay", queries are
+        instead answered from that file.
+
+        Within a request() with a budget, each attempt is limited to a share
+        of the remaining time, and DeadlineExceeded is raised if the query
+        can't be completed in time.
+
+        If a retry policy is configured, botocore only retries a query
+        within a region if there's no other region to fail over to, and up
+        to max_per_request times within a request.
+
+        If consumed_capacity is enabled, read capacity units consumed by
+        each query are added to the current request's stats.
+
+        If metrics are enabled, the latency of each request to DynamoDB and
+        counts of retries, throttles and failovers are recorded in metrics.
+
+        Unless coalesce_queries is false, concurrent identical queries from
+        different threads are coalesced into one, whose result is shared.
         """
-        output_error: Optional[BaseException] = None
+        if stats := CURRENT_REQUEST.get():
+            stats.add("queries")
+
+        if self._consumed_capacity:
+            kwargs.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+        if not self._coalesce:
+            return self._query(TableName, **kwargs)
+
+        key = _query_key({"TableName": TableName, **kwargs})
+        out, shared = self.coalesce(
+            key, lambda: self._query(TableName, **kwargs)
+        )
+        if shared and stats:
+            stats.add("coalesced")
+        return out
+
+    def coalesce(
+        self, key: Hashable, fn: Callable[[], Any]
+    ) -> tuple[Any, bool]:
+        """Call fn, or if a call with the same key is already in progress
+        in another thread, wait for that call and share its outcome.
+
+        Returns the outcome along with whether it was shared.
+
+        Within a request() with a budget, waits no longer than the time
+        remaining, raising DeadlineExceeded if the call in progress doesn't
+        complete in time.
+
+        A call in progress which fails by running out of time is made
+        again rather than shared, as it may have been limited by the
+        deadline of another request.
+        """
+        stats = CURRENT_REQUEST.get()
+        try:
+            return self._flights.do(
+                key,
+                fn,
+                timeout=stats.remaining() if stats else None,
+                retry_on=(DeadlineExceeded, TimeoutError),
+            )
+        except WaitTimeout:
+            raise DeadlineExceeded(
+                "Identical call in progress did not complete before deadline"
+            ) from None
+
+    def _query(self, TableName: str, **kwargs) -> dict[str, Any]:
+        if self._hedge_conf.get("enabled"):
+            return self._hedged_query(TableName, **kwargs)
 
-        for region in self._regions(TableName):
-            client = self._client(region)
+        output_error: Optional[BaseException] = None
 
+        regions = self._available_regions(TableName)
+        for idx, region in enumerate(regions):
             # Should we fail over only in case of error or also in case of
             # missing items?
             #
@@ -78,17 +1317,13 @@ class QueryHelper:
             #
 
             try:
-                out = client.query(TableName=TableName, **kwargs)
-                if output_error:
-                    LOG.warning(
-                        (
-                            "Failover: query for table %s succeeded in region "
-                            "%s after prior errors"
-                        ),
-                        TableName,
-                        region,
-                    )
-                return out
+                out = self._timed_query(
+                    region, len(regions) - idx, TableName, **kwargs
+                )
+            except DeadlineExceeded as error:
+                # Out of time, so no point trying other regions.
+                error.__cause__ = output_error
+                raise
             except (
                 Exception  # pylint: disable=broad-exception-caught
             ) as error:
@@ -102,7 +1337,26 @@ class QueryHelper:
                 # are lost
                 error.__cause__ = output_error
                 output_error = error
+            else:
+                if output_error:
+                    LOG.warning(
+                        (
+                            "Failover: query for table %s succeeded in region "
+                            "%s after prior errors"
+                        ),
+                        TableName,
+                        region,
+                    )
+                    if self.metrics:
+                        self.metrics.increment("Failovers", region)
+                return out
 
         # If we get here, every region failed.
         assert output_error
+        stats = CURRENT_REQUEST.get()
+        remaining = stats.remaining() if stats else None
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(
+                f"Query for table {TableName} did not complete before deadline"
+            ) from output_error
         raise output_error
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+LOG = logging.getLogger("exodus_lambda")
+
+
+class RegionHealth:
+    """Tracks the health of a single region, acting as a circuit breaker.
+
+    The breaker starts "closed" (the region is used normally). After
+    failure_threshold consecutive failed queries it "opens", and the region
+    should be skipped. Once cooldown seconds have passed the breaker is
+    "half-open": a single probe query is let through, which closes the
+    breaker on success or reopens it for another cooldown on failure.
+
+    An exponentially weighted moving average of successful query latencies
+    is also kept, for ordering regions by observed performance.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    # Weight of the most recent latency in the moving average.
+    EWMA_ALPHA = 0.2
+
+    def __init__(
+        self,
+        region: str,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        timer=time.monotonic,
+    ):
+        self.region = region
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.ewma: Optional[float] = None
+        self._opened_at = 0.0
+        self._timer = timer
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """True if the region should be queried now: the breaker is closed,
+        or its cooldown has expired and a probe may be sent.
+
+        This doesn't change the state of the breaker; see begin_query.
+        """
+        with self._lock:
+            return (
+                self.state == self.CLOSED
+                or self._timer() - self._opened_at >= self.cooldown
+            )
+
+    def begin_query(self) -> None:
+        """Called when a query is about to be sent to the region.
+
+        If the cooldown of an open breaker has expired, the query is the
+        probe: the breaker becomes half-open, and further probes are only
+        allowed once per cooldown period until one succeeds.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            now = self._timer()
+            if now - self._opened_at >= self.cooldown:
+                LOG.info("Probing region %s after cooldown", self.region)
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            if self.ewma is None:
+                self.ewma = latency
+            else:
+                self.ewma += self.EWMA_ALPHA * (latency - self.ewma)
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                LOG.warning("Region %s has recovered", self.region)
+                self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED
+                and self.failure_threshold
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                LOG.warning(
+                    "Region %s is unhealthy after %s consecutive failures, "
+                    "skipping for %s seconds",
+                    self.region,
+                    self.consecutive_failures,
+                    self.cooldown,
+                )
+                self.state = self.OPEN
+                self._opened_at = self._timer()
@@ -15,6 +15,10 @@ class JsonFormatter(logging.Formatter):
             "request": "request",
             "response": "response",
         }
+        # Fields only included when set on the record.
+        self.optional_fmt = {
+            "consumed-capacity": "consumed_capacity",
+        }
         self.datefmt = datefmt
 
     # Appended '_' on 'converter' because mypy doesn't approve of
@@ -35,7 +39,14 @@ class JsonFormatter(logging.Formatter):
         return s
 
     def formatMessage(self, record):
-        return {k: record.__dict__.get(v) for k, v in self.fmt.items()}
+        out = {k: record.__dict__.get(v) for k, v in self.fmt.items()}
+        for key, attr in self.optional_fmt.items():
+            if attr in record.__dict__:
+                out[key] = record.__dict__[attr]
+        # Embedded Metric Format documents are merged in at the top level,
+        # as CloudWatch expects.
+        out.update(record.__dict__.get("emf") or {})
+        return out
 
     def format(self, record):
         record.message = record.getMessage()
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# Error codes returned by DynamoDB when requests are throttled.
+THROTTLE_CODES = frozenset(
+    [
+        "ThrottlingException",
+        "ProvisionedThroughputExceededException",
+        "RequestLimitExceeded",
+    ]
+)
+
+# Counters kept for each region.
+COUNTERS = (
+    "Retries",
+    "Throttles",
+    "Failovers",
+    "Hedges",
+    "ConfigRefreshFailures",
+    "NegativeCacheHits",
+    "NegativeCacheMisses",
+    "UriCacheHits",
+    "UriCacheMisses",
+)
+
+
+class Metrics:
+    """Metrics on DynamoDB requests and caches, by region, for output in CloudWatch
+    Embedded Metric Format (EMF).
+
+    The latency of every HTTP request to DynamoDB is recorded, along with
+    counts of retries, throttled requests, queries which succeeded after
+    failing over from another region and queries hedged to a region.
+    Failed attempts to load config and hits and misses of the negative and
+    candidate URI caches are counted against the local region. flush() returns the metrics recorded
+    since the last flush as one EMF document per region, which becomes a
+    metric in CloudWatch once logged as a JSON line.
+    """
+
+    # EMF allows at most this many values for a single metric.
+    MAX_VALUES = 100
+
+    def __init__(
+        self,
+        namespace: str = "exodus-lambda",
+        flush_interval: float = 60.0,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.namespace = namespace
+        self.flush_interval = flush_interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._last_flush = timer()
+        self._latencies: dict[str, list[float]] = {}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    def record_latency(self, region: str, latency: float):
+        """Record the latency, in seconds, of a request to a region."""
+        with self._lock:
+            # EMF latency is in milliseconds; finer precision isn't useful.
+            self._latencies.setdefault(region, []).append(
+                round(latency * 1000, 1)
+            )
+
+    def record_response(
+        self, region: str, latency: float, error_code: Optional[str] = None
+    ):
+        """Record a response from a region, with its error code if any."""
+        self.record_latency(region, latency)
+        if error_code in THROTTLE_CODES:
+            self.increment("Throttles", region)
+
+    def increment(self, name: str, region: str, value: int = 1):
+        with self._lock:
+            counters = self._counters.setdefault(region, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def due(self) -> bool:
+        """True if metrics should be flushed now: either the flush interval
+        has passed or there are as many latency values as can be output at
+        once."""
+        with self._lock:
+            if not self._latencies and not self._counters:
+                return False
+            if self._timer() - self._last_flush >= self.flush_interval:
+                return True
+            return any(
+                len(values) >= self.MAX_VALUES
+                for values in self._latencies.values()
+            )
+
+    def flush(self) -> list[dict[str, Any]]:
+        """Returns EMF documents for all metrics recorded since the last
+        flush, and starts over."""
+        with self._lock:
+            latencies, self._latencies = self._latencies, {}
+            counters, self._counters = self._counters, {}
+            self._last_flush = self._timer()
+
+        timestamp = int(time.time() * 1000)
+        out = []
+        for region in sorted(set(latencies) | set(counters)):
+            values = latencies.get(region) or []
+            region_counters = counters.get(region) or {}
+            # Any latency values beyond what fits in one document are
+            # output in further documents.
+            for start in range(0, max(len(values), 1), self.MAX_VALUES):
+                doc: dict[str, Any] = {"Region": region}
+                definitions = []
+                if chunk := values[start : start + self.MAX_VALUES]:
+                    doc["Latency"] = chunk
+                    definitions.append(
+                        {"Name": "Latency", "Unit": "Milliseconds"}
+                    )
+                if start == 0:
+                    for name in COUNTERS:
+                        doc[name] = region_counters.get(name, 0)
+                        definitions.append({"Name": name, "Unit": "Count"})
+                doc["_aws"] = {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Region"]],
+                            "Metrics": definitions,
+                        }
+                    ],
+                }
+                out.append(doc)
+        return out
@@ -1,18 +1,32 @@
 import binascii
+import contextvars
 import functools
-import gzip
 import json
+import logging
 import os
+import random
 import re
+import threading
 import time
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from urllib.parse import parse_qs, unquote, urlencode
 
 import cachetools
 
-from .base import LambdaBase
-from .db import QueryHelper
+from .alias import AliasIndex
+from .backend import DynamoDbBackend
+from .base import MUTABLE_PATH_PATTERNS, LambdaBase
+from .cache import LRUCache, TLRUCache, TTLCache
+from .config import (
+    ConfigSnapshot,
+    decode_config,
+    read_config_file,
+    write_config_file,
+)
+from .db import DeadlineExceeded, QueryHelper
+from .snapshot import Snapshot, SnapshotBackend
 
 CONF_FILE = os.environ.get("EXODUS_LAMBDA_CONF_FILE") or "lambda_config.json"
 
@@ -22,6 +36,22 @@ CONF_FILE = os.environ.get("EXODUS_LAMBDA_CONF_FILE") or "lambda_config.json"
 # this code against localstack.
 ENDPOINT_URL = os.environ.get("EXODUS_AWS_ENDPOINT_URL") or None
 
+# Key identifying a synthetic warm-up event, e.g. {"exodus-warmup": true}.
+WARMUP_EVENT_KEY = "exodus-warmup"
+
+# Maximum number of items waiting to be added to the item cache. Items
+# found while this many are waiting are not cached.
+MAX_PENDING_ITEM_CACHE_FILLS = 100
+
+
+def parse_date(value):
+    # Parse a from_date value from the table. Dates without an explicit
+    # timezone are in UTC.
+    out = datetime.fromisoformat(value)
+    if out.tzinfo is None:
+        out = out.replace(tzinfo=timezone.utc)
+    return out
+
 
 def cf_b64decode(data):
     return b64decode(
@@ -30,123 +60,372 @@ def cf_b64decode(data):
 
 
 class OriginRequest(LambdaBase):
-    def __init__(self, conf_file=CONF_FILE):
+    def __init__(self, conf_file=CONF_FILE, backend=None):
         super().__init__("origin-request", conf_file)
         self._sm_client = None
+        config_refresh = self.conf.get("config_refresh") or {}
+        # Each instance uses a slightly different TTL, so that instances
+        # started together don't all refresh config at the same time.
+        self._config_ttl = timedelta(
+            minutes=self.conf.get("config_cache_ttl", 2)
+        ).total_seconds() * (
+            1 - random.uniform(0, config_refresh.get("jitter", 0))  # nosec
+        )
+        self._config_max_stale = config_refresh.get("max_stale", 0)
+        self._config_stale_if_error = config_refresh.get(
+            "stale_if_error", True
+        )
+        self._config_backoff = (
+            config_refresh.get("retry_backoff", 1),
+            config_refresh.get("max_retry_backoff", 60),
+        )
+        self._config_failures = 0
+        self._config_retry_at = 0.0
+        self._config_loaded = None
+        self._config_from_date = None
+        self._config_seeded = False
+        self._config_refresh = None
+        self._config_refresh_lock = threading.Lock()
         self._cache = cachetools.TTLCache(
-            maxsize=1,
-            ttl=timedelta(
-                minutes=self.conf.get("config_cache_ttl", 2)
-            ).total_seconds(),
+            maxsize=1, ttl=self._config_ttl, timer=time.monotonic
+        )
+        self._db = QueryHelper(
+            self.conf, ENDPOINT_URL, local_region=os.environ.get("AWS_REGION")
+        )
+        self._backend = (
+            backend if backend is not None else DynamoDbBackend(self._db)
+        )
+        if snapshot_file := self.conf.get("snapshot_file"):
+            self._backend = self._snapshot_backend(snapshot_file)
+        self._config = None
+        self._config_lock = threading.Lock()
+        self._metrics_logger = None
+        self._uri_plans = LRUCache(
+            maxsize=self.conf.get("uri_cache_size", 1024)
+        )
+        self._seed_definitions()
+        self._negative_cache = TTLCache(
+            maxsize=(
+                self.conf.get("negative_cache_size", 10000)
+                if self.conf.get("negative_cache_ttl")
+                else 0
+            ),
+            ttl=self.conf.get("negative_cache_ttl") or 0,
+            timer=time.monotonic,
+        )
+        item_cache_conf = self.conf.get("item_cache") or {}
+        self._item_cache = TLRUCache(
+            maxsize=(
+                item_cache_conf.get("maxsize", 10000)
+                if item_cache_conf.get("ttl")
+                else 0
+            ),
+            ttu=lambda _key, value, _now: value[2],
             timer=time.monotonic,
         )
-        self._db = QueryHelper(self.conf, ENDPOINT_URL)
-        self.handler = self.__wrap_version_check(self.handler)
+        # Mutable paths such as repo entry points are not cached unless
+        # explicitly configured otherwise.
+        self._item_cache_rules = [
+            (re.compile(rule["pattern"]), rule["ttl"])
+            for rule in item_cache_conf.get("path_ttl") or []
+        ] + [(re.compile(pattern), 0) for pattern in MUTABLE_PATH_PATTERNS]
+        # Items are added to the cache in the background, as that needs
+        # another query which responses shouldn't have to wait for.
+        self._item_cache_fills = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="item-cache")
+            if self._item_cache.maxsize
+            else None
+        )
+        self._item_cache_pending = set()
+        self._item_cache_lock = threading.Lock()
+        self._executor = None
+        if self.conf.get("concurrent_lookups"):
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.conf.get("max_lookup_workers", 8),
+                thread_name_prefix="lookup",
+            )
+        self.handler = self.__wrap_warmup(
+            self.__wrap_version_check(self.__wrap_request_stats(self.handler))
+        )
+        self._prewarm_threads = []
+        if self.conf.get("prewarm"):
+            # Get going on this while the Lambda is still initializing.
+            self._prewarm_threads = self._db.prewarm(
+                [self.conf["table"]["name"], self.conf["config_table"]["name"]]
+            )
+
+    def _seed_definitions(self):
+        # Until config has been loaded from the table, use config saved by
+        # an earlier instance in the same sandbox or bundled with the
+        # package, whichever is newer.
+        seeds = []
+        for path in (
+            self.conf.get("config_cache_file"),
+            self.conf.get("config_seed_file"),
+        ):
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                definitions, from_date = read_config_file(path)
+            except (OSError, ValueError):
+                self.logger.warning(
+                    "Can't load config from %s, not using it",
+                    path,
+                    exc_info=True,
+                )
+                continue
+            seeds.append((from_date or "", path, definitions))
+
+        if seeds:
+            from_date, path, definitions = max(seeds, key=lambda s: s[0])
+            self.logger.info(
+                "Using config from %s (from_date %s) until config is loaded",
+                path,
+                from_date or "unknown",
+            )
+            self._compile_config(definitions)
+            self._config_loaded = (definitions, time.monotonic())
+            self._config_from_date = from_date or None
+            self._config_seeded = True
+
+    def _snapshot_backend(self, snapshot_file):
+        # Returns the backend wrapped to look in the snapshot first, or
+        # unchanged if the snapshot can't be used.
+        try:
+            snapshot = Snapshot(snapshot_file)
+        except (OSError, ValueError):
+            self.logger.warning(
+                "Can't load snapshot %s, not using it",
+                snapshot_file,
+                exc_info=True,
+            )
+            return self._backend
+
+        self.logger.info(
+            "Loaded snapshot %s with %s items", snapshot_file, len(snapshot)
+        )
+        return SnapshotBackend(
+            snapshot, self._backend, self.conf["table"]["name"]
+        )
 
     @property
     def definitions(self):
         out = self._cache.get("exodus-config")
         if out is None:
-            table = self.conf["config_table"]["name"]
-
-            query_result = self._db.query(
-                TableName=table,
-                Limit=1,
-                ScanIndexForward=False,
-                KeyConditionExpression="config_id = :id and from_date <= :d",
-                ExpressionAttributeValues={
-                    ":id": {"S": "exodus-config"},
-                    ":d": {
-                        "S": str(
-                            datetime.now(timezone.utc).isoformat(
-                                timespec="milliseconds"
-                            )
-                        )
-                    },
-                },
+            out = self._stale_definitions()
+        if out is None and self._config_stale_if_error:
+            out = self._backoff_definitions()
+        if out is None:
+            try:
+                # If several threads find the config expired at once, only
+                # one of them loads it.
+                out, _ = self._db.coalesce(
+                    "exodus-config", self._load_definitions
+                )
+            except Exception:  # pylint: disable=broad-except
+                if not self._config_stale_if_error or (
+                    self._config_loaded is None
+                ):
+                    raise
+                out, loaded_at = self._config_loaded
+                self.logger.warning(
+                    "Using last loaded config from %.0f seconds ago",
+                    time.monotonic() - loaded_at,
+                )
+        return out
+
+    def _backoff_definitions(self):
+        # Returns the last loaded config if config shouldn't be loaded yet
+        # due to recent failures, else None.
+        if self._config_loaded is None:
+            return None
+        if time.monotonic() >= self._config_retry_at:
+            return None
+        self.logger.debug("Config expired, using last loaded config")
+        return self._config_loaded[0]
+
+    def _stale_definitions(self):
+        # Returns the last loaded config if it's expired by no more than
+        # max_stale, or is seed config, making sure a refresh is running in
+        # the background. Returns None if a stale config can't be used.
+        if self._config_loaded is None:
+            return None
+
+        out, loaded_at = self._config_loaded
+        now = time.monotonic()
+        if not self._config_seeded and (
+            not self._config_max_stale
+            or now - loaded_at > self._config_ttl + self._config_max_stale
+        ):
+            return None
+
+        with self._config_refresh_lock:
+            if now >= self._config_retry_at and (
+                self._config_refresh is None
+                or not self._config_refresh.is_alive()
+            ):
+                self.logger.debug("Config expired, refreshing in background")
+                self._config_refresh = threading.Thread(
+                    target=self._refresh_definitions,
+                    name="config-refresh",
+                    daemon=True,
+                )
+                self._config_refresh.start()
+        return out
+
+    def _refresh_definitions(self):
+        try:
+            self._db.coalesce("exodus-config", self._load_definitions)
+        except Exception:  # pylint: disable=broad-except
+            # Already logged by _load_definitions.
+            pass
+
+    def _load_definitions(self):
+        try:
+            out, from_date = self._query_definitions()
+            # Compiled before the config is made available, so that
+            # requests never have to.
+            self._compile_config(out)
+        except Exception:  # pylint: disable=broad-except
+            self._config_failures += 1
+            initial, maximum = self._config_backoff
+            backoff = min(initial * 2 ** (self._config_failures - 1), maximum)
+            self._config_retry_at = time.monotonic() + backoff
+            self.logger.warning(
+                "Failed to load config (%s consecutive failures), "
+                "next attempt in %s seconds",
+                self._config_failures,
+                backoff,
+                exc_info=True,
             )
-            if query_result["Items"]:
-                item = query_result["Items"][0]
-                if item_bytes := item["config"].get("B"):
-                    # new-style: config is compressed and stored as bytes
-                    item_json = gzip.decompress(item_bytes).decode()
-                else:
-                    # old-style, config was stored as JSON string.
-                    # Consider deleting this code path in 2025
-                    item_json = item["config"]["S"]
-                out = json.loads(item_json)
-            else:
-                # Provide dict with expected keys when no config is found.
-                out = {
-                    "origin_alias": [],
-                    "rhui_alias": [],
-                    "releasever_alias": [],
-                    "listing": {},
-                }
+            self._count("ConfigRefreshFailures")
+            raise
 
-            self._cache["exodus-config"] = out
+        if self._config_loaded is None or out is not self._config_loaded[0]:
+            self._save_definitions(out, from_date)
 
+        self._config_failures = 0
+        self._cache["exodus-config"] = out
+        self._config_loaded = (out, time.monotonic())
+        self._config_from_date = from_date
+        self._config_seeded = False
         return out
 
+    def _save_definitions(self, definitions, from_date):
+        # Save newly loaded config for use by later instances until they've
+        # loaded config themselves.
+        if path := self.conf.get("config_cache_file"):
+            try:
+                write_config_file(path, definitions, from_date)
+            except OSError:
+                self.logger.warning(
+                    "Can't save config to %s", path, exc_info=True
+                )
+
+    def _query_definitions(self):
+        # Returns the config in effect now, and its from_date.
+        table = self.conf["config_table"]["name"]
+        now = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+        if self._config_loaded is not None:
+            # Config rarely changes, so check whether it has before fetching
+            # and parsing the whole thing. If it hasn't, the loaded config is
+            # kept as is, along with everything derived from it.
+            from_date = self._backend.latest_config_date(
+                table, "exodus-config", now
+            )
+            if from_date == self._config_from_date:
+                self.logger.debug("Config unchanged since %s", from_date)
+                return self._config_loaded[0], from_date
+
+        item = self._backend.latest_config(table, "exodus-config", now)
+        from_date = item["from_date"]["S"] if item else None
+        return decode_config(item), from_date
+
+    @property
+    def metrics_logger(self):
+        # Logger for metrics, which are only logged when enabled in config
+        # and so are output at INFO level even if the main logger is set
+        # to a higher level, unless a level is configured for this logger.
+        if not self._metrics_logger:
+            logger = logging.getLogger(f"{self.logger.name}.metrics")
+            if logger.level == logging.NOTSET:
+                logger.setLevel(logging.INFO)
+            self._metrics_logger = logger
+        return self._metrics_logger
+
+    def _count(self, name):
+        # Increment a counter in metrics, if enabled, against the local
+        # region.
+        if metrics := self._db.metrics:
+            metrics.increment(name, os.environ.get("AWS_REGION", "unknown"))
+
+    def _compile_config(self, definitions):
+        # Make a ConfigSnapshot of newly loaded definitions the current
+        # config, unless it already is. Each loaded config is a new
+        # 'generation'.
+        with self._config_lock:
+            config = self._config
+            if config is None or config.definitions is not definitions:
+                config = ConfigSnapshot(
+                    definitions, config.generation + 1 if config else 1
+                )
+                self._uri_plans.clear()
+                self._config = config
+            return config
+
+    @property
+    def config(self):
+        # The current config as a ConfigSnapshot, as compiled when the
+        # definitions were loaded.
+        definitions = self.definitions
+        config = self._config
+        if config is None or config.definitions is not definitions:
+            # Only for definitions which didn't come from the loader, such
+            # as those put in the cache directly.
+            config = self._compile_config(definitions)
+        return config
+
+    @property
+    def generation(self):
+        return self.config.generation
+
+    @property
+    def aliases(self):
+        return self.config.aliases
+
     def uri_alias(self, uri, aliases, ignore_exclusions=False):
         # Resolve every alias between paths within the uri (e.g.
         # allow RHUI paths to be aliased to non-RHUI).
         #
-        # Aliases are expected to come from cdn-definitions.
-
-        remaining = aliases
-
-        # We do multiple passes here to ensure that nested aliases
-        # are resolved correctly, regardless of the order in which
-        # they're provided.
-        while remaining:
-            processed = []
-
-            for alias in remaining:
-                exclusion_match = not ignore_exclusions and any(
-                    [
-                        re.search(exclusion, uri)
-                        for exclusion in alias.get("exclude_paths", [])
-                    ]
-                )
-                if (
-                    uri.startswith(alias["src"] + "/") or uri == alias["src"]
-                ) and not exclusion_match:
-                    uri = uri.replace(alias["src"], alias["dest"], 1)
-                    processed.append(alias)
-
-            if not processed:
-                # We didn't resolve any alias, then we're done processing.
-                break
+        # Aliases are expected to come from cdn-definitions, either as
+        # a raw list or already compiled into an AliasIndex.
+        if not isinstance(aliases, AliasIndex):
+            aliases = AliasIndex(aliases)
 
-            # We resolved at least one alias, so we need another round
-            # in case others apply now. But take out anything we've already
-            # processed, so it is not possible to recurse.
-            remaining = [r for r in remaining if r not in processed]
-
-        return uri
+        return aliases.resolve(uri, ignore_exclusions)
 
     def resolve_aliases(
-        self, uri, ignore_exclusions=False, ignore_releasever=False
+        self,
+        uri,
+        ignore_exclusions=False,
+        ignore_releasever=False,
+        config=None,
     ):
+        aliases = (config or self.config).aliases
+
         # aliases relating to origin, e.g. content/origin <=> origin
-        uri = self.uri_alias(
-            uri, self.definitions.get("origin_alias"), ignore_exclusions
-        )
+        uri = self.uri_alias(uri, aliases["origin_alias"], ignore_exclusions)
 
         # aliases relating to rhui; listing files are a special exemption
         # because they must be allowed to differ for rhui vs non-rhui.
         if not uri.endswith("/listing"):
-            uri = self.uri_alias(
-                uri, self.definitions.get("rhui_alias"), ignore_exclusions
-            )
+            uri = self.uri_alias(uri, aliases["rhui_alias"], ignore_exclusions)
 
         # aliases relating to releasever; e.g. /content/dist/rhel8/8 <=> /content/dist/rhel8/8.5
         if not ignore_releasever:
             uri = self.uri_alias(
-                uri,
-                self.definitions.get("releasever_alias"),
-                ignore_exclusions,
+                uri, aliases["releasever_alias"], ignore_exclusions
             )
 
         self.logger.debug("Resolved request URI: %s", uri)
@@ -194,16 +473,15 @@ class OriginRequest(LambdaBase):
         )
         return response
 
-    def handle_listing_request(self, uri):
+    def handle_listing_request(self, uri, config=None):
         if uri.endswith("/listing"):
             self.logger.info("Handling listing request: %s", uri)
-            listing_data = self.definitions.get("listing")
-            if listing_data:
-                target = uri[: -len("/listing")]
-                listing = listing_data.get(target)
-                if listing:
+            config = config or self.config
+            if config.listings:
+                body = config.listing(uri[: -len("/listing")])
+                if body is not None:
                     response = {
-                        "body": "\n".join(listing["values"]) + "\n",
+                        "body": body,
                         "status": "200",
                         "statusDescription": "OK",
                         "headers": {
@@ -223,6 +501,115 @@ class OriginRequest(LambdaBase):
 
         return {}
 
+    def request_budget(self, context):
+        # Returns the time, in seconds, within which a request must be
+        # handled, or None if unlimited.
+        #
+        # This is the smaller of the configured budget and the time
+        # remaining before the Lambda would be terminated, minus a margin
+        # to allow for returning an error response.
+        budgets = []
+        if budget_ms := self.conf.get("request_budget_ms"):
+            budgets.append(budget_ms)
+        if remaining := getattr(context, "get_remaining_time_in_millis", None):
+            budgets.append(
+                remaining() - self.conf.get("deadline_margin_ms", 200)
+            )
+        return min(budgets) / 1000.0 if budgets else None
+
+    def __wrap_warmup(self, handler):
+        # Decorator wrapping every request to handle synthetic warm-up events,
+        # which may be sent to get an instance of the Lambda ready to serve
+        # requests. These load the config and wait for any prewarming to
+        # complete, then return without handling any request.
+
+        @functools.wraps(handler)
+        def new_handler(event, context):
+            if not event.get(WARMUP_EVENT_KEY):
+                return handler(event, context)
+
+            start = time.monotonic()
+            for thread in self._prewarm_threads:
+                thread.join()
+            generation = self.generation
+            self.logger.info(
+                "Warmed up in %.3fs (config generation %s)",
+                time.monotonic() - start,
+                generation,
+            )
+            return {"status": "200", "statusDescription": "OK"}
+
+        return new_handler
+
+    def __wrap_request_stats(self, handler):
+        # Decorator wrapping every request to account for the queries made
+        # while handling it.
+
+        @functools.wraps(handler)
+        def new_handler(event, context):
+            # The handler may rewrite the request's uri.
+            uri = event["Records"][0]["cf"]["request"]["uri"]
+            with self._db.request(self.request_budget(context)) as stats:
+                try:
+                    response = handler(event, context)
+                except DeadlineExceeded:
+                    self.logger.warning(
+                        "Request deadline exceeded, returning 503",
+                        exc_info=True,
+                    )
+                    response = {
+                        "status": "503",
+                        "statusDescription": "Service Unavailable",
+                        "headers": {
+                            "cache-control": [
+                                {"key": "Cache-Control", "value": "no-store"}
+                            ]
+                        },
+                    }
+
+            if stats.queries:
+                extra = {}
+                logger, level = self.logger, logging.DEBUG
+                if self._db.metrics or self.conf.get("consumed_capacity"):
+                    # Logged with enough detail to attribute the cost of
+                    # queries to the requests which needed them.
+                    logger, level = self.metrics_logger, logging.INFO
+                    extra = {
+                        "request": {"uri": uri},
+                        "response": {"status": response.get("status")},
+                    }
+                    if self.conf.get("consumed_capacity"):
+                        extra["consumed_capacity"] = stats.consumed_capacity
+                logger.log(
+                    level,
+                    (
+                        "Request used %s queries (%s attempts, %s retries, "
+                        "%.3fs backoff, %s hedged, %s total hedges)"
+                    ),
+                    stats.queries,
+                    stats.attempts,
+                    stats.retries,
+                    stats.backoff,
+                    stats.hedges,
+                    self._db.hedges,
+                    extra=extra,
+                )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(
+                        "DynamoDB connections: %s",
+                        self._db.connection_stats(),
+                    )
+
+            if (metrics := self._db.metrics) and metrics.due():
+                for doc in metrics.flush():
+                    self.metrics_logger.info(
+                        "DynamoDB metrics", extra={"emf": doc}
+                    )
+
+            return response
+
+        return new_handler
+
     def __wrap_version_check(self, handler):
         # Decorator wrapping every request to add x-exodus-version on responses
         # which generated directly without going to origin-response.
@@ -241,71 +628,173 @@ class OriginRequest(LambdaBase):
 
         return new_handler
 
-    def response_from_db(self, request, table, uri):
+    def _item_cache_ttl(self, uri):
+        # How long, in seconds, an item for this URI may be cached.
+        for pattern, ttl in self._item_cache_rules:
+            if pattern.match(uri):
+                return ttl
+        return self.conf.get("item_cache", {}).get("ttl", 0)
+
+    def _schedule_cache_item(self, table, uri, object_key, content_type, now):
+        # Arrange for an item to be cached in the background, unless it's
+        # not to be cached at all.
+        ttl = self._item_cache_ttl(uri)
+        if not ttl:
+            return
+
+        key = (table, uri)
+        with self._item_cache_lock:
+            if (
+                key in self._item_cache_pending
+                or len(self._item_cache_pending)
+                >= MAX_PENDING_ITEM_CACHE_FILLS
+            ):
+                return
+            self._item_cache_pending.add(key)
+
+        self._item_cache_fills.submit(
+            self._cache_item, table, uri, object_key, content_type, now, ttl
+        )
+
+    def _cache_item(self, table, uri, object_key, content_type, now, ttl):
+        try:
+            self._store_item(table, uri, object_key, content_type, now, ttl)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.warning(
+                "Error caching item for URI: %s", uri, exc_info=True
+            )
+        finally:
+            with self._item_cache_lock:
+                self._item_cache_pending.discard((table, uri))
+
+    def _store_item(self, table, uri, object_key, content_type, now, ttl):
+        # The cached item must not outlive the point at which any newer item
+        # for the same URI takes effect, so find when that would be.
+        if next_from_date := self._backend.next_from_date(table, uri, now):
+            next_date = parse_date(next_from_date)
+            ttl = min(
+                ttl, (next_date - datetime.now(timezone.utc)).total_seconds()
+            )
+
+        if ttl > 0:
+            self._item_cache.store(
+                (table, uri),
+                (object_key, content_type, time.monotonic() + ttl),
+            )
+
+    def lookup_item(self, table, uri):
+        # Look up the item currently in effect for uri. Returns one of:
+        #
+        # - None, if there is no item
+        # - "absent", if the item marks the content as deleted
+        # - (object_key, content_type) otherwise
+        #
+        # This method does not touch the request, so it is safe to call
+        # from multiple threads at once.
+        if self._negative_cache.maxsize:
+            # Recently known to be missing or absent?
+            cached = self._negative_cache.lookup((table, uri))
+            self.logger.debug(
+                "Negative cache %s for '%s' (hits: %s, misses: %s)",
+                "hit" if cached else "miss",
+                uri,
+                self._negative_cache.hits,
+                self._negative_cache.misses,
+            )
+            self._count(
+                "NegativeCacheHits" if cached else "NegativeCacheMisses"
+            )
+            if cached == "absent":
+                self.logger.info("Item absent for URI: %s", uri)
+                return "absent"
+            if cached == "missing":
+                return None
+
+        if self._item_cache.maxsize:
+            cached = self._item_cache.lookup((table, uri))
+            self.logger.debug(
+                "Item cache %s for '%s' (hits: %s, misses: %s)",
+                "hit" if cached else "miss",
+                uri,
+                self._item_cache.hits,
+                self._item_cache.misses,
+            )
+            if cached:
+                self.logger.info("Item found for URI: %s", uri)
+                return cached[:2]
+
         self.logger.info("Querying '%s' table for '%s'...", table, uri)
 
-        query_result = self._db.query(
-            TableName=table,
-            Limit=1,
-            ConsistentRead=True,
-            ScanIndexForward=False,
-            KeyConditionExpression="web_uri = :u and from_date <= :d",
-            ExpressionAttributeValues={
-                ":u": {"S": uri},
-                ":d": {
-                    "S": str(
-                        datetime.now(timezone.utc).isoformat(
-                            timespec="milliseconds"
-                        )
-                    )
-                },
-            },
+        now = str(
+            datetime.now(timezone.utc).isoformat(timespec="milliseconds")
         )
+        item = self._backend.latest_item(table, uri, now)
 
-        if not query_result["Items"]:
-            return
+        if not item:
+            self._negative_cache.store((table, uri), "missing")
+            return None
 
         self.logger.info("Item found for URI: %s", uri)
 
         try:
             # Validate If the item's "object_key" is "absent"
-            object_key = query_result["Items"][0]["object_key"]["S"]
+            object_key = item["object_key"]["S"]
             if object_key == "absent":
                 self.logger.info("Item absent for URI: %s", uri)
-                return {"status": "404", "statusDescription": "Not Found"}
-
-            # Add custom header containing the original request uri
-            request["headers"]["exodus-original-uri"] = [
-                {"key": "exodus-original-uri", "value": request["uri"]}
-            ]
+                self._negative_cache.store((table, uri), "absent")
+                return "absent"
 
-            # Update request uri to point to S3 object key
-            request["uri"] = "/" + object_key
-            content_type = (
-                query_result["Items"][0].get("content_type", {}).get("S")
-            )
+            content_type = item.get("content_type", {}).get("S")
             if not content_type:
                 # return "application/octet-stream" when content_type is empty
                 content_type = "application/octet-stream"
-
-            request["querystring"] = urlencode(
-                {"response-content-type": content_type}
-            )
-
-            self.logger.debug(
-                "Updated request value for origin_request",
-                extra={"request": request},
-            )
-
-            return request
         except Exception as err:
             self.logger.exception(
-                "Exception occurred while processing item: %s",
-                query_result["Items"][0],
+                "Exception occurred while processing item: %s", item
             )
 
             raise err
 
+        if self._item_cache.maxsize:
+            self._schedule_cache_item(
+                table, uri, object_key, content_type, now
+            )
+
+        return (object_key, content_type)
+
+    def response_from_db(self, request, table, uri):
+        return self.response_for_item(request, self.lookup_item(table, uri))
+
+    def response_for_item(self, request, item):
+        # Given the result of lookup_item, returns the response (or updated
+        # request) to be returned from the handler, or None if no item.
+        if item is None:
+            return None
+
+        if item == "absent":
+            return {"status": "404", "statusDescription": "Not Found"}
+
+        return self.request_for_object(request, *item)
+
+    def request_for_object(self, request, object_key, content_type):
+        # Add custom header containing the original request uri
+        request["headers"]["exodus-original-uri"] = [
+            {"key": "exodus-original-uri", "value": request["uri"]}
+        ]
+
+        # Update request uri to point to S3 object key
+        request["uri"] = "/" + object_key
+        request["querystring"] = urlencode(
+            {"response-content-type": content_type}
+        )
+
+        self.logger.debug(
+            "Updated request value for origin_request",
+            extra={"request": request},
+        )
+
+        return request
+
     def validate_request(self, request):
         # Validate URI and query string lengths, as those are only elements provided by users.
         #
@@ -324,73 +813,138 @@ class OriginRequest(LambdaBase):
             valid = False
         return valid
 
+    def query_uris(self, uri):
+        # The URIs to be looked up in the table for uri: the uri itself,
+        # then its index file.
+
+        # Do not permit clients to explicitly request an index file
+        if uri.endswith("/" + self.index):
+            return []
+
+        return [uri, uri.rstrip("/") + "/" + self.index]
+
+    def file_response(self, out, original_uri, uri, query_uri):
+        # Given the output of response_from_db for one of query_uris(uri),
+        # returns the response to be sent.
+        if query_uri != uri and not uri.endswith("/"):
+            # If we got an index response but the user's requested uri doesn't
+            # end in '/', then we can't directly serve the index.
+            # We need to instead serve a redirect back to the same path with
+            # '/' appended.
+            #
+            # This is due to the way HTML links are resolved, for example:
+            #
+            #   current URL  |  link href  |  resolved URL
+            # ---------------+-------------+---------------------------
+            #   /some/repo   |  Packages/  | /some/Packages (bad)
+            #   /some/repo/  |  Packages/  | /some/repo/Packages (good)
+            #
+            # This is conceptually similar to:
+            # https://httpd.apache.org/docs/2.4/mod/mod_dir.html#directoryslash
+            self.logger.debug("Sending '/' redirect for index at %s", uri)
+
+            response = {
+                "status": "302",
+                "headers": {
+                    "location": [
+                        {"value": original_uri + "/"},
+                    ],
+                },
+            }
+            self.logger.debug(
+                "Generated redirect response",
+                extra={"response": response},
+            )
+            return response
+
+        return out
+
     def handle_file_request(self, request, table, original_uri, uri):
         # Try find the db entry corresponding to the uri.
+        for query_uri in self.query_uris(uri):
+            if out := self.response_from_db(request, table, query_uri):
+                return self.file_response(out, original_uri, uri, query_uri)
 
-        # Do not permit clients to explicitly request an index file
-        if not uri.endswith("/" + self.index):
-            index_uri = uri
-            while index_uri.endswith("/"):
-                index_uri = index_uri[:-1]
-            index_uri = index_uri + "/" + self.index
-            for query_uri in (uri, index_uri):
-                if out := self.response_from_db(request, table, query_uri):
-                    if query_uri == index_uri and not uri.endswith("/"):
-                        # If we got an index response but the user's requested uri doesn't
-                        # end in '/', then we can't directly serve the index.
-                        # We need to instead serve a redirect back to the same path with
-                        # '/' appended.
-                        #
-                        # This is due to the way HTML links are resolved, for example:
-                        #
-                        #   current URL  |  link href  |  resolved URL
-                        # ---------------+-------------+---------------------------
-                        #   /some/repo   |  Packages/  | /some/Packages (bad)
-                        #   /some/repo/  |  Packages/  | /some/repo/Packages (good)
-                        #
-                        # This is conceptually similar to:
-                        # https://httpd.apache.org/docs/2.4/mod/mod_dir.html#directoryslash
-                        self.logger.debug(
-                            "Sending '/' redirect for index at %s", uri
-                        )
+    def handle_concurrent_requests(
+        self, request, table, original_uri, uris, config=None
+    ):
+        # Equivalent to trying handle_listing_request and handle_file_request
+        # for each uri in turn, but with all table lookups issued at once.
+        plan = []
+        for uri in uris:
+            if listing_response := self.handle_listing_request(uri, config):
+                self.set_cache_control(uri, listing_response)
+                plan.append((uri, listing_response, []))
+                # Nothing after a listing could be used.
+                break
+
+            lookups = [
+                (
+                    query_uri,
+                    self._executor.submit(
+                        contextvars.copy_context().run,
+                        self.lookup_item,
+                        table,
+                        query_uri,
+                    ),
+                )
+                for query_uri in self.query_uris(uri)
+            ]
+            plan.append((uri, None, lookups))
 
-                        response = {
-                            "status": "302",
-                            "headers": {
-                                "location": [
-                                    {"value": original_uri + "/"},
-                                ],
-                            },
-                        }
-                        self.logger.debug(
-                            "Generated redirect response",
-                            extra={"response": response},
+        try:
+            # Wait for results in order of priority; the first one to
+            # produce something wins.
+            for uri, listing_response, lookups in plan:
+                if listing_response:
+                    return listing_response
+
+                for query_uri, future in lookups:
+                    item = future.result()
+                    if out := self.response_for_item(request, item):
+                        return self.file_response(
+                            out, original_uri, uri, query_uri
                         )
-                        return response
 
-                    return out
+                self.logger.info("No item found for URI: %s", uri)
+        finally:
+            # Anything not yet started is no longer needed.
+            for _, _, lookups in plan:
+                for _, future in lookups:
+                    future.cancel()
 
-    def handler(self, event, context):
-        # pylint: disable=unused-argument
-        request = event["Records"][0]["cf"]["request"]
+        return None
 
-        if not self.validate_request(request):
-            return {"status": "400", "statusDescription": "Bad Request"}
+    def candidate_uris(self, uri, config=None):
+        # Returns the URIs which should be looked up for a request, in
+        # order of preference.
+        #
+        # This is somewhat expensive to calculate and the same hot paths are
+        # requested repeatedly, so results are cached for the current config
+        # generation.
+        config = config or self.config
+        key = (uri, config.generation)
+        uris = self._uri_plans.lookup(key)
+        self._count("UriCacheMisses" if uris is None else "UriCacheHits")
+
+        if uris is None:
+            uris = self._candidate_uris(uri, config)
+            self._uri_plans.store(key, uris)
 
         self.logger.debug(
-            "Incoming request value for origin_request",
-            extra={"request": request},
+            "Candidate URIs for %s: %s (cache hits: %s, misses: %s)",
+            uri,
+            uris,
+            self._uri_plans.hits,
+            self._uri_plans.misses,
         )
 
-        request["uri"] = unquote(request["uri"])
-        original_uri = request["uri"]
+        return list(uris)
 
-        if request["uri"].startswith("/_/cookie/"):
-            return self.handle_cookie_request(event)
-
-        preferred_uri = self.resolve_aliases(request["uri"])
+    def _candidate_uris(self, uri, config):
+        preferred_uri = self.resolve_aliases(uri, config=config)
         fallback_uri = self.resolve_aliases(
-            request["uri"], ignore_exclusions=True
+            uri, ignore_exclusions=True, config=config
         )
         uris = [preferred_uri]
         # Some file keys might take a while to update to reflect URI alias exclusions.
@@ -408,15 +962,49 @@ class OriginRequest(LambdaBase):
             # (rhui and origin aliases) are resolved.
             for ignore_exclusions in (False, True):
                 mirrored_uri = self.resolve_aliases(
-                    request["uri"],
+                    uri,
                     ignore_exclusions=ignore_exclusions,
                     ignore_releasever=True,
+                    config=config,
                 )
                 if mirrored_uri not in uris:
                     uris.append(mirrored_uri)
 
+        return tuple(uris)
+
+    def handler(self, event, context):
+        # pylint: disable=unused-argument
+        request = event["Records"][0]["cf"]["request"]
+
+        if not self.validate_request(request):
+            return {"status": "400", "statusDescription": "Bad Request"}
+
+        self.logger.debug(
+            "Incoming request value for origin_request",
+            extra={"request": request},
+        )
+
+        request["uri"] = unquote(request["uri"])
+        original_uri = request["uri"]
+
+        if request["uri"].startswith("/_/cookie/"):
+            return self.handle_cookie_request(event)
+
+        # The same config is used throughout the request, even if a newer
+        # one is loaded in the meantime.
+        config = self.config
+        uris = self.candidate_uris(request["uri"], config)
+
+        if self._executor:
+            table = self.conf["table"]["name"]
+            if out := self.handle_concurrent_requests(
+                request, table, original_uri, uris, config
+            ):
+                return out
+            return {"status": "404", "statusDescription": "Not Found"}
+
         for uri in uris:
-            if listing_response := self.handle_listing_request(uri):
+            if listing_response := self.handle_listing_request(uri, config):
                 self.set_cache_control(uri, listing_response)
                 return listing_response
 
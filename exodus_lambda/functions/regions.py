@@ -0,0 +1,71 @@
+import math
+from typing import Optional
+
+# Approximate locations (latitude, longitude) of AWS regions, used to
+# estimate how far apart two regions are.
+REGION_COORDINATES: dict[str, tuple[float, float]] = {
+    "us-east-1": (38.9, -77.4),
+    "us-east-2": (40.0, -83.0),
+    "us-west-1": (37.4, -122.0),
+    "us-west-2": (45.8, -119.7),
+    "ca-central-1": (45.5, -73.6),
+    "ca-west-1": (51.0, -114.1),
+    "mx-central-1": (20.6, -100.4),
+    "sa-east-1": (-23.5, -46.6),
+    "eu-west-1": (53.3, -6.3),
+    "eu-west-2": (51.5, -0.1),
+    "eu-west-3": (48.9, 2.4),
+    "eu-central-1": (50.1, 8.7),
+    "eu-central-2": (47.4, 8.5),
+    "eu-north-1": (59.3, 18.1),
+    "eu-south-1": (45.5, 9.2),
+    "eu-south-2": (41.6, -0.9),
+    "il-central-1": (32.1, 34.8),
+    "me-south-1": (26.1, 50.6),
+    "me-central-1": (25.2, 55.3),
+    "af-south-1": (-33.9, 18.4),
+    "ap-south-1": (19.1, 72.9),
+    "ap-south-2": (17.4, 78.5),
+    "ap-east-1": (22.3, 114.2),
+    "ap-northeast-1": (35.7, 139.7),
+    "ap-northeast-2": (37.6, 127.0),
+    "ap-northeast-3": (34.7, 135.5),
+    "ap-southeast-1": (1.4, 103.8),
+    "ap-southeast-2": (-33.9, 151.2),
+    "ap-southeast-3": (-6.2, 106.8),
+    "ap-southeast-4": (-37.8, 145.0),
+    "ap-southeast-5": (3.1, 101.7),
+    "ap-southeast-7": (13.8, 100.5),
+}
+
+# Rough round-trip time per kilometre between regions, in seconds, and the
+# fixed cost of a query regardless of distance. These only need to be good
+# enough to compare estimates against each other and against observed
+# latencies.
+_SECONDS_PER_KM = 0.00001
+_BASE_LATENCY = 0.005
+
+
+def distance(region1: str, region2: str) -> Optional[float]:
+    """Returns the great-circle distance, in kilometres, between two regions,
+    or None if the location of either region is unknown."""
+    if region1 not in REGION_COORDINATES or region2 not in REGION_COORDINATES:
+        return None
+
+    lat1, lon1 = (math.radians(x) for x in REGION_COORDINATES[region1])
+    lat2, lon2 = (math.radians(x) for x in REGION_COORDINATES[region2])
+
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+def estimated_latency(origin: Optional[str], region: str) -> Optional[float]:
+    """Returns a rough estimate of query latency, in seconds, to region from
+    origin, or None if it can't be estimated."""
+    km = distance(origin, region) if origin else None
+    if km is None:
+        return None
+    return _BASE_LATENCY + km * _SECONDS_PER_KM
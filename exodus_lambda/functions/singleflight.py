@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+
+class WaitTimeout(TimeoutError):
+    """Raised when a call in progress didn't complete in time."""
+
+
+class _Call:
+    # A call in progress, and its outcome once done.
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single call.
+
+    While a call for a key is in progress, further calls for that key wait
+    for it and share its outcome, rather than making their own call. Only
+    callers of the same key ever wait for each other.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Any],
+        timeout: Optional[float] = None,
+        retry_on: tuple[type[BaseException], ...] = (),
+    ) -> tuple[Any, bool]:
+        """Call fn, unless a call for key is already in progress.
+
+        Returns the outcome of fn along with whether it was shared with
+        another caller. If fn raises, so do all callers sharing the call,
+        except for errors of the types in retry_on: callers sharing a call
+        which failed with one of those make the call again instead.
+
+        If timeout is given, waits at most that many seconds in total for
+        calls in progress, raising WaitTimeout if they don't complete in
+        time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if call is None:
+                    call = self._calls[key] = _Call()
+
+            if leader:
+                break
+
+            remaining = (
+                None if deadline is None else deadline - time.monotonic()
+            )
+            if not call.done.wait(remaining):
+                raise WaitTimeout(f"Timed out waiting for call for {key!r}")
+            if call.error is None:
+                return call.result, True
+            if not isinstance(call.error, retry_on):
+                raise call.error
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
@@ -0,0 +1,264 @@
+import gzip
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from .backend import Backend, InMemoryBackend, Item
+from .base import MUTABLE_PATH_PATTERNS
+
+# A snapshot is a read-only file of content items, used via mmap so that
+# lookups read the file in place. Layout:
+#
+# - header: magic, slot count, record count
+# - slots: a hash table of (crc32 of web_uri, index of first record + 1),
+#   with 0 marking an empty slot; collisions are resolved by probing the
+#   following slots
+# - offsets: record count + 1 offsets of records, relative to the start of
+#   the records
+# - records: sorted by (web_uri, from_date), each being the lengths of
+#   web_uri, from_date, object_key and content_type followed by their
+#   UTF-8 encoded values
+#
+# All integers are little-endian and unsigned.
+MAGIC = b"EXSNAP01"
+HEADER = struct.Struct("<8sII")
+SLOT = struct.Struct("<II")
+OFFSET = struct.Struct("<I")
+RECORD = struct.Struct("<HHHH")
+
+# Items for paths expected to change in place are never served from a
+# snapshot, as it would go on serving them after they've changed.
+_MUTABLE_PATHS = re.compile(
+    "|".join(f"(?:{pattern})" for pattern in MUTABLE_PATH_PATTERNS)
+)
+
+
+def _is_mutable(web_uri: str) -> bool:
+    return _MUTABLE_PATHS.match(web_uri) is not None
+
+
+def write_snapshot(path: str, items: Iterable[Item]) -> int:
+    """Write content items, in DynamoDB JSON format, to a snapshot file.
+
+    Items without a web_uri, or for mutable paths (see
+    MUTABLE_PATH_PATTERNS), are left out.
+
+    Returns the number of records written.
+    """
+    records = sorted(
+        tuple(
+            item.get(name, {}).get("S", "").encode("utf-8")
+            for name in ("web_uri", "from_date", "object_key", "content_type")
+        )
+        for item in items
+        if (web_uri := item.get("web_uri", {}).get("S"))
+        and not _is_mutable(web_uri)
+    )
+
+    slot_count = 1
+    while slot_count < 2 * len(records):
+        slot_count *= 2
+    slots = [(0, 0)] * slot_count
+
+    offsets = [0]
+    data = bytearray()
+    for idx, record in enumerate(records):
+        if idx == 0 or records[idx - 1][0] != record[0]:
+            key_hash = zlib.crc32(record[0])
+            slot = key_hash & (slot_count - 1)
+            while slots[slot][1]:
+                slot = (slot + 1) & (slot_count - 1)
+            slots[slot] = (key_hash, idx + 1)
+
+        data += RECORD.pack(*(len(value) for value in record))
+        data += b"".join(record)
+        offsets.append(len(data))
+
+    with open(path, "wb") as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, slot_count, len(records)))
+        snapshot.write(b"".join(SLOT.pack(*slot) for slot in slots))
+        snapshot.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        snapshot.write(data)
+
+    return len(records)
+
+
+def read_items(path: str) -> Iterator[Item]:
+    """Yield content items from a DynamoDB table export or a fixture.
+
+    path may be a directory or file from a DynamoDB export to S3 in
+    DynamoDB JSON format (*.json.gz), or a fixture in any format supported
+    by InMemoryBackend.from_file. Only content items are read from a
+    fixture, leaving out any config it contains.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json.gz"):
+                yield from read_items(os.path.join(path, name))
+    elif path.endswith(".json.gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as export:
+            for line in export:
+                if line.strip():
+                    yield json.loads(line)["Item"]
+    else:
+        fixture = InMemoryBackend.from_file(path, "content", "config")
+        yield from fixture.items("content")
+
+
+class Snapshot:
+    """A memory-mapped snapshot file written by write_snapshot."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as snapshot:
+            self._mm = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._slot_count, self._record_count = HEADER.unpack_from(
+            self._mm
+        )
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a snapshot file: {path}")
+
+        self._offsets_start = HEADER.size + self._slot_count * SLOT.size
+        self._records_start = (
+            self._offsets_start + (self._record_count + 1) * OFFSET.size
+        )
+
+    def __len__(self) -> int:
+        return self._record_count
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _record_offset(self, idx: int) -> int:
+        return (
+            self._records_start
+            + OFFSET.unpack_from(
+                self._mm, self._offsets_start + idx * OFFSET.size
+            )[0]
+        )
+
+    def _key_matches(self, idx: int, key: bytes) -> bool:
+        offset = self._record_offset(idx)
+        key_len = RECORD.unpack_from(self._mm, offset)[0]
+        start = offset + RECORD.size
+        return key_len == len(key) and self._mm[start : start + key_len] == key
+
+    def _find(self, key: bytes) -> int:
+        # Returns index of the first record for key, or -1. Misses only
+        # read integers from the slots, without touching any records.
+        key_hash = zlib.crc32(key)
+        mask = self._slot_count - 1
+        slot = key_hash & mask
+        while True:
+            slot_hash, idx = SLOT.unpack_from(
+                self._mm, HEADER.size + slot * SLOT.size
+            )
+            if not idx:
+                return -1
+            if slot_hash == key_hash and self._key_matches(idx - 1, key):
+                return idx - 1
+            slot = (slot + 1) & mask
+
+    def _fields(self, idx: int) -> tuple[bytes, ...]:
+        # web_uri, from_date, object_key, content_type of a record.
+        offset = self._record_offset(idx)
+        out = []
+        start = offset + RECORD.size
+        for length in RECORD.unpack_from(self._mm, offset):
+            out.append(self._mm[start : start + length])
+            start += length
+        return tuple(out)
+
+    def _from_dates(self, key: bytes) -> Iterator[tuple[int, bytes]]:
+        # (index, from_date) of each record for key, in from_date order.
+        idx = self._find(key)
+        while idx != -1 and idx < self._record_count:
+            offset = self._record_offset(idx)
+            key_len, date_len = RECORD.unpack_from(self._mm, offset)[:2]
+            start = offset + RECORD.size
+            if self._mm[start : start + key_len] != key:
+                return
+            start += key_len
+            yield idx, self._mm[start : start + date_len]
+            idx += 1
+
+    def __contains__(self, web_uri: str) -> bool:
+        return self._find(web_uri.encode("utf-8")) != -1
+
+    def latest_item(self, web_uri: str, as_of: str) -> Optional[Item]:
+        """Returns the item for web_uri with the latest from_date <= as_of,
+        if any."""
+        as_of_bytes = as_of.encode("utf-8")
+        found = -1
+        for idx, from_date in self._from_dates(web_uri.encode("utf-8")):
+            if from_date > as_of_bytes:
+                break
+            found = idx
+        if found == -1:
+            return None
+
+        out = {}
+        for name, value in zip(
+            ("web_uri", "from_date", "object_key", "content_type"),
+            self._fields(found),
+        ):
+            if value:
+                out[name] = {"S": value.decode("utf-8")}
+        return out
+
+    def next_from_date(self, web_uri: str, after: str) -> Optional[str]:
+        """Returns the earliest from_date > after for web_uri, if any."""
+        after_bytes = after.encode("utf-8")
+        for _, from_date in self._from_dates(web_uri.encode("utf-8")):
+            if from_date > after_bytes:
+                return from_date.decode("utf-8")
+        return None
+
+
+class SnapshotBackend:
+    """Backend serving content items from a Snapshot where possible.
+
+    Lookups for web_uris in the snapshot are answered from the snapshot
+    alone, unless it has no item in effect at the time of the lookup.
+    Everything else, including any mutable paths, is passed to the
+    fallback backend.
+    """
+
+    def __init__(self, snapshot: Snapshot, fallback: Backend, table: str):
+        self._snapshot = snapshot
+        self._fallback = fallback
+        self._table = table
+
+    def latest_item(
+        self, table: str, web_uri: str, as_of: str
+    ) -> Optional[Item]:
+        if table == self._table and not _is_mutable(web_uri):
+            if item := self._snapshot.latest_item(web_uri, as_of):
+                return item
+        return self._fallback.latest_item(table, web_uri, as_of)
+
+    def next_from_date(
+        self, table: str, web_uri: str, after: str
+    ) -> Optional[str]:
+        if (
+            table == self._table
+            and not _is_mutable(web_uri)
+            and web_uri in self._snapshot
+        ):
+            return self._snapshot.next_from_date(web_uri, after)
+        return self._fallback.next_from_date(table, web_uri, after)
+
+    def latest_config(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[Item]:
+        return self._fallback.latest_config(table, config_id, as_of)
+
+    def latest_config_date(
+        self, table: str, config_id: str, as_of: str
+    ) -> Optional[str]:
+        return self._fallback.latest_config_date(table, config_id, as_of)
@@ -0,0 +1,36 @@
+"""benchmark: micro-benchmarks for the exodus-lambda hot paths.
+
+Each module can be run directly, e.g.:
+
+    python -m support.benchmark.alias
+
+Benchmarks run locally with no AWS access required.
+"""
+
+import atexit
+import os
+from subprocess import check_output
+from tempfile import NamedTemporaryFile
+
+THIS_DIR = os.path.dirname(__file__)
+MK_CONFIG = os.path.join(THIS_DIR, "../../scripts/mk-config")
+
+
+def ensure_config():
+    """Ensure EXODUS_LAMBDA_CONF_FILE points at a usable lambda_config.json.
+
+    exodus_lambda reads its config at import time, so this must be called
+    before importing anything from exodus_lambda.
+    """
+    if os.environ.get("EXODUS_LAMBDA_CONF_FILE"):
+        return
+
+    config_file = NamedTemporaryFile(
+        mode="wt", prefix="benchmark", delete=False
+    )
+    atexit.register(os.remove, config_file.name)
+
+    config_file.write(check_output([MK_CONFIG], env=os.environ, text=True))
+    config_file.flush()
+
+    os.environ["EXODUS_LAMBDA_CONF_FILE"] = config_file.name
@@ -0,0 +1,111 @@
+"""Benchmark alias resolution as the number of aliases grows.
+
+For each alias count, a set of releasever-style aliases is generated and
+the time taken to resolve a typical request URI is measured, using both
+the compiled AliasIndex and the multi-pass scan it replaced.
+
+Resolution time with AliasIndex is expected to stay roughly flat as
+the alias count grows, while the legacy scan grows linearly.
+
+Usage:
+
+    python -m support.benchmark.alias [--counts 10,100,1000]
+"""
+
+import argparse
+import re
+import timeit
+
+from . import ensure_config
+
+
+def legacy_uri_alias(uri, aliases, ignore_exclusions=False):
+    remaining = aliases
+    while remaining:
+        processed = []
+        for alias in remaining:
+            exclusion_match = not ignore_exclusions and any(
+                [
+                    re.search(exclusion, uri)
+                    for exclusion in alias.get("exclude_paths", [])
+                ]
+            )
+            if (
+                uri.startswith(alias["src"] + "/") or uri == alias["src"]
+            ) and not exclusion_match:
+                uri = uri.replace(alias["src"], alias["dest"], 1)
+                processed.append(alias)
+        if not processed:
+            break
+        remaining = [r for r in remaining if r not in processed]
+    return uri
+
+
+def make_aliases(count):
+    # Shaped like releasever_alias from cdn-definitions: one alias per
+    # (product, major version), each with a couple of exclusions.
+    out = []
+    for i in range(count):
+        product = f"/content/dist/product{i // 10}"
+        major = i % 10
+        out.append(
+            {
+                "src": f"{product}/{major}/{major}Server",
+                "dest": f"{product}/{major}/{major}.9",
+                "exclude_paths": ["/files/", "/iso/"],
+            }
+        )
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--counts",
+        default="10,100,1000,2000,5000",
+        help="Comma-separated alias counts to benchmark",
+    )
+    parser.add_argument(
+        "--number",
+        type=int,
+        default=2000,
+        help="Resolutions per measurement",
+    )
+    args = parser.parse_args()
+
+    ensure_config()
+    from exodus_lambda.functions.alias import AliasIndex
+
+    print(f"{'aliases':>8} {'index (us)':>12} {'legacy (us)':>12}")
+
+    for count in [int(c) for c in args.counts.split(",")]:
+        aliases = make_aliases(count)
+        index = AliasIndex(aliases)
+
+        # Pick a URI matching an alias near the end of the list, which is
+        # the worst case for the legacy scan.
+        uri = aliases[-1]["src"] + "/x86_64/os/repodata/repomd.xml"
+        assert index.resolve(uri) == legacy_uri_alias(uri, aliases)
+
+        index_time = min(
+            timeit.repeat(
+                lambda: index.resolve(uri), number=args.number, repeat=3
+            )
+        )
+        legacy_time = min(
+            timeit.repeat(
+                lambda: legacy_uri_alias(uri, aliases),
+                number=max(args.number // count, 1),
+                repeat=3,
+            )
+        )
+
+        print(
+            f"{count:>8} "
+            f"{index_time / args.number * 1e6:>12.2f} "
+            f"{legacy_time / max(args.number // count, 1) * 1e6:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark DynamoDB clients: boto3 versus LiteDynamoDbClient.
+
+Two things are measured:
+
+- cold start: time to import and create a client, each in a fresh
+  interpreter so nothing is already imported
+- per-query CPU time of the calling thread, for a typical Query against a
+  local HTTP server returning a canned response
+
+No AWS access is needed; fake credentials are used and nothing leaves
+the local machine.
+
+Usage:
+
+    python -m support.benchmark.dynamodb [--queries 2000] [--starts 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import ensure_config
+
+COLD_START = {
+    "boto3": (
+        "import boto3, botocore.config\n"
+        "boto3.client('dynamodb', "
+        "config=botocore.config.Config(region_name='us-east-1'))\n"
+    ),
+    "lite": (
+        "from exodus_lambda.functions.db import LiteDynamoDbClient\n"
+        "LiteDynamoDbClient('us-east-1')\n"
+    ),
+}
+
+RESPONSE = json.dumps(
+    {
+        "Count": 1,
+        "ScannedCount": 1,
+        "Items": [
+            {
+                "web_uri": {"S": "/content/dist/rhel8/8/x86_64/os/Packages"},
+                "from_date": {"S": "2024-01-01T00:00:00.000+00:00"},
+                "object_key": {"S": "a" * 64},
+                "content_type": {"S": "application/x-rpm"},
+            }
+        ],
+    }
+).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["content-length"]))
+        self.send_response(200)
+        self.send_header("content-type", "application/x-amz-json-1.0")
+        self.send_header("content-length", str(len(RESPONSE)))
+        self.send_header("x-amz-crc32", str(zlib.crc32(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def cold_start(kind, starts):
+    # Returns the best wall-clock time, in seconds, of starting a fresh
+    # interpreter, importing and creating a client, minus the time for
+    # starting an interpreter doing nothing.
+    def run(code):
+        best = None
+        for _ in range(starts):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    return run(COLD_START[kind]) - run("pass")
+
+
+def query_cpu(client, queries):
+    # Returns the median CPU time, in seconds, used by this thread per query.
+    kwargs = {
+        "TableName": "my-table",
+        "Limit": 1,
+        "ConsistentRead": True,
+        "ScanIndexForward": False,
+        "KeyConditionExpression": "web_uri = :u and from_date <= :d",
+        "ExpressionAttributeValues": {
+            ":u": {"S": "/content/dist/rhel8/8/x86_64/os/Packages"},
+            ":d": {"S": "2024-06-01T00:00:00.000+00:00"},
+        },
+    }
+
+    # Warm up (connections, caches).
+    for _ in range(20):
+        client.query(**kwargs)
+
+    samples = []
+    for _ in range(queries):
+        start = time.thread_time()
+        client.query(**kwargs)
+        samples.append(time.thread_time() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--queries", type=int, default=2000, help="Queries per client"
+    )
+    parser.add_argument(
+        "--starts", type=int, default=5, help="Cold starts per client"
+    )
+    args = parser.parse_args()
+
+    ensure_config()
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    # pylint: disable=import-outside-toplevel
+    import boto3
+    import botocore.config
+
+    from exodus_lambda.functions.db import LiteDynamoDbClient
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    clients = {
+        "boto3": boto3.client(
+            "dynamodb",
+            endpoint_url=url,
+            config=botocore.config.Config(region_name="us-east-1"),
+        ),
+        "lite": LiteDynamoDbClient("us-east-1", endpoint_url=url),
+    }
+
+    print(f"{'client':>8} {'cold start (ms)':>16} {'CPU/query (us)':>16}")
+    for kind, client in clients.items():
+        print(
+            f"{kind:>8} "
+            f"{cold_start(kind, args.starts) * 1e3:>16.1f} "
+            f"{query_cpu(client, args.queries) * 1e6:>16.1f}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark the origin request handler against an in-memory backend.
+
+Content items are generated in bulk and loaded into an InMemoryBackend
+along with the reftest exodus-config, so that the measured time is that
+of the pure-Python hot path: alias resolution, lookups and building the
+response, with no network or DynamoDB client involved.
+
+Lookups are O(log n), so time per request is expected to grow very
+slowly with the item count.
+
+Usage:
+
+    python -m support.benchmark.handler [--counts 1000,1000000]
+"""
+
+import argparse
+import json
+import os
+import time
+import timeit
+
+from . import THIS_DIR, ensure_config
+
+CONFIG = os.path.join(THIS_DIR, "../reftest/exodus-config.json")
+
+
+def make_items(count):
+    for i in range(count):
+        yield {
+            "web_uri": {"S": f"/content/dist/product{i % 100}/{i}/file.rpm"},
+            "from_date": {"S": "2024-01-01T00:00:00.000+00:00"},
+            "object_key": {"S": f"{i:064x}"},
+            "content_type": {"S": "application/x-rpm"},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--counts",
+        default="1000,100000,1000000",
+        help="Comma-separated item counts to benchmark",
+    )
+    parser.add_argument(
+        "--number", type=int, default=5000, help="Requests per measurement"
+    )
+    args = parser.parse_args()
+
+    ensure_config()
+    # pylint: disable=import-outside-toplevel
+    from exodus_lambda.functions.backend import InMemoryBackend
+    from exodus_lambda.functions.origin_request import OriginRequest
+
+    with open(CONFIG, "rt", encoding="utf-8") as config:
+        config_data = json.load(config)
+
+    print(f"{'items':>10} {'load (s)':>10} {'request (us)':>14}")
+
+    for count in [int(c) for c in args.counts.split(",")]:
+        backend = InMemoryBackend()
+        handler = OriginRequest(backend=backend)
+        table = handler.conf["table"]["name"]
+        config_table = handler.conf["config_table"]["name"]
+
+        start = time.perf_counter()
+        backend.load_items(table, "web_uri", make_items(count))
+        load_time = time.perf_counter() - start
+        backend.load_fixture({"config": config_data}, table, config_table)
+
+        # The last item generated, which sorts among the others.
+        last = count - 1
+        uri = f"/content/dist/product{last % 100}/{last}/file.rpm"
+        event = {"Records": [{"cf": {"request": {"uri": uri, "headers": {}}}}]}
+        assert handler.handler(event, None)["uri"] == f"/{last:064x}"
+
+        request_time = min(
+            timeit.repeat(
+                lambda: handler.handler(event, None),
+                number=args.number,
+                repeat=3,
+            )
+        )
+
+        print(
+            f"{count:>10} {load_time:>10.2f} "
+            f"{request_time / args.number * 1e6:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the origin request handler by replaying recorded queries.
+
+A cassette recorded by fakefront (see EXODUS_FAKEFRONT_RECORD) is replayed
+with no network access: a request is made for each content path queried
+in the recorded session, and queries are answered from the cassette.
+
+Handler latency percentiles and the number of queries per request are
+reported, so they can be compared between builds.
+
+Usage:
+
+    python -m support.benchmark.replay CASSETTE [--latency] [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from . import ensure_config
+
+
+def recorded_paths(cassette, table):
+    # Paths queried in the content table, in order of first query.
+    paths = {}
+    with open(cassette, "rt", encoding="utf-8") as log:
+        for line in log:
+            params = json.loads(line)["params"]
+            if params["TableName"] == table:
+                values = params["ExpressionAttributeValues"]
+                paths.setdefault(values[":u"]["S"], None)
+    return list(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("cassette", help="Cassette file to replay")
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="Replay recorded query latencies",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=5, help="Times to replay each request"
+    )
+    args = parser.parse_args()
+
+    ensure_config()
+    # pylint: disable=import-outside-toplevel
+    from exodus_lambda.functions.base import LambdaBase
+    from exodus_lambda.functions.origin_request import OriginRequest
+
+    conf = LambdaBase(conf_file=os.environ["EXODUS_LAMBDA_CONF_FILE"]).conf
+    conf["cassette"] = {
+        "mode": "replay",
+        "path": args.cassette,
+        "replay_latency": args.latency,
+    }
+    handler = OriginRequest(conf_file=conf)
+
+    queries = 0
+    query = handler._db.query  # pylint: disable=protected-access
+
+    def counting_query(**kwargs):
+        nonlocal queries
+        queries += 1
+        return query(**kwargs)
+
+    handler._db.query = counting_query  # pylint: disable=protected-access
+
+    paths = recorded_paths(args.cassette, conf["table"]["name"])
+    samples = []
+    for _ in range(args.rounds):
+        for path in paths:
+            event = {
+                "Records": [{"cf": {"request": {"uri": path, "headers": {}}}}]
+            }
+            start = time.perf_counter()
+            handler.handler(event, None)
+            samples.append(time.perf_counter() - start)
+
+    quantiles = statistics.quantiles(samples, n=100)
+    print(f"requests: {len(samples)} ({len(paths)} paths)")
+    print(f"queries per request: {queries / len(samples):.2f}")
+    print(
+        f"latency (us): p50 {quantiles[49] * 1e6:.1f}, "
+        f"p90 {quantiles[89] * 1e6:.1f}, p99 {quantiles[98] * 1e6:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
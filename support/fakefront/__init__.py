@@ -7,6 +7,11 @@ should be set in the EXODUS_AWS_ENDPOINT_URL environment variable.
 
 While it's likely possible to run this against real AWS services also,
 your S3 bucket would have to be unsecured, which is not recommended.
+
+To capture the DynamoDB queries of a session, set EXODUS_FAKEFRONT_RECORD
+to the path of a cassette file. To later serve queries from that file with
+no access to DynamoDB, set EXODUS_FAKEFRONT_REPLAY to its path instead,
+and EXODUS_FAKEFRONT_REPLAY_LATENCY=1 to also replay recorded latencies.
 """
 
 from .config import ensure_config
@@ -28,6 +28,23 @@ def ensure_config_file():
     atexit.register(os.remove, config_file.name)
 
     config_json = check_output([MK_CONFIG], env=os.environ, text=True)
+
+    # Record or replay DynamoDB queries if requested, e.g. to capture a
+    # session once and replay it against later builds.
+    for mode in ("record", "replay"):
+        path = os.environ.get(f"EXODUS_FAKEFRONT_{mode.upper()}")
+        if path:
+            config = json.loads(config_json)
+            config["cassette"] = {
+                "mode": mode,
+                "path": path,
+                "replay_latency": bool(
+                    os.environ.get("EXODUS_FAKEFRONT_REPLAY_LATENCY")
+                ),
+            }
+            config_json = json.dumps(config)
+            LOG.info("fakefront: %s DynamoDB queries at %s", mode, path)
+
     config_file.write(config_json)
     config_file.flush()
 
@@ -78,6 +78,9 @@ def mock_conf_file():
     test_env["EXODUS_CONFIG_CACHE_TTL"] = "2"
     test_env["EXODUS_CONNECT_TIMEOUT"] = "4"
     test_env["EXODUS_READ_TIMEOUT"] = "4"
+    test_env["EXODUS_MAX_POOL_CONNECTIONS"] = "10"
+    test_env["EXODUS_TCP_KEEPALIVE"] = "false"
+    test_env["EXODUS_CONNECTION_IDLE_TIMEOUT"] = "50"
     test_env["EXODUS_COOKIE_TTL"] = "720"
     test_env["EXODUS_HEADERS_MAX_AGE"] = "600"
     test_env["EXODUS_SECRET_ARN"] = "arn:aws:secretsmanager:example"
@@ -87,6 +90,9 @@ def mock_conf_file():
     test_env["EXODUS_LAMBDA_VERSION"] = "fake version"
     test_env["EXODUS_INDEX_FILENAME"] = ".__exodus_autoindex"
     test_env["EXODUS_MIRROR_READS"] = ""
+    test_env["EXODUS_SNAPSHOT_FILE"] = ""
+    test_env["EXODUS_CONFIG_CACHE_FILE"] = ""
+    test_env["EXODUS_CONFIG_SEED_FILE"] = ""
 
     subprocess.run(
         ["envsubst"],
@@ -1,11 +1,15 @@
 # More in depth tests for alias resolution.
+import random
+import re
 from collections import namedtuple
 
+import mock
 import pytest
 
+from exodus_lambda.functions.alias import AliasIndex, Exclusions
 from exodus_lambda.functions.origin_request import OriginRequest
 
-from ..test_utils.utils import generate_test_config
+from ..test_utils.utils import generate_test_config, mock_definitions
 
 TEST_CONF = generate_test_config()
 
@@ -156,3 +160,175 @@ def test_alias_exclusions(uri, expected_uri, ignore_exclusions, aliases):
     req = OriginRequest(conf_file=TEST_CONF)
 
     assert req.uri_alias(uri, aliases, ignore_exclusions) == expected_uri
+
+
+def legacy_uri_alias(uri, aliases, ignore_exclusions=False):
+    # The multi-pass alias scan which AliasIndex replaced, kept here as
+    # a reference implementation.
+    remaining = aliases
+    while remaining:
+        processed = []
+        for alias in remaining:
+            exclusion_match = not ignore_exclusions and any(
+                re.search(exclusion, uri)
+                for exclusion in alias.get("exclude_paths", [])
+            )
+            if (
+                uri.startswith(alias["src"] + "/") or uri == alias["src"]
+            ) and not exclusion_match:
+                uri = uri.replace(alias["src"], alias["dest"], 1)
+                processed.append(alias)
+        if not processed:
+            break
+        remaining = [r for r in remaining if r not in processed]
+    return uri
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("ignore_exclusions", [False, True])
+def test_alias_index_matches_legacy(seed, ignore_exclusions):
+    """AliasIndex gives the same results as the legacy multi-pass scan,
+    including for nested, chained, duplicated and excluded aliases."""
+
+    rand = random.Random(seed)
+    segments = ["a", "b", "c", "rhui", "", "8", "8.5"]
+
+    def random_path(max_len):
+        return "/" + "/".join(
+            rand.choice(segments) for _ in range(rand.randint(0, max_len))
+        )
+
+    aliases = []
+    for _ in range(rand.randint(1, 12)):
+        alias = {"src": random_path(3), "dest": random_path(3)}
+        if rand.random() < 0.3:
+            alias["exclude_paths"] = [rand.choice(["/b/", "/c", "8[.]5"])]
+        aliases.append(alias)
+        if rand.random() < 0.1:
+            aliases.append(dict(alias))
+
+    index = AliasIndex(aliases)
+    for _ in range(50):
+        uri = random_path(6)
+        assert index.resolve(uri, ignore_exclusions) == legacy_uri_alias(
+            uri, aliases, ignore_exclusions
+        ), (uri, aliases)
+
+
+def test_alias_index_empty():
+    """AliasIndex can be built from missing alias definitions."""
+
+    assert AliasIndex(None).resolve("/foo/bar") == "/foo/bar"
+
+
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_aliases_compiled_per_generation(mocked_cache):
+    """Compiled aliases are reused until a new config is loaded."""
+
+    definitions = mock_definitions()
+    cache = {"exodus-config": definitions}
+    mocked_cache.TTLCache.return_value = cache
+
+    req = OriginRequest(conf_file=TEST_CONF)
+
+    compiled = req.aliases
+    assert req.aliases is compiled
+    assert len(compiled["rhui_alias"].aliases) == len(
+        definitions["rhui_alias"]
+    )
+
+    # Simulate loading a new config.
+    cache["exodus-config"] = mock_definitions()
+    assert req.aliases is not compiled
+
+
+@pytest.mark.parametrize(
+    "patterns",
+    [
+        [],
+        ["/iso/"],
+        ["/iso/", "/files/"],
+        ["/rhel[89]/"],
+        ["/rhel[89]/", "/iso/", "^/content/beta"],
+        ["/a|/b"],
+        ["/xa*b", "/x+"],
+        ["/c{2}", "/d?e"],
+        ["(/a)\\1", "/rhel[89]/"],
+        ["(?i)/ISO/"],
+        ["(?i)/RHEL8/", "/beta[0-9]/", "/iso/"],
+        ["/rhel[89]/", "(?i)/ISO/", "(/a)\\1", "/b$"],
+        ["8\\.5$"],
+    ],
+)
+def test_exclusions_match_re_search(patterns):
+    """Compiled exclusions give the same results as searching for each
+    pattern individually."""
+
+    exclusions = Exclusions(patterns)
+
+    for uri in [
+        "/content/dist/rhel8/8.5",
+        "/content/beta/rhel9/iso/foo",
+        "/content/dist/rhel7/files/foo",
+        "/a/a/b",
+        "/b",
+        "/xb",
+        "/xxab",
+        "/cc/e",
+        "/ce",
+        "/de",
+        "/ISO/",
+        "/content/beta1/x",
+        "/content/dist/RHEL8/x",
+        "",
+    ]:
+        assert exclusions.search(uri) == any(
+            re.search(p, uri) for p in patterns
+        ), (patterns, uri)
+
+
+def test_exclusions_combined():
+    """Patterns are combined into one regex where possible, while those
+    with groups or inline global flags are kept separate."""
+
+    exclusions = Exclusions(
+        ["(?i)/RHEL8/", "/beta[0-9]/", "(/a)\\1", "/iso$", "/files/"]
+    )
+
+    assert [r.pattern for r in exclusions.regexes] == [
+        "(?:/beta[0-9]/)|(?:/iso$)",
+        "(?i)/RHEL8/",
+        "(/a)\\1",
+    ]
+    assert exclusions.search("/content/dist/rhel8/os")
+    assert not exclusions.search("/content/dist/rhel9/os")
+
+
+def test_exclusions_compiled_once():
+    """Exclusions are compiled when the index is built and shared
+    between lookups with and without ignore_exclusions."""
+
+    index = AliasIndex(
+        [
+            {
+                "src": "/origin",
+                "dest": "/aliased",
+                "exclude_paths": ["/rhel[89]/", "/iso/", "/files/"],
+            }
+        ]
+    )
+    (exclusions,) = index.exclusions
+
+    assert exclusions.literals == ("/iso/", "/files/")
+    assert len(exclusions.regexes) == 1
+    assert exclusions.prefilter == ("/rhel",)
+
+    with mock.patch("re.search") as mocked_search, mock.patch(
+        "re.compile"
+    ) as mocked_compile:
+        assert index.resolve("/origin/rhel9/x") == "/origin/rhel9/x"
+        assert index.resolve("/origin/rhel9/x", True) == "/aliased/rhel9/x"
+        assert index.resolve("/origin/rhel7/x") == "/aliased/rhel7/x"
+
+    mocked_search.assert_not_called()
+    mocked_compile.assert_not_called()
@@ -0,0 +1,223 @@
+import json
+import os
+
+import mock
+import pytest
+
+from exodus_lambda.functions.backend import (
+    DEFAULT_FROM_DATE,
+    DynamoDbBackend,
+    InMemoryBackend,
+)
+from exodus_lambda.functions.db import QueryHelper
+from exodus_lambda.functions.origin_request import OriginRequest
+
+from ..test_utils.utils import generate_test_config
+
+TEST_CONF = generate_test_config()
+REFTEST_DIR = os.path.join(os.path.dirname(__file__), "../../support/reftest")
+
+
+def item(web_uri, from_date, object_key="abc"):
+    return {
+        "web_uri": {"S": web_uri},
+        "from_date": {"S": from_date},
+        "object_key": {"S": object_key},
+    }
+
+
+@pytest.fixture
+def backend():
+    out = InMemoryBackend()
+    out.load_items(
+        "content",
+        "web_uri",
+        [
+            item("/b", "2024-03-01", "b3"),
+            item("/a", "2024-01-01", "a1"),
+            item("/b", "2024-01-01", "b1"),
+        ],
+    )
+    # Adding more items keeps everything sorted.
+    out.load_items("content", "web_uri", [item("/c", "2024-01-01", "c1")])
+    out.put_item("content", "/b", item("/b", "2024-02-01", "b2"))
+    return out
+
+
+@pytest.mark.parametrize(
+    "web_uri, as_of, expected",
+    [
+        ("/a", "2024-06-01", "a1"),
+        ("/a", "2023-12-31", None),
+        ("/b", "2024-01-15", "b1"),
+        ("/b", "2024-02-01", "b2"),
+        ("/b", "2024-06-01", "b3"),
+        ("/c", "2024-06-01", "c1"),
+        ("/0", "2024-06-01", None),
+        ("/d", "2024-06-01", None),
+    ],
+)
+def test_in_memory_latest_item(backend, web_uri, as_of, expected):
+    """Latest item with from_date <= as_of is found."""
+
+    out = backend.latest_item("content", web_uri, as_of)
+
+    assert (out["object_key"]["S"] if out else None) == expected
+
+
+@pytest.mark.parametrize(
+    "web_uri, after, expected",
+    [
+        ("/b", "2023-01-01", "2024-01-01"),
+        ("/b", "2024-01-01", "2024-02-01"),
+        ("/b", "2024-02-15", "2024-03-01"),
+        ("/b", "2024-03-01", None),
+        ("/a", "2024-01-01", None),
+        ("/d", "2024-01-01", None),
+    ],
+)
+def test_in_memory_next_from_date(backend, web_uri, after, expected):
+    """Earliest from_date after a given date is found."""
+
+    assert backend.next_from_date("content", web_uri, after) == expected
+
+
+def test_in_memory_unknown_table(backend):
+    """Lookups in an unknown table find nothing."""
+
+    assert backend.latest_item("other", "/a", "2024-06-01") is None
+    assert backend.next_from_date("other", "/a", "2020-01-01") is None
+    assert backend.latest_config("other", "exodus-config", "2024") is None
+    assert backend.latest_config_date("other", "exodus-config", "2024") is None
+    assert len(backend) == 5
+
+
+def test_in_memory_from_reftest_data():
+    """Backend can be loaded from the reftest data."""
+
+    backend = InMemoryBackend.from_file(
+        os.path.join(REFTEST_DIR, "data.yml"), "content", "config"
+    )
+
+    item = backend.latest_item(
+        "content",
+        "/origin/rpms/bash/4.4.19/8.el8_0/fd431d51/"
+        "bash-4.4.19-8.el8_0.x86_64.rpm",
+        "2024-01-01",
+    )
+    assert item == {
+        "web_uri": {
+            "S": "/origin/rpms/bash/4.4.19/8.el8_0/fd431d51/"
+            "bash-4.4.19-8.el8_0.x86_64.rpm"
+        },
+        "object_key": {
+            "S": "4164ff2c0116d666578ba5e456ab03b88788dfb42fb93fc91b2c1da709d86686"
+        },
+        "content_type": {"S": "application/x-rpm"},
+        "from_date": {"S": DEFAULT_FROM_DATE},
+    }
+
+    # Items with deploy: false are not loaded.
+    assert not backend.latest_item(
+        "content",
+        "/origin/rpm/bash/4.4.19/8.el8_0/fd431d51/"
+        "bash-4.4.19-8.el8_0.x86_64.rpm",
+        "2024-01-01",
+    )
+
+
+def test_origin_request_in_memory(tmp_path):
+    """OriginRequest can serve requests from an in-memory backend."""
+
+    with open(os.path.join(REFTEST_DIR, "exodus-config.json")) as f:
+        config = json.load(f)
+
+    fixture = tmp_path / "fixture.json"
+    fixture.write_text(
+        json.dumps(
+            {
+                "items": [
+                    {
+                        "web_uri": "/origin/rpms/repo/file.rpm",
+                        "object_key": "abc123",
+                        "content_type": "application/x-rpm",
+                    },
+                    {
+                        "web_uri": "/origin/rpms/repo/gone.rpm",
+                        "object_key": "absent",
+                    },
+                ],
+                "test_data": [
+                    {"path": "/content/absent/file", "state": "absent"}
+                ],
+                "config": config,
+            }
+        )
+    )
+
+    backend = InMemoryBackend.from_file(
+        str(fixture),
+        TEST_CONF["table"]["name"],
+        TEST_CONF["config_table"]["name"],
+    )
+    req = OriginRequest(conf_file=TEST_CONF, backend=backend)
+
+    def handle(uri):
+        event = {"Records": [{"cf": {"request": {"uri": uri, "headers": {}}}}]}
+        return req.handler(event, context=None)
+
+    with mock.patch("boto3.client") as mocked_client:
+        # Resolved via origin alias from the config.
+        assert handle("/content/origin/rpm/repo/file.rpm")["uri"] == (
+            "/abc123"
+        )
+        assert handle("/origin/rpms/repo/gone.rpm")["status"] == "404"
+        assert handle("/content/absent/file")["status"] == "404"
+        assert handle("/origin/rpms/repo/other.rpm")["status"] == "404"
+
+    # DynamoDB wasn't used at all.
+    mocked_client.assert_not_called()
+    assert req.definitions == config
+
+    # An empty backend is used too, rather than falling back to DynamoDB.
+    empty = InMemoryBackend()
+    assert OriginRequest(conf_file=TEST_CONF, backend=empty)._backend is empty
+
+
+def test_dynamodb_backend():
+    """DynamoDbBackend issues the expected queries."""
+
+    db = mock.Mock(spec=QueryHelper)
+    db.query.return_value = {"Items": []}
+    backend = DynamoDbBackend(db)
+
+    assert backend.latest_item("content", "/a", "2024") is None
+    assert backend.next_from_date("content", "/a", "2024") is None
+    assert backend.latest_config("config", "exodus-config", "2024") is None
+
+    db.query.return_value = {"Items": [item("/a", "2025")]}
+    assert backend.next_from_date("content", "/a", "2024") == "2025"
+    db.query.assert_called_with(
+        TableName="content",
+        Limit=1,
+        ConsistentRead=True,
+        ScanIndexForward=True,
+        KeyConditionExpression="web_uri = :u and from_date > :d",
+        ProjectionExpression="from_date",
+        ExpressionAttributeValues={":u": {"S": "/a"}, ":d": {"S": "2024"}},
+    )
+
+    assert backend.latest_config_date("config", "exodus-config", "2026") == (
+        "2025"
+    )
+    db.query.assert_called_with(
+        TableName="config",
+        Limit=1,
+        ScanIndexForward=False,
+        KeyConditionExpression="config_id = :id and from_date <= :d",
+        ProjectionExpression="from_date",
+        ExpressionAttributeValues={
+            ":id": {"S": "exodus-config"},
+            ":d": {"S": "2026"},
+        },
+    )
@@ -0,0 +1,217 @@
+import contextvars
+import json
+import time
+
+import mock
+import pytest
+from botocore.exceptions import ClientError
+
+from exodus_lambda.functions import db as db_module
+from exodus_lambda.functions.db import (
+    Cassette,
+    DynamoDbError,
+    QueryHelper,
+    ReplayDynamoDbClient,
+)
+
+TABLE = {"name": "test", "available_regions": ["region1", "region2"]}
+
+
+def query_kwargs(web_uri="/some/uri", date="2020-02-17T00:00:00.000+00:00"):
+    return {
+        "TableName": "test",
+        "Limit": 1,
+        "ConsistentRead": True,
+        "ScanIndexForward": False,
+        "KeyConditionExpression": "web_uri = :u and from_date <= :d",
+        "ExpressionAttributeValues": {
+            ":u": {"S": web_uri},
+            ":d": {"S": date},
+        },
+    }
+
+
+RESPONSE = {
+    "Count": 1,
+    "Items": [
+        {
+            "web_uri": {"S": "/some/uri"},
+            "config": {"B": b"some config"},
+        }
+    ],
+}
+
+
+def test_record_and_replay(tmp_path):
+    """Queries recorded in one session are answered in another."""
+
+    path = str(tmp_path / "cassette.jsonl")
+    db = QueryHelper(
+        {"table": TABLE, "cassette": {"mode": "record", "path": path}}, None
+    )
+    region1 = mock.Mock()
+    region1.query.side_effect = [
+        ClientError(
+            {
+                "Error": {"Code": "ThrottlingException", "Message": "slow"},
+                "ResponseMetadata": {"HTTPStatusCode": 400},
+            },
+            "Query",
+        ),
+        RuntimeError("oops"),
+        {**RESPONSE, "ResponseMetadata": {"RequestId": "abc"}},
+    ]
+    region2 = mock.Mock()
+    region2.query.side_effect = [RESPONSE, RESPONSE]
+    db._clients.update(region1=region1, region2=region2)
+
+    assert db.query(**query_kwargs()) == RESPONSE
+    assert db.query(**query_kwargs("/other")) == RESPONSE
+    assert db.query(**query_kwargs())["ResponseMetadata"]
+
+    with open(path) as log:
+        entries = [json.loads(line) for line in log]
+    assert [(e["region"], "error" in e) for e in entries] == [
+        ("region1", True),
+        ("region2", False),
+        ("region1", True),
+        ("region2", False),
+        ("region1", False),
+    ]
+    assert entries[0]["error"] == {
+        "status": 400,
+        "code": "ThrottlingException",
+        "message": (
+            "An error occurred (ThrottlingException) when calling the Query "
+            "operation: slow"
+        ),
+    }
+    assert entries[2]["error"] == {
+        "status": 0,
+        "code": "RuntimeError",
+        "message": "oops",
+    }
+    assert "ResponseMetadata" not in entries[4]["response"]
+
+    # Replay at a later date, with no clients at all.
+    db = QueryHelper(
+        {"table": TABLE, "cassette": {"mode": "replay", "path": path}}, None
+    )
+    later = "2024-01-01T00:00:00.000+00:00"
+
+    with db.request() as stats:
+        assert db.query(**query_kwargs(date=later)) == RESPONSE
+    assert db.health("region1").consecutive_failures == 1
+
+    # Outcomes for the same query are replayed in order...
+    assert db.query(**query_kwargs(date=later)) == RESPONSE
+    assert db.health("region1").consecutive_failures == 0
+
+    # ...and the last one is then repeated.
+    assert db.query(**query_kwargs(date=later)) == RESPONSE
+    assert stats.queries == 1
+
+    # Queries which weren't recorded fail.
+    with pytest.raises(LookupError, match="No recorded response"):
+        db.query(**query_kwargs("/unknown"))
+
+    assert isinstance(db._client("region1"), ReplayDynamoDbClient)
+    assert db.connection_stats() == {}
+    for thread in db.prewarm(["test"]):
+        thread.join()
+
+
+def test_replay_region_preference():
+    """Outcomes recorded in the queried region are preferred."""
+
+    params = query_kwargs()
+    cassette = Cassette(
+        [
+            {"region": "region1", "latency": 0.1, "params": params},
+            {"region": "region2", "latency": 0.2, "params": params},
+        ]
+    )
+
+    assert len(cassette) == 2
+    assert cassette.next_entry("region2", params)["latency"] == 0.2
+    assert cassette.next_entry("region1", params)["latency"] == 0.1
+    # Nothing recorded in region3, so any region's outcome is used.
+    assert cassette.next_entry("region3", params)["latency"] == 0.1
+    assert cassette.next_entry("region3", query_kwargs("/other")) is None
+
+
+def test_replay_latency():
+    """Recorded latency and errors are replayed."""
+
+    params = query_kwargs()
+    cassette = Cassette(
+        [
+            {
+                "region": "region1",
+                "latency": 0.25,
+                "params": params,
+                "error": {"status": 500, "code": "Oops", "message": "oops"},
+            }
+        ]
+    )
+    client = ReplayDynamoDbClient(cassette, "region1", replay_latency=True)
+
+    with mock.patch("time.sleep") as sleep, pytest.raises(
+        DynamoDbError, match="Oops"
+    ):
+        client.query(**params)
+
+    sleep.assert_called_once_with(0.25)
+
+
+def test_replay_latency_deadline():
+    """Replayed latency is limited to the deadline of the attempt."""
+
+    params = query_kwargs()
+    cassette = Cassette(
+        [
+            {"region": "region1", "latency": 5, "params": params},
+            {"region": "region2", "latency": 5, "params": params},
+        ]
+    )
+    with mock.patch.object(Cassette, "from_file", return_value=cassette):
+        db = QueryHelper(
+            {
+                "table": TABLE,
+                "cassette": {
+                    "mode": "replay",
+                    "path": "cassette.json",
+                    "replay_latency": True,
+                },
+            },
+            None,
+        )
+
+    with mock.patch("time.sleep") as sleep, db.request(budget=0.2):
+        with pytest.raises(TimeoutError):
+            db.query(**params)
+
+    # Each region got its share of the budget.
+    assert sleep.call_count == 2
+    assert all(call.args[0] <= 0.2 for call in sleep.call_args_list)
+
+
+def test_replay_latency_no_time_left():
+    """Nothing is replayed once the attempt's deadline has passed."""
+
+    params = query_kwargs()
+    cassette = Cassette(
+        [{"region": "region1", "latency": 5, "params": params}]
+    )
+    client = ReplayDynamoDbClient(cassette, "region1", replay_latency=True)
+
+    def query():
+        db_module._ATTEMPT_DEADLINE.set(time.monotonic() - 1)
+        client.query(**params)
+
+    with mock.patch("time.sleep") as sleep, pytest.raises(
+        TimeoutError, match="No time left"
+    ):
+        contextvars.copy_context().run(query)
+
+    sleep.assert_not_called()
@@ -0,0 +1,128 @@
+# Tests for concurrent lookup of candidate URIs.
+import copy
+import threading
+
+import mock
+import pytest
+
+from exodus_lambda.functions.origin_request import OriginRequest
+
+from ..test_utils.utils import generate_test_config, mock_definitions
+
+TEST_CONF = generate_test_config()
+
+
+def fake_table(items):
+    # Returns a fake query function serving items from a dict of
+    # {web_uri: object_key}, independent of the order of queries.
+    def query(**kwargs):
+        uri = kwargs["ExpressionAttributeValues"][":u"]["S"]
+        if uri not in items:
+            return {"Items": []}
+        return {
+            "Items": [
+                {
+                    "web_uri": {"S": uri},
+                    "from_date": {"S": "2020-02-17T00:00:00.000+00:00"},
+                    "object_key": {"S": items[uri]},
+                    "content_type": {"S": "text/plain"},
+                }
+            ]
+        }
+
+    return query
+
+
+def handle(uri, concurrent, items):
+    conf = copy.deepcopy(TEST_CONF)
+    conf["concurrent_lookups"] = concurrent
+    conf["mirror_reads"] = "true"
+
+    with mock.patch(
+        "exodus_lambda.functions.origin_request.cachetools"
+    ) as mocked_cache, mock.patch("boto3.client") as mocked_client:
+        mocked_cache.TTLCache.return_value = {
+            "exodus-config": mock_definitions()
+        }
+        mocked_client().query.side_effect = fake_table(items)
+
+        event = {"Records": [{"cf": {"request": {"uri": uri, "headers": {}}}}]}
+        return OriginRequest(conf_file=conf).handler(event, context=None)
+
+
+RHEL7 = "/content/dist/rhel/server/7"
+INDEX = ".__exodus_autoindex"
+
+
+@pytest.mark.parametrize(
+    "uri, items",
+    [
+        (f"{RHEL7}/7Server/file.ext", {}),
+        (f"{RHEL7}/7Server/file.ext", {f"{RHEL7}/7.9/file.ext": "a"}),
+        (f"{RHEL7}/7Server/file.ext", {f"{RHEL7}/7Server/file.ext": "b"}),
+        (
+            f"{RHEL7}/7Server/file.ext",
+            {f"{RHEL7}/7.9/file.ext": "a", f"{RHEL7}/7Server/file.ext": "b"},
+        ),
+        (f"{RHEL7}/7Server/file.ext", {f"{RHEL7}/7.9/file.ext": "absent"}),
+        (f"{RHEL7}/7Server/repo", {f"{RHEL7}/7.9/repo/{INDEX}": "index"}),
+        (f"{RHEL7}/7Server/repo/", {f"{RHEL7}/7.9/repo/{INDEX}": "index"}),
+        (
+            f"{RHEL7}/7Server/repo",
+            {
+                f"{RHEL7}/7.9/repo/{INDEX}": "index",
+                f"{RHEL7}/7Server/repo": "file",
+            },
+        ),
+        (f"{RHEL7}/7Server/repo/{INDEX}", {f"{RHEL7}/7.9/repo/{INDEX}": "x"}),
+        (f"{RHEL7}/listing", {}),
+        (f"{RHEL7}/listing", {f"{RHEL7}/listing": "listing-file"}),
+        ("/content/dist/rhel/rhui/server/7/7Server/f", {}),
+    ],
+)
+def test_concurrent_matches_sequential(uri, items):
+    """Concurrent lookups give the same responses as sequential lookups."""
+
+    sequential = handle(uri, False, items)
+    concurrent = handle(uri, True, items)
+
+    assert concurrent == sequential
+
+
+def test_concurrent_precedence():
+    """A slow higher-priority lookup wins over a fast lower-priority one."""
+
+    preferred = f"{RHEL7}/7.9/file.ext"
+    mirrored = f"{RHEL7}/7Server/file.ext"
+    items = {preferred: "preferred", mirrored: "mirrored"}
+    query = fake_table(items)
+    mirrored_done = threading.Event()
+
+    def slow_query(**kwargs):
+        uri = kwargs["ExpressionAttributeValues"][":u"]["S"]
+        if uri == preferred:
+            # Don't answer until the lower priority lookup has finished.
+            assert mirrored_done.wait(10)
+        out = query(**kwargs)
+        if uri == mirrored:
+            mirrored_done.set()
+        return out
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["concurrent_lookups"] = True
+    conf["mirror_reads"] = "true"
+
+    with mock.patch(
+        "exodus_lambda.functions.origin_request.cachetools"
+    ) as mocked_cache, mock.patch("boto3.client") as mocked_client:
+        mocked_cache.TTLCache.return_value = {
+            "exodus-config": mock_definitions()
+        }
+        mocked_client().query.side_effect = slow_query
+
+        event = {
+            "Records": [{"cf": {"request": {"uri": mirrored, "headers": {}}}}]
+        }
+        out = OriginRequest(conf_file=conf).handler(event, context=None)
+
+    assert out["uri"] == "/preferred"
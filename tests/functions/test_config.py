@@ -0,0 +1,102 @@
+import os
+import sys
+
+import mock
+import pytest
+
+from exodus_lambda.functions.alias import AliasIndex
+from exodus_lambda.functions.config import (
+    ConfigSnapshot,
+    read_config_file,
+    write_config_file,
+)
+from exodus_lambda.functions.origin_request import OriginRequest
+
+from ..test_utils.utils import generate_test_config, mock_definitions
+
+TEST_CONF = generate_test_config()
+
+
+def test_config_snapshot():
+    """Config is compiled into aliases and prerendered listings."""
+
+    definitions = mock_definitions()
+    config = ConfigSnapshot(definitions, 3)
+
+    assert config.generation == 3
+    assert config.definitions is definitions
+    assert sorted(config.aliases) == [
+        "origin_alias",
+        "releasever_alias",
+        "rhui_alias",
+    ]
+    assert isinstance(config.aliases["rhui_alias"], AliasIndex)
+
+    target = "/content/dist/rhel/server/7"
+    assert config.listing(target) == (
+        "\n".join(definitions["listing"][target]["values"]) + "\n"
+    )
+    assert config.listing("/unknown") is None
+    [key] = [key for key in config.listings if key == target]
+    assert key is sys.intern(target)
+
+
+def test_config_snapshot_empty():
+    """A config without aliases or listings can be compiled."""
+
+    config = ConfigSnapshot({"listing": {"/empty": {}}}, 1)
+
+    assert config.aliases["origin_alias"].resolve("/a") == "/a"
+    assert not config.listings
+
+
+def test_config_snapshot_immutable():
+    """Snapshots can't be modified."""
+
+    config = ConfigSnapshot({}, 1)
+
+    with pytest.raises(AttributeError):
+        config.generation = 2
+    with pytest.raises(AttributeError):
+        del config.listings
+    with pytest.raises(TypeError):
+        config.aliases["origin_alias"] = None
+
+
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_config_consistent_within_request(mocked_cache):
+    """A request keeps using the config it started with, even if a new
+    config is loaded meanwhile."""
+
+    cache = {"exodus-config": mock_definitions()}
+    mocked_cache.TTLCache.return_value = cache
+    uri = "/content/dist/rhel/server/7/listing"
+
+    req = OriginRequest(conf_file=TEST_CONF)
+    config = req.config
+    assert req.config is config
+
+    cache["exodus-config"] = {"listing": {}}
+    assert req.handle_listing_request(uri, config)["status"] == "200"
+    assert not req.handle_listing_request(uri)
+    assert req.generation == config.generation + 1
+
+
+def test_config_file(tmp_path):
+    """Config written to a file can be read back."""
+
+    path = str(tmp_path / "config.json")
+    write_config_file(path, {"listing": {}}, "2024-01-01")
+    write_config_file(path, mock_definitions(), "2024-02-01")
+
+    assert read_config_file(path) == (mock_definitions(), "2024-02-01")
+    assert os.listdir(tmp_path) == ["config.json"]
+
+    # Nothing is left behind if writing fails.
+    with pytest.raises(TypeError):
+        write_config_file(path, {"bad": object()}, None)
+    assert os.listdir(tmp_path) == ["config.json"]
+
+    (tmp_path / "bad.json").write_text("[]")
+    with pytest.raises(ValueError, match="Not a config file"):
+        read_config_file(str(tmp_path / "bad.json"))
@@ -0,0 +1,84 @@
+import logging
+
+import mock
+
+from exodus_lambda.functions.health import RegionHealth
+
+
+def test_breaker_lifecycle(caplog):
+    """Breaker opens after repeated failures, probes after cooldown and
+    closes again on success."""
+
+    caplog.set_level(logging.INFO)
+    timer = mock.Mock(return_value=100.0)
+    health = RegionHealth(
+        "region1", failure_threshold=3, cooldown=30, timer=timer
+    )
+
+    for _ in range(2):
+        health.record_failure()
+        assert health.available()
+
+    # Third consecutive failure trips the breaker.
+    health.record_failure()
+    assert health.state == RegionHealth.OPEN
+    assert not health.available()
+    assert (
+        "Region region1 is unhealthy after 3 consecutive failures, "
+        "skipping for 30 seconds" in caplog.messages
+    )
+
+    # After cooldown, a single probe is allowed. Checking doesn't use it up.
+    timer.return_value = 131.0
+    assert health.available()
+    assert health.available()
+    assert health.state == RegionHealth.OPEN
+    health.begin_query()
+    assert health.state == RegionHealth.HALF_OPEN
+    assert not health.available()
+    assert "Probing region region1 after cooldown" in caplog.messages
+
+    # Queries sent anyway while half-open don't restart the cooldown.
+    timer.return_value = 140.0
+    health.begin_query()
+
+    # A failed probe reopens the breaker for another cooldown.
+    health.record_failure()
+    assert health.state == RegionHealth.OPEN
+    timer.return_value = 150.0
+    assert not health.available()
+
+    # A successful probe closes it.
+    timer.return_value = 171.0
+    assert health.available()
+    health.begin_query()
+    health.record_success(0.01)
+    assert health.state == RegionHealth.CLOSED
+    assert health.consecutive_failures == 0
+    health.begin_query()
+    assert health.available()
+    assert "Region region1 has recovered" in caplog.messages
+
+
+def test_breaker_success_resets():
+    """Only consecutive failures trip the breaker."""
+
+    health = RegionHealth("region1", failure_threshold=2)
+
+    health.record_failure()
+    health.record_success(0.01)
+    health.record_failure()
+
+    assert health.state == RegionHealth.CLOSED
+    assert list(health.latencies) == [0.01]
+
+
+def test_breaker_disabled():
+    """A failure_threshold of 0 disables the breaker."""
+
+    health = RegionHealth("region1", failure_threshold=0)
+
+    for _ in range(100):
+        health.record_failure()
+
+    assert health.available()
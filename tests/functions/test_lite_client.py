@@ -0,0 +1,494 @@
+import base64
+import json
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mock
+import pytest
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from exodus_lambda.functions.db import (
+    DeadlineExceeded,
+    DynamoDbError,
+    LiteDynamoDbClient,
+    QueryHelper,
+)
+
+
+class FakeDynamoDb(ThreadingHTTPServer):
+    # A local HTTP server standing in for DynamoDB. Each request is
+    # answered with the next (status, body, headers) from responses, after
+    # the next delay from delays if any, and recorded in requests.
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeDynamoDbHandler)
+        self.responses = []
+        self.delays = []
+        self.requests = []
+        self.connections = 0
+        self.close_after_response = False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections (e.g. on timeouts) are expected, so
+        # don't dump tracebacks to stderr.
+        pass
+
+
+class FakeDynamoDbHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers["content-length"])
+        self.server.requests.append(
+            (dict(self.headers), json.loads(self.rfile.read(length)))
+        )
+
+        status, body, headers = self.server.responses.pop(0)
+        if self.server.delays:
+            time.sleep(self.server.delays.pop(0))
+
+        # Simulates server closing an idle keep-alive connection without
+        # the client knowing.
+        self.close_connection = self.server.close_after_response
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        headers = {"x-amz-crc32": str(zlib.crc32(data)), **headers}
+
+        self.send_response(status)
+        self.send_header("content-length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "token")
+
+    out = FakeDynamoDb()
+    thread = threading.Thread(
+        target=out.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield out
+    out.shutdown()
+    out.server_close()
+
+
+def query_kwargs():
+    return {
+        "TableName": "test",
+        "Limit": 1,
+        "ConsistentRead": True,
+        "ScanIndexForward": False,
+        "KeyConditionExpression": "web_uri = :u and from_date <= :d",
+        "ExpressionAttributeValues": {
+            ":u": {"S": "/some/uri"},
+            ":d": {"S": "2020-02-17T00:00:00.000+00:00"},
+        },
+    }
+
+
+def test_lite_query(server):
+    """Query is sent as DynamoDB JSON and the response decoded as boto3
+    would."""
+
+    config = b'{"some": "config"}'
+    server.responses.append(
+        (
+            200,
+            {
+                "Count": 1,
+                "Items": [
+                    {
+                        "config": {"B": base64.b64encode(config).decode()},
+                        "nested": {
+                            "M": {
+                                "list": {"L": [{"BS": ["AA=="]}, {"N": "1"}]}
+                            }
+                        },
+                    }
+                ],
+            },
+            {},
+        )
+    )
+
+    client = LiteDynamoDbClient("us-east-1", endpoint_url=server.url)
+    kwargs = query_kwargs()
+    kwargs["ExpressionAttributeValues"][":b"] = {"B": b"\0"}
+    out = client.query(**kwargs)
+
+    assert out == {
+        "Count": 1,
+        "Items": [
+            {
+                "config": {"B": config},
+                "nested": {
+                    "M": {"list": {"L": [{"BS": [b"\0"]}, {"N": "1"}]}}
+                },
+            }
+        ],
+    }
+
+    headers, body = server.requests[0]
+    assert headers["x-amz-target"] == "DynamoDB_20120810.Query"
+    assert headers["content-type"] == "application/x-amz-json-1.0"
+    assert headers["x-amz-security-token"] == "token"
+    assert body["ExpressionAttributeValues"][":b"] == {"B": "AA=="}
+    assert body["KeyConditionExpression"] == (
+        "web_uri = :u and from_date <= :d"
+    )
+
+
+@mock.patch("exodus_lambda.functions.db.datetime")
+def test_lite_signature(mocked_datetime):
+    """Requests are signed identically to botocore."""
+
+    now = datetime(2024, 5, 6, 7, 8, 9, tzinfo=timezone.utc)
+    mocked_datetime.now.return_value = now
+    env = {
+        "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+        "AWS_SECRET_ACCESS_KEY": "secret",
+        "AWS_SESSION_TOKEN": "token",
+    }
+    payload = json.dumps(query_kwargs()).encode()
+
+    client = LiteDynamoDbClient("eu-west-1")
+    with mock.patch.dict("os.environ", env):
+        headers = client._headers("Query", payload)
+        # Signing key is cached and reused.
+        assert client._headers("Query", payload) == headers
+
+    request = AWSRequest(
+        method="POST",
+        url="https://dynamodb.eu-west-1.amazonaws.com/",
+        data=payload,
+        headers={
+            "content-type": "application/x-amz-json-1.0",
+            "x-amz-target": "DynamoDB_20120810.Query",
+        },
+    )
+    with mock.patch(
+        "botocore.auth.get_current_datetime",
+        return_value=now.replace(tzinfo=None),
+    ):
+        SigV4Auth(
+            Credentials("AKIDEXAMPLE", "secret", "token"),
+            "dynamodb",
+            "eu-west-1",
+        ).add_auth(request)
+
+    assert headers["authorization"] == request.headers["Authorization"]
+    assert headers["host"] == "dynamodb.eu-west-1.amazonaws.com"
+
+
+def test_lite_no_credentials(monkeypatch):
+    """A clear error is raised if credentials are missing."""
+
+    monkeypatch.delenv("AWS_ACCESS_KEY_ID", raising=False)
+    client = LiteDynamoDbClient("us-east-1")
+
+    with pytest.raises(RuntimeError, match="AWS credentials are not"):
+        client.query(TableName="test")
+
+
+def test_lite_unsupported_params():
+    """Parameters which aren't implemented are rejected."""
+
+    client = LiteDynamoDbClient("us-east-1")
+
+    with pytest.raises(TypeError, match=": FilterExpression, Select"):
+        client.query(TableName="test", Select="COUNT", FilterExpression="x")
+
+    with pytest.raises(TypeError, match="Can't encode set"):
+        client.query(
+            TableName="test", ExpressionAttributeValues={":x": {"SS": {"a"}}}
+        )
+
+
+@pytest.mark.parametrize(
+    "status, body, headers, expected",
+    [
+        (
+            400,
+            {
+                "__type": "com.amazonaws.dynamodb.v20120810"
+                "#ResourceNotFoundException",
+                "message": "Requested resource not found",
+            },
+            {},
+            "ResourceNotFoundException (400): Requested resource not found",
+        ),
+        (500, {"Message": "oops"}, {}, "Unknown (500): oops"),
+        (502, b"<html>Bad Gateway</html>", {}, "Unknown (502): "),
+        (
+            200,
+            {"Items": []},
+            {"x-amz-crc32": "123"},
+            "ChecksumError (200): CRC32 of response did not match",
+        ),
+    ],
+)
+def test_lite_errors(server, status, body, headers, expected):
+    """Error responses are raised as DynamoDbError, and error statuses
+    passed to the observer."""
+
+    server.responses.append((status, body, headers))
+    observer = mock.Mock()
+    client = LiteDynamoDbClient(
+        "us-east-1", endpoint_url=server.url, observer=observer
+    )
+
+    with pytest.raises(DynamoDbError) as excinfo:
+        client.query(TableName="test")
+
+    assert str(excinfo.value) == expected
+    assert excinfo.value.status == status
+    if status != 200:
+        observer.assert_called_once_with(mock.ANY, excinfo.value.code)
+
+
+def test_lite_connection_reuse(server):
+    """Connections are kept alive and reused, and stale connections are
+    replaced."""
+
+    server.responses.extend([(200, {"Items": []}, {})] * 4)
+    client = LiteDynamoDbClient("us-east-1", endpoint_url=server.url)
+    db = QueryHelper({}, None)
+
+    with db.request() as stats:
+        client.query(TableName="test")
+        client.query(TableName="test")
+    assert server.connections == 1
+    assert stats.attempts == 2
+
+    # Server drops the connection after the next request; the following
+    # query should transparently use a new connection.
+    server.close_after_response = True
+    client.query(TableName="test")
+    client.query(TableName="test")
+
+    assert server.connections == 2
+    assert not server.responses
+
+    # A connection the server says it will close isn't reused.
+    server.close_after_response = False
+    server.responses.extend(
+        [(200, {"Items": []}, {"connection": "close"}), (200, {}, {})]
+    )
+    client.query(TableName="test")
+    assert not client._idle
+    client.query(TableName="test")
+    assert server.connections == 4
+
+
+def test_lite_connection_error(server):
+    """Errors on a new connection are raised."""
+
+    client = LiteDynamoDbClient("us-east-1", endpoint_url=server.url)
+
+    # Server drops the connection without answering.
+    server.responses.append((200, {"Items": []}, {}))
+    with mock.patch.object(
+        FakeDynamoDbHandler,
+        "do_POST",
+        lambda self: setattr(self, "close_connection", True),
+    ), pytest.raises(ConnectionError):
+        client.query(TableName="test")
+
+    # Timeouts also close the connection.
+    with mock.patch(
+        "http.client.HTTPConnection.getresponse", side_effect=TimeoutError
+    ), pytest.raises(TimeoutError):
+        client.query(TableName="test")
+
+    assert not client._idle
+
+
+def test_query_helper_lite(server):
+    """QueryHelper uses the lite client when configured."""
+
+    server.responses.extend(
+        [(200, {"Items": []}, {}), (200, {"Endpoints": []}, {})]
+    )
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": ["us-east-1"]},
+            "dynamodb_client": "lite",
+        },
+        server.url,
+    )
+
+    assert db.query(TableName="test") == {"Items": []}
+    assert isinstance(db._client("us-east-1"), LiteDynamoDbClient)
+
+    for thread in db.prewarm(["test"]):
+        thread.join()
+    assert not server.responses
+
+
+def test_lite_connection_pool_limits(server):
+    """Idle connections are limited in number and age."""
+
+    server.responses.extend([(200, {"Items": []}, {})] * 4)
+    client = LiteDynamoDbClient(
+        "us-east-1",
+        endpoint_url=server.url,
+        max_pool_connections=1,
+        tcp_keepalive=True,
+        idle_timeout=30,
+    )
+
+    # Two connections in use at once, but only one is kept afterwards.
+    conn1, _ = client._connection()
+    conn2, _ = client._connection()
+    assert conn1.sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    client._release(conn1)
+    client._release(conn2)
+    assert [c for c, _ in client._idle] == [conn1]
+    assert conn2.sock is None
+
+    client.query(TableName="test")
+    assert client.connection_stats == {"new": 2, "reused": 1}
+
+    # A connection idle for too long is not reused.
+    with mock.patch("time.monotonic", return_value=time.monotonic() + 60):
+        client.query(TableName="test")
+    assert client.connection_stats == {"new": 3, "reused": 1}
+
+
+@pytest.mark.parametrize("dynamodb_client", ["boto3", "lite"])
+def test_query_helper_connection_stats(server, dynamodb_client):
+    """Counts of new and reused connections are available for each
+    region's client."""
+
+    server.responses.extend([(200, {"Items": []}, {})] * 3)
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": ["us-east-1"]},
+            "dynamodb_client": dynamodb_client,
+            "max_pool_connections": 5,
+            "tcp_keepalive": True,
+        },
+        server.url,
+    )
+
+    for _ in range(3):
+        db.query(TableName="test")
+
+    assert db.connection_stats() == {"us-east-1": {"new": 1, "reused": 2}}
+    if dynamodb_client == "boto3":
+        config = db._client("us-east-1").meta.config
+        assert config.max_pool_connections == 5
+        assert config.tcp_keepalive is True
+
+
+def test_query_helper_connection_stats_unavailable():
+    """Clients without the expected internals are left out of stats."""
+
+    db = QueryHelper({}, None)
+    db._clients["us-east-1"] = mock.Mock(spec=["query"])
+
+    assert db.connection_stats() == {}
+
+
+def test_query_helper_lite_metrics(server):
+    """Metrics are recorded for responses to the lite client."""
+
+    server.responses.extend(
+        [
+            (200, {"Items": []}, {}),
+            (400, {"__type": "x#ThrottlingException"}, {}),
+        ]
+    )
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": ["us-east-1"]},
+            "dynamodb_client": "lite",
+            "metrics": {"enabled": True},
+        },
+        server.url,
+    )
+
+    db.query(TableName="test")
+    with pytest.raises(DynamoDbError):
+        db.query(TableName="test")
+
+    [doc] = db.metrics.flush()
+    assert len(doc["Latency"]) == 2
+    assert doc["Throttles"] == 1
+
+
+@pytest.mark.parametrize("dynamodb_client", ["boto3", "lite"])
+def test_query_helper_attempt_deadline(server, dynamodb_client):
+    """Each attempt is limited to its share of the request's budget by the
+    client itself, leaving time to fail over."""
+
+    server.responses.extend([(200, {"Items": []}, {})] * 2)
+    server.delays.append(2)
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["us-east-1", "us-west-2"],
+            },
+            "dynamodb_client": dynamodb_client,
+        },
+        server.url,
+    )
+
+    start = time.monotonic()
+    with db.request(budget=1):
+        assert db.query(TableName="test")["Items"] == []
+
+    assert time.monotonic() - start < 1
+    # Timed out attempt wasn't retried.
+    assert len(server.requests) == 2
+    assert not db._attempt_executor
+
+
+@pytest.mark.parametrize("dynamodb_client", ["boto3", "lite"])
+def test_query_helper_attempt_deadline_exceeded(server, dynamodb_client):
+    """DeadlineExceeded is raised once the last attempt times out."""
+
+    server.responses.extend([(200, {"Items": []}, {})] * 2)
+    server.delays.extend([2, 2])
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["us-east-1", "us-west-2"],
+            },
+            "dynamodb_client": dynamodb_client,
+        },
+        server.url,
+    )
+
+    with db.request(budget=0.5):
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            db.query(TableName="test")
+
+    assert "did not complete before deadline" in str(excinfo.value)
+    assert len(server.requests) == 2
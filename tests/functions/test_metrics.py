@@ -0,0 +1,242 @@
+import threading
+
+import mock
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import EndpointConnectionError
+
+from exodus_lambda.functions.db import QueryHelper
+from exodus_lambda.functions.metrics import Metrics
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_metrics_flush():
+    """Metrics are output as EMF documents, one per region."""
+
+    timer = FakeTimer()
+    metrics = Metrics(namespace="test", flush_interval=10, timer=timer)
+    assert not metrics.due()
+
+    metrics.record_response("r1", 0.0123)
+    metrics.record_response("r1", 0.5, "ThrottlingException")
+    metrics.record_response("r1", 0.02, "InternalServerError")
+    metrics.increment("Failovers", "r2")
+    assert not metrics.due()
+
+    timer.now = 10
+    assert metrics.due()
+
+    with mock.patch("time.time", return_value=1700000000.123):
+        docs = metrics.flush()
+
+    assert docs == [
+        {
+            "Region": "r1",
+            "Latency": [12.3, 500.0, 20.0],
+            "Retries": 0,
+            "Throttles": 1,
+            "Failovers": 0,
+            "Hedges": 0,
+            "ConfigRefreshFailures": 0,
+            "NegativeCacheHits": 0,
+            "NegativeCacheMisses": 0,
+            "UriCacheHits": 0,
+            "UriCacheMisses": 0,
+            "_aws": {
+                "Timestamp": 1700000000123,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": "test",
+                        "Dimensions": [["Region"]],
+                        "Metrics": [
+                            {"Name": "Latency", "Unit": "Milliseconds"},
+                            {"Name": "Retries", "Unit": "Count"},
+                            {"Name": "Throttles", "Unit": "Count"},
+                            {"Name": "Failovers", "Unit": "Count"},
+                            {"Name": "Hedges", "Unit": "Count"},
+                            {
+                                "Name": "ConfigRefreshFailures",
+                                "Unit": "Count",
+                            },
+                            {"Name": "NegativeCacheHits", "Unit": "Count"},
+                            {"Name": "NegativeCacheMisses", "Unit": "Count"},
+                            {"Name": "UriCacheHits", "Unit": "Count"},
+                            {"Name": "UriCacheMisses", "Unit": "Count"},
+                        ],
+                    }
+                ],
+            },
+        },
+        {
+            "Region": "r2",
+            "Retries": 0,
+            "Throttles": 0,
+            "Failovers": 1,
+            "Hedges": 0,
+            "ConfigRefreshFailures": 0,
+            "NegativeCacheHits": 0,
+            "NegativeCacheMisses": 0,
+            "UriCacheHits": 0,
+            "UriCacheMisses": 0,
+            "_aws": mock.ANY,
+        },
+    ]
+
+    # Everything was flushed.
+    timer.now = 100
+    assert not metrics.due()
+    assert metrics.flush() == []
+
+
+def test_metrics_many_values():
+    """Latency values beyond the EMF limit are split across documents."""
+
+    metrics = Metrics(timer=FakeTimer())
+
+    for _ in range(Metrics.MAX_VALUES * 2 + 1):
+        metrics.record_latency("r1", 0.001)
+        assert metrics.due() == (
+            len(metrics._latencies["r1"]) >= Metrics.MAX_VALUES
+        )
+
+    docs = metrics.flush()
+    assert [len(doc["Latency"]) for doc in docs] == [100, 100, 1]
+    assert "Retries" in docs[0]
+    assert "Retries" not in docs[1]
+    assert docs[1]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [
+        {"Name": "Latency", "Unit": "Milliseconds"}
+    ]
+
+
+def fake_responses(client, responses):
+    # Makes the client respond to each HTTP request with the next
+    # (status, error code) from responses, or raise if an exception is
+    # given, without sending anything.
+    responses = iter(responses)
+
+    def send(request, **_kwargs):
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        status, code = response
+        body = b'{"Items": [], "Count": 0}'
+        if code:
+            body = (
+                b'{"__type": "com.amazonaws.dynamodb.v20120810#'
+                + code.encode()
+                + b'", "message": "simulated error"}'
+            )
+        return AWSResponse(
+            request.url,
+            status,
+            {},
+            mock.Mock(**{"stream.return_value": iter([body])}),
+        )
+
+    client.meta.events.register("before-send.dynamodb.Query", send)
+
+
+@pytest.fixture
+def metrics_helper(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "fake")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "fake")
+    monkeypatch.setattr("botocore.endpoint.time.sleep", lambda _: None)
+
+    def make(regions, **conf):
+        db = QueryHelper(
+            {
+                "table": {"name": "test", "available_regions": list(regions)},
+                "metrics": {"enabled": True},
+                **conf,
+            },
+            "https://dynamodb.example.com",
+        )
+        for region, responses in regions.items():
+            fake_responses(db._client(region), responses)
+        return db
+
+    return make
+
+
+def test_metrics_boto3(metrics_helper):
+    """Latency, retries, throttles and failovers are recorded from
+    botocore's events."""
+
+    db = metrics_helper(
+        {
+            "us-east-1": [(400, "ThrottlingException")],
+            "us-east-2": [
+                (500, "InternalServerError"),
+                EndpointConnectionError(endpoint_url="https://example.com"),
+                (200, None),
+            ],
+        },
+        retries={"mode": "standard", "max_attempts": 3},
+    )
+
+    assert db.query(TableName="test")["Count"] == 0
+
+    docs = {doc["Region"]: doc for doc in db.metrics.flush()}
+    assert len(docs["us-east-1"]["Latency"]) == 1
+    assert docs["us-east-1"]["Throttles"] == 1
+    assert docs["us-east-1"]["Retries"] == 0
+    # The attempt with no response isn't measured.
+    assert len(docs["us-east-2"]["Latency"]) == 2
+    assert docs["us-east-2"]["Retries"] == 2
+    assert docs["us-east-2"]["Failovers"] == 1
+
+
+def test_metrics_hedged_failover():
+    """Failovers are recorded for hedged queries."""
+
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": ["r1", "r2"]},
+            "hedging": {"enabled": True},
+            "metrics": {"enabled": True},
+        },
+        None,
+    )
+    db._clients["r1"] = mock.Mock(**{"query.side_effect": RuntimeError()})
+    db._clients["r2"] = mock.Mock(**{"query.return_value": {"Items": []}})
+
+    assert db.query(TableName="test") == {"Items": []}
+
+    docs = db.metrics.flush()
+    assert [(doc["Region"], doc["Failovers"]) for doc in docs] == [("r2", 1)]
+
+
+def test_metrics_hedges():
+    """Hedged queries are counted against the region hedged to."""
+
+    release = threading.Event()
+
+    def slow_query(**_):
+        assert release.wait(5)
+        return {"Items": []}
+
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": ["r1", "r2"]},
+            "hedging": {"enabled": True, "delay_ms": 10},
+            "metrics": {"enabled": True},
+        },
+        None,
+    )
+    db._clients["r1"] = mock.Mock(**{"query.side_effect": slow_query})
+    db._clients["r2"] = mock.Mock(**{"query.return_value": {"Items": []}})
+
+    try:
+        assert db.query(TableName="test") == {"Items": []}
+    finally:
+        release.set()
+
+    docs = db.metrics.flush()
+    assert [(doc["Region"], doc["Hedges"]) for doc in docs] == [("r2", 1)]
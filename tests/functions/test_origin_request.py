@@ -2,11 +2,14 @@ import copy
 import gzip
 import json
 import logging
+import threading
+from datetime import datetime, timedelta, timezone
 from urllib.parse import unquote, urlencode
 
 import mock
 import pytest
 
+from exodus_lambda.functions.config import read_config_file, write_config_file
 from exodus_lambda.functions.origin_request import OriginRequest
 
 from ..test_utils.utils import generate_test_config, mock_definitions
@@ -164,11 +167,11 @@ def test_origin_request_db_failover(
     mocked_cache.TTLCache.return_value = {"exodus-config": mock_definitions()}
 
     # Simulate dynamodb raising errors in some regions.
-    bad_client1 = mock.Mock(spec=["query"])
+    bad_client1 = mock.Mock(spec=["query", "meta"])
     bad_client1.query.side_effect = RuntimeError("simulated error 1")
-    bad_client2 = mock.Mock(spec=["query"])
+    bad_client2 = mock.Mock(spec=["query", "meta"])
     bad_client2.query.side_effect = RuntimeError("simulated error 2")
-    good_client = mock.Mock(spec=["query"])
+    good_client = mock.Mock(spec=["query", "meta"])
     good_client.query.return_value = {
         "Items": [
             {
@@ -413,6 +416,316 @@ def test_origin_request_definitions_cache(
     assert mocked_boto3_client().query.call_count == count
 
 
+def config_response(defs, from_date="2020-02-17T00:00:00.000+00:00"):
+    return {
+        "Items": [
+            {
+                "from_date": {"S": from_date},
+                "config_id": {"S": "exodus-config"},
+                "config": {"S": json.dumps(defs)},
+            }
+        ]
+    }
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+def test_origin_request_definitions_stale_while_revalidate(
+    mocked_time, mocked_boto3_client, caplog
+):
+    """Expired config is used while it's refreshed in the background, for
+    up to max_stale seconds."""
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["config_cache_ttl"] = 2
+    conf["config_refresh"] = {"max_stale": 60}
+    mocked_boto3_client().query.side_effect = [
+        config_response({"v": 1}, "2020-01-01"),
+        config_response({"v": 2}, "2020-01-02"),
+        config_response({"v": 2}, "2020-01-02"),
+        RuntimeError("simulated error"),
+        config_response({"v": 3}, "2020-01-03"),
+        config_response({"v": 3}, "2020-01-03"),
+    ]
+    mocked_time.return_value = 1000.0
+    obj = OriginRequest(conf_file=conf)
+
+    def definitions():
+        version = obj.definitions["v"]
+        if obj._config_refresh:
+            obj._config_refresh.join()
+        return version
+
+    assert definitions() == 1
+
+    # Expired: v1 is still used, while v2 is loaded.
+    mocked_time.return_value = 1130.0
+    assert definitions() == 1
+    assert definitions() == 2
+
+    # Refresh fails: v2 continues to be used.
+    mocked_time.return_value = 1260.0
+    assert definitions() == 2
+    assert "Failed to load config (1 consecutive failures)" in caplog.text
+    assert mocked_boto3_client().query.call_count == 4
+
+    # Expired for longer than max_stale: waits for v3.
+    mocked_time.return_value = 1311.0
+    assert obj.definitions["v"] == 3
+    assert mocked_boto3_client().query.call_count == 6
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+def test_origin_request_definitions_stale_if_error(
+    mocked_time, mocked_boto3_client, monkeypatch, caplog
+):
+    """The last loaded config is used if loading config fails, with
+    exponential backoff between attempts."""
+
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    conf = copy.deepcopy(TEST_CONF)
+    conf["metrics"] = {"enabled": True}
+    response = config_response({"v": 1})
+
+    def query(**_kwargs):
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    mocked_boto3_client().query.side_effect = query
+    mocked_time.return_value = 1000.0
+    obj = OriginRequest(conf_file=conf)
+    assert obj.definitions["v"] == 1
+    queries = mocked_boto3_client().query.call_count
+
+    # Every region fails: v1 is used, and the next attempt is a second later.
+    response = RuntimeError("simulated error")
+    mocked_time.return_value = 1200.0
+    assert obj.definitions["v"] == 1
+    assert "Using last loaded config from 200 seconds ago" in caplog.text
+    assert "next attempt in 1 seconds" in caplog.text
+    assert mocked_boto3_client().query.call_count > queries
+    queries = mocked_boto3_client().query.call_count
+
+    mocked_time.return_value = 1200.5
+    assert obj.definitions["v"] == 1
+    assert mocked_boto3_client().query.call_count == queries
+
+    # Fails again: the next attempt is two seconds later.
+    mocked_time.return_value = 1201.0
+    assert obj.definitions["v"] == 1
+    assert "next attempt in 2 seconds" in caplog.text
+
+    [doc] = obj._db.metrics.flush()
+    assert doc["Region"] == "us-east-1"
+    assert doc["ConfigRefreshFailures"] == 2
+
+    response = config_response({"v": 2}, "2020-03-01")
+    mocked_time.return_value = 1202.0
+    assert obj.definitions["v"] == 1
+    mocked_time.return_value = 1203.0
+    assert obj.definitions["v"] == 2
+    assert obj._config_failures == 0
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+def test_origin_request_definitions_no_stale_if_error(
+    mocked_time, mocked_boto3_client
+):
+    """Errors loading config are raised if there's no config to fall back
+    to, or stale_if_error is false."""
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["config_refresh"] = {"stale_if_error": False}
+    mocked_boto3_client().query.side_effect = RuntimeError("simulated error")
+    mocked_time.return_value = 1000.0
+    obj = OriginRequest(conf_file=conf)
+
+    with pytest.raises(RuntimeError):
+        obj.definitions
+
+    mocked_boto3_client().query.side_effect = None
+    mocked_boto3_client().query.return_value = config_response({})
+    assert obj.definitions == {}
+
+    mocked_boto3_client().query.side_effect = RuntimeError("simulated error")
+    mocked_time.return_value = 1200.0
+    with pytest.raises(RuntimeError):
+        obj.definitions
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+def test_origin_request_definitions_unchanged(
+    mocked_time, mocked_boto3_client
+):
+    """Config is only fetched again if a newer config is in effect."""
+
+    query = mocked_boto3_client().query
+    query.return_value = config_response({"v": 1}, "2020-01-01")
+    mocked_time.return_value = 1000.0
+    obj = OriginRequest(conf_file=TEST_CONF)
+    definitions = obj.definitions
+    generation = obj.generation
+
+    # Expired, but unchanged: only from_date is queried, and the loaded
+    # config is kept along with everything derived from it.
+    mocked_time.return_value = 1200.0
+    assert obj.definitions is definitions
+    assert obj.generation == generation
+    assert query.call_count == 2
+    assert query.call_args.kwargs["ProjectionExpression"] == "from_date"
+
+    # A newer config is in effect.
+    query.return_value = config_response({"v": 2}, "2020-01-02")
+    mocked_time.return_value = 1400.0
+    assert obj.definitions == {"v": 2}
+    assert obj.generation == generation + 1
+    assert query.call_count == 4
+    assert "ProjectionExpression" not in query.call_args.kwargs
+
+
+@mock.patch("boto3.client")
+def test_origin_request_definitions_seeded(
+    mocked_boto3_client, tmp_path, caplog
+):
+    """Saved or seed config is used while config is loaded."""
+
+    cache_file = str(tmp_path / "cache.json")
+    seed_file = str(tmp_path / "seed.json")
+    write_config_file(seed_file, {"v": "seed"}, "2020-01-01")
+    conf = copy.deepcopy(TEST_CONF)
+    conf["config_cache_file"] = cache_file
+    conf["config_seed_file"] = seed_file
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def query(**_kwargs):
+        started.set()
+        release.wait()
+        return config_response({"v": "table"}, "2020-02-01")
+
+    mocked_boto3_client().query.side_effect = query
+
+    obj = OriginRequest(conf_file=conf)
+    assert f"Using config from {seed_file} (from_date 2020-01-01)" in (
+        caplog.text
+    )
+
+    # Seed config is used at once, while config is loaded in the background.
+    # Each is compiled as it's loaded, rather than by requests.
+    assert obj._config.definitions == {"v": "seed"}
+    assert obj.definitions == {"v": "seed"}
+    started.wait()
+    release.set()
+    obj._config_refresh.join()
+    config = obj._config
+    assert config.definitions == {"v": "table"}
+    assert config.generation == 2
+    assert obj.definitions == {"v": "table"}
+    assert obj.config is config
+    assert read_config_file(cache_file) == ({"v": "table"}, "2020-02-01")
+
+    # The next instance uses the saved config, which is newer.
+    obj = OriginRequest(conf_file=conf)
+    assert obj.definitions == {"v": "table"}
+    obj._config_refresh.join()
+
+    # The config is unchanged, so isn't saved again.
+    assert obj.definitions == {"v": "table"}
+    assert "Config unchanged since 2020-02-01" in caplog.text
+
+
+@mock.patch("boto3.client")
+def test_origin_request_definitions_uncompilable(mocked_boto3_client, caplog):
+    """Config which can't be compiled counts as a failure to load it."""
+
+    mocked_boto3_client().query.return_value = config_response(
+        {"listing": {"/origin/rhel": {"var": "basearch"}}}
+    )
+
+    obj = OriginRequest(conf_file=TEST_CONF)
+    with pytest.raises(KeyError):
+        obj.definitions
+
+    assert obj._config is None
+    assert "Failed to load config (1 consecutive failures)" in caplog.text
+
+
+@mock.patch("boto3.client")
+def test_origin_request_definitions_bad_seed(
+    mocked_boto3_client, tmp_path, caplog
+):
+    """Unusable config files are ignored."""
+
+    seed_file = tmp_path / "seed.json"
+    seed_file.write_text("not json")
+    conf = copy.deepcopy(TEST_CONF)
+    conf["config_cache_file"] = str(tmp_path / "missing" / "cache.json")
+    conf["config_seed_file"] = str(seed_file)
+    mocked_boto3_client().query.return_value = config_response({"v": 1})
+
+    obj = OriginRequest(conf_file=conf)
+    assert f"Can't load config from {seed_file}, not using it" in caplog.text
+
+    assert obj.definitions == {"v": 1}
+    assert "Can't save config to" in caplog.text
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.random.uniform")
+def test_origin_request_definitions_ttl_jitter(mocked_uniform, _):
+    """Config TTL is randomly shortened by up to jitter."""
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["config_cache_ttl"] = 2
+    conf["config_refresh"] = {"jitter": 0.1}
+    mocked_uniform.return_value = 0.05
+
+    obj = OriginRequest(conf_file=conf)
+
+    mocked_uniform.assert_called_once_with(0, 0.1)
+    assert obj._cache.ttl == 114
+
+
+@mock.patch("boto3.client")
+def test_origin_request_definitions_coalesced(mocked_boto3_client):
+    """Threads needing the config at the same time only load it once."""
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def query(**_kwargs):
+        started.set()
+        release.wait()
+        return {"Items": []}
+
+    mocked_boto3_client().query.side_effect = query
+    obj = OriginRequest(conf_file=TEST_CONF)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(obj.definitions))
+    ]
+    threads[0].start()
+    started.wait()
+    threads.append(
+        threading.Thread(target=lambda: results.append(obj.definitions))
+    )
+    threads[1].start()
+    # Give the second thread a chance to start waiting.
+    threading.Event().wait(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert mocked_boto3_client().query.call_count == 1
+    assert results[0] is results[1]
+
+
 @pytest.mark.parametrize(
     "req_uri, real_uri",
     [
@@ -1602,3 +1915,622 @@ def test_origin_request_mirrored_reads_no_alias(
         )
     ]
     mocked_boto3_client().query.assert_has_calls(expected_boto_calls)
+
+
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_candidate_uris_cache(mocked_cache, caplog, monkeypatch):
+    """Candidate URIs are cached per request URI and config generation."""
+
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    cache = {"exodus-config": mock_definitions()}
+    mocked_cache.TTLCache.return_value = cache
+    uri = "/content/dist/rhel/rhui/server/7/7Server/file.ext"
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["metrics"] = {"enabled": True}
+    req = OriginRequest(conf_file=conf)
+
+    with mock.patch.object(
+        req, "resolve_aliases", wraps=req.resolve_aliases
+    ) as resolve:
+        first = req.candidate_uris(uri)
+        calls = resolve.call_count
+        assert calls
+
+        # Asking again gives the same answer without resolving again.
+        assert req.candidate_uris(uri) == first
+        assert resolve.call_count == calls
+
+        # Loading a new config invalidates cached results.
+        cache["exodus-config"] = mock_definitions()
+        assert req.candidate_uris(uri) == first
+        assert resolve.call_count == calls * 2
+
+    assert first == [
+        "/content/dist/rhel/server/7/7.9/file.ext",
+        "/content/dist/rhel/server/7/7Server/file.ext",
+    ]
+    assert caplog.messages[-1] == (
+        f"Candidate URIs for {uri}: {tuple(first)} (cache hits: 1, misses: 2)"
+    )
+
+    # Hits and misses are counted in metrics, against the local region.
+    [doc] = req._db.metrics.flush()
+    assert doc["Region"] == "us-east-1"
+    assert (doc["UriCacheHits"], doc["UriCacheMisses"]) == (1, 2)
+
+
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_candidate_uris_cache_disabled(mocked_cache):
+    """Caching of candidate URIs can be disabled."""
+
+    mocked_cache.TTLCache.return_value = {"exodus-config": mock_definitions()}
+    conf = copy.deepcopy(TEST_CONF)
+    conf["uri_cache_size"] = 0
+
+    req = OriginRequest(conf_file=conf)
+
+    req.candidate_uris("/some/uri")
+    req.candidate_uris("/some/uri")
+
+    assert req._uri_plans.stats == {"hits": 0, "misses": 2}
+
+
+@pytest.mark.parametrize(
+    "items, expected",
+    [
+        ([], {"status": "404", "statusDescription": "Not Found"}),
+        (
+            [
+                {
+                    "web_uri": {"S": TEST_PATH},
+                    "from_date": {"S": "2020-02-17T00:00:00.000+00:00"},
+                    "object_key": {"S": "absent"},
+                }
+            ],
+            {"status": "404", "statusDescription": "Not Found"},
+        ),
+    ],
+    ids=["missing", "absent"],
+)
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_negative_cache(
+    mocked_cache,
+    mocked_time,
+    mocked_boto3_client,
+    items,
+    expected,
+    caplog,
+    monkeypatch,
+):
+    """Misses and absent items are cached for negative_cache_ttl."""
+
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    mocked_cache.TTLCache.return_value = {"exodus-config": {}}
+    mocked_time.return_value = 1000.0
+    mocked_boto3_client().query.return_value = {"Items": items}
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["negative_cache_ttl"] = 5
+    conf["metrics"] = {"enabled": True}
+    req = OriginRequest(conf_file=conf)
+
+    def handle():
+        event = {"Records": [{"cf": {"request": {"uri": TEST_PATH}}}]}
+        return req.handler(event, context=None)
+
+    assert handle() == expected
+    queries = mocked_boto3_client().query.call_count
+    assert queries
+
+    # Within TTL, no more queries are needed.
+    mocked_time.return_value = 1004.0
+    assert handle() == expected
+    assert mocked_boto3_client().query.call_count == queries
+    assert f"Negative cache hit for '{TEST_PATH}' (hits: 1, misses: " in (
+        caplog.text
+    )
+
+    # After TTL, the table is queried again.
+    mocked_time.return_value = 1006.0
+    assert handle() == expected
+    assert mocked_boto3_client().query.call_count == queries * 2
+
+    # Hits and misses are counted in metrics, against the local region.
+    [doc] = req._db.metrics.flush()
+    assert doc["Region"] == "us-east-1"
+    assert doc["NegativeCacheHits"] == req._negative_cache.hits > 0
+    assert doc["NegativeCacheMisses"] == req._negative_cache.misses > 0
+
+
+def item_cache_handler(conf_item_cache, mocked_cache, mocked_boto3_client):
+    # Returns a function which handles a request for a URI, with some
+    # item cache configured.
+    mocked_cache.TTLCache.return_value = {"exodus-config": {}}
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["item_cache"] = conf_item_cache
+    req = OriginRequest(conf_file=conf)
+
+    def handle(uri, wait=True):
+        event = {"Records": [{"cf": {"request": {"uri": uri, "headers": {}}}}]}
+        out = req.handler(event, context=None)
+        if wait:
+            # Wait for any item to be cached in the background.
+            req._item_cache_fills.submit(lambda: None).result()
+        return out
+
+    handle.req = req
+    return handle
+
+
+def item_query_result(uri, object_key="e4a3f2sum"):
+    return {
+        "Items": [
+            {
+                "web_uri": {"S": uri},
+                "from_date": {"S": "2020-02-17T00:00:00.000+00:00"},
+                "object_key": {"S": object_key},
+                "content_type": {"S": "text/plain"},
+            }
+        ]
+    }
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache(
+    mocked_cache, mocked_time, mocked_boto3_client, caplog
+):
+    """Items found in the table are cached for the configured TTL."""
+
+    mocked_time.return_value = 1000.0
+    handle = item_cache_handler({"ttl": 60}, mocked_cache, mocked_boto3_client)
+    query = mocked_boto3_client().query
+    query.side_effect = [
+        item_query_result(TEST_PATH),
+        # Lookup of next from_date: nothing is scheduled.
+        {"Items": []},
+    ]
+
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+    assert query.call_count == 2
+    assert query.call_args.kwargs == {
+        "TableName": "test-table",
+        "Limit": 1,
+        "ConsistentRead": True,
+        "ScanIndexForward": True,
+        "KeyConditionExpression": "web_uri = :u and from_date > :d",
+        "ProjectionExpression": "from_date",
+        "ExpressionAttributeValues": {":u": {"S": TEST_PATH}, ":d": mock.ANY},
+    }
+
+    # Within TTL, no queries are needed and the response is the same.
+    mocked_time.return_value = 1059.0
+    assert handle(TEST_PATH) == {
+        "uri": "/e4a3f2sum",
+        "querystring": urlencode({"response-content-type": "text/plain"}),
+        "headers": {
+            "exodus-original-uri": [
+                {"key": "exodus-original-uri", "value": TEST_PATH}
+            ]
+        },
+    }
+    assert query.call_count == 2
+    assert (
+        f"Item cache hit for '{TEST_PATH}' (hits: 1, misses: 1)"
+        in caplog.messages
+    )
+
+    # After TTL, the table is queried again.
+    mocked_time.return_value = 1061.0
+    query.side_effect = [item_query_result(TEST_PATH, "newsum"), {"Items": []}]
+    assert handle(TEST_PATH)["uri"] == "/newsum"
+    assert query.call_count == 4
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.time.monotonic")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache_from_date(
+    mocked_cache, mocked_time, mocked_boto3_client
+):
+    """Cached items expire no later than the from_date of the next item."""
+
+    mocked_time.return_value = 1000.0
+    handle = item_cache_handler(
+        {"ttl": 600}, mocked_cache, mocked_boto3_client
+    )
+    next_date = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+    query = mocked_boto3_client().query
+    query.side_effect = [
+        item_query_result(TEST_PATH),
+        {
+            "Items": [
+                {
+                    "from_date": {
+                        # Naive dates are taken to be in UTC.
+                        "S": next_date.replace(tzinfo=None).isoformat()
+                    }
+                }
+            ]
+        },
+        item_query_result(TEST_PATH, "newsum"),
+        {"Items": []},
+    ]
+
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+
+    mocked_time.return_value = 1020.0
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+    assert query.call_count == 2
+
+    # From this point the next item is in effect, so should be looked up.
+    mocked_time.return_value = 1031.0
+    assert handle(TEST_PATH)["uri"] == "/newsum"
+    assert query.call_count == 4
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache_from_date_passed(
+    mocked_cache, mocked_boto3_client
+):
+    """Items are not cached if a newer item is about to take effect."""
+
+    handle = item_cache_handler(
+        {"ttl": 600}, mocked_cache, mocked_boto3_client
+    )
+    query = mocked_boto3_client().query
+    query.side_effect = [
+        item_query_result(TEST_PATH),
+        {"Items": [{"from_date": {"S": "2020-02-18T00:00:00.000+00:00"}}]},
+        item_query_result(TEST_PATH, "newsum"),
+        {"Items": []},
+    ]
+
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+    assert handle(TEST_PATH)["uri"] == "/newsum"
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache_background(
+    mocked_cache, mocked_boto3_client
+):
+    """Responses don't wait for items to be cached, and each item is
+    cached once at a time."""
+
+    handle = item_cache_handler(
+        {"ttl": 600}, mocked_cache, mocked_boto3_client
+    )
+    release = threading.Event()
+
+    def query(**kwargs):
+        if kwargs["ScanIndexForward"]:
+            # Lookup of next from_date.
+            assert release.wait(5)
+            return {"Items": []}
+        return item_query_result(
+            kwargs["ExpressionAttributeValues"][":u"]["S"]
+        )
+
+    mocked_boto3_client().query.side_effect = query
+
+    try:
+        assert handle(TEST_PATH, wait=False)["uri"] == "/e4a3f2sum"
+        # Not cached yet, so queried again, but not cached twice.
+        assert handle(TEST_PATH, wait=False)["uri"] == "/e4a3f2sum"
+
+        # Nothing else is cached while too many items are waiting.
+        with mock.patch(
+            "exodus_lambda.functions.origin_request."
+            "MAX_PENDING_ITEM_CACHE_FILLS",
+            1,
+        ):
+            handle("/other/path", wait=False)
+    finally:
+        release.set()
+    handle.req._item_cache_fills.submit(lambda: None).result()
+
+    next_date_queries = [
+        call.kwargs["ExpressionAttributeValues"][":u"]["S"]
+        for call in mocked_boto3_client().query.call_args_list
+        if call.kwargs["ScanIndexForward"]
+    ]
+    assert next_date_queries == [TEST_PATH]
+    assert handle.req._item_cache.lookup(("test-table", TEST_PATH))
+    assert not handle.req._item_cache_pending
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache_error(
+    mocked_cache, mocked_boto3_client, caplog
+):
+    """Items are not cached if their expiry can't be found."""
+
+    handle = item_cache_handler(
+        {"ttl": 600}, mocked_cache, mocked_boto3_client
+    )
+    query = mocked_boto3_client().query
+
+    def fail_next_date(**kwargs):
+        if kwargs["ScanIndexForward"]:
+            raise RuntimeError("simulated error")
+        return item_query_result(TEST_PATH)
+
+    query.side_effect = fail_next_date
+
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+    assert f"Error caching item for URI: {TEST_PATH}" in caplog.messages
+    assert handle(TEST_PATH)["uri"] == "/e4a3f2sum"
+
+    # Each request had to look up the item.
+    assert [
+        call.kwargs["ScanIndexForward"] for call in query.call_args_list
+    ].count(False) == 2
+
+
+@pytest.mark.parametrize(
+    "path_ttl, cached",
+    [
+        (None, False),
+        ([{"pattern": ".+/repodata/repomd.xml", "ttl": 5}], True),
+    ],
+    ids=["default", "override"],
+)
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_item_cache_mutable_paths(
+    mocked_cache, mocked_boto3_client, path_ttl, cached
+):
+    """Mutable paths are only cached if configured."""
+
+    uri = "/content/dist/repo/repodata/repomd.xml"
+    handle = item_cache_handler(
+        {"ttl": 600, "path_ttl": path_ttl}, mocked_cache, mocked_boto3_client
+    )
+    query = mocked_boto3_client().query
+    query.side_effect = lambda **kwargs: (
+        item_query_result(uri)
+        if not kwargs["ScanIndexForward"]
+        else {"Items": []}
+    )
+
+    handle(uri)
+    handle(uri)
+
+    # If cached, the second query looks up the next from_date and the
+    # second request is served from cache. Otherwise, each request
+    # queries for the item.
+    assert [
+        call.kwargs["ScanIndexForward"] for call in query.call_args_list
+    ] == ([False, True] if cached else [False, False])
+
+
+@pytest.mark.parametrize(
+    "conf, context, expected",
+    [
+        ({}, None, None),
+        ({}, {}, None),
+        ({"request_budget_ms": 1500}, None, 1.5),
+        ({}, mock.Mock(get_remaining_time_in_millis=lambda: 3000), 2.8),
+        (
+            {"request_budget_ms": 1500, "deadline_margin_ms": 0},
+            mock.Mock(get_remaining_time_in_millis=lambda: 1000),
+            1.0,
+        ),
+        (
+            {"request_budget_ms": 1500},
+            mock.Mock(get_remaining_time_in_millis=lambda: 5000),
+            1.5,
+        ),
+    ],
+)
+def test_request_budget(conf, context, expected):
+    """Request budget is the smaller of the configured budget and the
+    remaining execution time of the Lambda."""
+
+    req = OriginRequest(conf_file={**TEST_CONF, **conf})
+
+    assert req.request_budget(context) == expected
+
+
+@pytest.mark.parametrize("config_cached", [True, False])
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_deadline_exceeded(
+    mocked_cache, mocked_boto3_client, config_cached, caplog
+):
+    """A 503 response is returned when queries for either config or items
+    can't be completed before the Lambda's execution time runs out."""
+
+    mocked_cache.TTLCache.return_value = (
+        {"exodus-config": mock_definitions()} if config_cached else {}
+    )
+    release = threading.Event()
+    mocked_boto3_client().query.side_effect = lambda **_: release.wait(5)
+
+    context = mock.Mock(get_remaining_time_in_millis=lambda: 300)
+    event = {"Records": [{"cf": {"request": {"uri": TEST_PATH}}}]}
+
+    try:
+        out = OriginRequest(conf_file=TEST_CONF).handler(event, context)
+    finally:
+        release.set()
+
+    assert out == {
+        "status": "503",
+        "statusDescription": "Service Unavailable",
+        "headers": {
+            "cache-control": [{"key": "Cache-Control", "value": "no-store"}]
+        },
+    }
+    assert "Request deadline exceeded, returning 503" in caplog.messages
+
+
+@mock.patch("boto3.client")
+def test_origin_request_warmup(mocked_boto3_client, caplog):
+    """A warm-up event loads config and waits for prewarming, without
+    handling any request."""
+
+    mocked_defs = mock_definitions()
+    mocked_boto3_client().query.return_value = {
+        "Items": [
+            {
+                "from_date": {"S": "2020-02-17T00:00:00.000+00:00"},
+                "config_id": {"S": "exodus-config"},
+                "config": {"S": json.dumps(mocked_defs)},
+            }
+        ]
+    }
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["prewarm"] = True
+    req = OriginRequest(conf_file=conf)
+
+    assert req.handler({"exodus-warmup": True}, context=None) == {
+        "status": "200",
+        "statusDescription": "OK",
+    }
+
+    # Every region was prewarmed and config is ready to use.
+    assert all(not t.is_alive() for t in req._prewarm_threads)
+    assert mocked_boto3_client().describe_endpoints.called
+    assert req.generation == 1
+    assert "Warmed up in " in caplog.text
+    assert "(config generation 1)" in caplog.text
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_consumed_capacity(
+    mocked_cache, mocked_boto3_client, caplog
+):
+    """Capacity consumed by queries is logged for each request."""
+
+    mocked_cache.TTLCache.return_value = {"exodus-config": mock_definitions()}
+    mocked_boto3_client().query.return_value = {
+        "Items": [
+            {
+                "web_uri": {"S": TEST_PATH},
+                "from_date": {"S": "2020-02-17T00:00:00.000+00:00"},
+                "object_key": {"S": "e4a3f2sum"},
+                "content_type": {"S": "text/plain"},
+            }
+        ],
+        "ConsumedCapacity": {"TableName": "test", "CapacityUnits": 1.0},
+    }
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["consumed_capacity"] = True
+    # Logged even if the main logger is only logging warnings.
+    conf["logging"]["loggers"]["origin-request"]["level"] = "WARNING"
+    event = {
+        "Records": [{"cf": {"request": {"uri": TEST_PATH, "headers": {}}}}]
+    }
+
+    OriginRequest(conf_file=conf).handler(event, context=None)
+
+    assert mocked_boto3_client().query.call_args.kwargs[
+        "ReturnConsumedCapacity"
+    ] == ("TOTAL")
+    logged = [
+        json.loads(line)
+        for line in caplog.text.splitlines()
+        if "Request used" in line
+    ]
+    assert logged == [
+        {
+            "level": "INFO",
+            "time": mock.ANY,
+            "aws-request-id": None,
+            "message": mock.ANY,
+            "logger": "origin-request.metrics",
+            "request": {"uri": TEST_PATH},
+            "response": {"status": None},
+            "consumed-capacity": {"content": {"us-east-1": 1.0}},
+        }
+    ]
+
+
+@mock.patch("boto3.client")
+@mock.patch("exodus_lambda.functions.origin_request.cachetools")
+def test_origin_request_metrics(
+    mocked_cache, mocked_boto3_client, caplog, monkeypatch
+):
+    """Metrics are logged in Embedded Metric Format once due."""
+
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    mocked_cache.TTLCache.return_value = {"exodus-config": mock_definitions()}
+    mocked_boto3_client().query.return_value = {"Items": []}
+
+    conf = copy.deepcopy(TEST_CONF)
+    conf["metrics"] = {"enabled": True, "flush_interval": 0}
+    # Metrics are logged even if the main logger is only logging warnings,
+    # as in deployed functions, and no level is configured for metrics.
+    conf["logging"]["loggers"]["origin-request"]["level"] = "WARNING"
+    del conf["logging"]["loggers"]["origin-request.metrics"]
+    logging.getLogger("origin-request.metrics").setLevel(logging.NOTSET)
+    req = OriginRequest(conf_file=conf)
+    event = {
+        "Records": [{"cf": {"request": {"uri": TEST_PATH, "headers": {}}}}]
+    }
+
+    req.handler(event, context=None)
+    req._db.metrics.record_latency("us-east-1", 0.01)
+    req.handler(event, context=None)
+
+    logged = [
+        json.loads(line)
+        for line in caplog.text.splitlines()
+        if "DynamoDB metrics" in line
+    ]
+    expected = {
+        "level": "INFO",
+        "time": mock.ANY,
+        "aws-request-id": None,
+        "message": "DynamoDB metrics",
+        "logger": "origin-request.metrics",
+        "request": None,
+        "response": None,
+        "Region": "us-east-1",
+        "Retries": 0,
+        "Throttles": 0,
+        "Failovers": 0,
+        "Hedges": 0,
+        "ConfigRefreshFailures": 0,
+        "NegativeCacheHits": 0,
+        "NegativeCacheMisses": 0,
+        "UriCacheHits": 0,
+        "UriCacheMisses": 0,
+        "_aws": mock.ANY,
+    }
+    assert logged == [
+        {**expected, "UriCacheMisses": 1},
+        {**expected, "Latency": [10.0], "UriCacheHits": 1},
+    ]
+
+    # The queries made by each request are logged too.
+    logged = [
+        json.loads(line)
+        for line in caplog.text.splitlines()
+        if "Request used" in line
+    ]
+    assert len(logged) == 2
+    assert logged[0] == {
+        "level": "INFO",
+        "time": mock.ANY,
+        "aws-request-id": None,
+        "message": mock.ANY,
+        "logger": "origin-request.metrics",
+        "request": {"uri": TEST_PATH},
+        "response": {"status": "404"},
+    }
+    assert "attempts" in logged[0]["message"]
+    assert "backoff" in logged[0]["message"]
@@ -1,6 +1,15 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+import mock
 import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
 
-from exodus_lambda.functions.db import QueryHelper
+from exodus_lambda.functions.db import DeadlineExceeded, QueryHelper
 
 
 class DynamoDbBrokenClient:
@@ -9,6 +18,7 @@ class DynamoDbBrokenClient:
     def __init__(self, service, *args, **kwargs):
         assert service == "dynamodb"
         self._region = kwargs["config"].region_name
+        self.meta = mock.Mock()
 
     def query(self, *args, **kwargs):
         raise RuntimeError(f"error from {self._region}")
@@ -60,3 +70,920 @@ def test_all_regions_fail(monkeypatch: pytest.MonkeyPatch):
     assert str(exc.__cause__.__cause__) == "error from region1"
 
     assert exc.__cause__.__cause__.__cause__ is None
+
+
+class DynamoDbFakeClient:
+    # A DynamoDb client whose behavior in each region is determined
+    # by a callable in BEHAVIORS.
+
+    BEHAVIORS: dict[str, Any] = {}
+
+    def __init__(self, service, *args, **kwargs):
+        assert service == "dynamodb"
+        self._region = kwargs["config"].region_name
+        self.meta = mock.Mock()
+
+    def query(self, *args, **kwargs):
+        return self.BEHAVIORS[self._region]()
+
+
+def hedging_helper(monkeypatch, behaviors, **hedging):
+    monkeypatch.setattr("boto3.client", DynamoDbFakeClient)
+    monkeypatch.setattr(DynamoDbFakeClient, "BEHAVIORS", behaviors)
+
+    return QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["region1", "region2", "region3"],
+            },
+            "hedging": {"enabled": True, "delay_ms": 10, **hedging},
+        },
+        None,
+    )
+
+
+def answer(region, release=None):
+    # Returns a behavior answering from region, optionally waiting
+    # for an event first.
+    def fn():
+        if release:
+            assert release.wait(5)
+        return {"Items": [], "region": region}
+
+    return fn
+
+
+def test_hedging_slow_primary(monkeypatch, caplog):
+    """A query is hedged to the next region if the primary is slow."""
+
+    caplog.set_level(logging.INFO)
+    release = threading.Event()
+    db = hedging_helper(
+        monkeypatch,
+        {"region1": answer("region1", release), "region2": answer("region2")},
+    )
+
+    try:
+        with db.request() as stats:
+            out = db.query(TableName="test")
+    finally:
+        release.set()
+
+    assert out["region"] == "region2"
+    assert stats.queries == 1
+    assert stats.hedges == 1
+    assert db.hedges == 1
+    assert "Hedging query for table test to region region2" in caplog.messages
+
+
+def test_hedging_fast_primary(monkeypatch):
+    """No hedging occurs if the primary answers in time."""
+
+    db = hedging_helper(
+        monkeypatch, {"region1": answer("region1")}, delay_ms=5000
+    )
+
+    with db.request() as stats:
+        assert db.query(TableName="test")["region"] == "region1"
+
+    assert stats.hedges == 0
+
+
+def test_hedging_capped(monkeypatch):
+    """Hedges per request are capped."""
+
+    release1 = threading.Event()
+    release2 = threading.Event()
+    region3 = mock.Mock(side_effect=answer("region3"))
+    db = hedging_helper(
+        monkeypatch,
+        {
+            "region1": answer("region1", release1),
+            "region2": answer("region2", release2),
+            "region3": region3,
+        },
+        max_per_request=1,
+    )
+
+    def release():
+        time.sleep(0.1)
+        release1.set()
+
+    threading.Thread(target=release).start()
+    try:
+        with db.request() as stats:
+            out = db.query(TableName="test")
+    finally:
+        release2.set()
+
+    # Only one hedge was sent, and the primary eventually answered.
+    assert stats.hedges == 1
+    assert out["region"] == "region1"
+    region3.assert_not_called()
+
+
+def test_hedging_failover(monkeypatch, caplog):
+    """Errors while hedging fail over to the next region."""
+
+    def broken():
+        raise RuntimeError("simulated error")
+
+    db = hedging_helper(
+        monkeypatch,
+        {"region1": broken, "region2": broken, "region3": answer("region3")},
+        delay_ms=5000,
+    )
+
+    assert db.query(TableName="test")["region"] == "region3"
+    assert (
+        "Failover: query for table test succeeded in region region3 "
+        "after prior errors"
+    ) in caplog.messages
+
+
+def test_hedging_all_fail(monkeypatch):
+    """Exceptions propagate if every region fails while hedging."""
+
+    release = threading.Event()
+
+    def broken_after_release():
+        assert release.wait(5)
+        raise RuntimeError("error from region1")
+
+    def broken():
+        release.set()
+        raise RuntimeError("error from region2")
+
+    db = hedging_helper(
+        monkeypatch,
+        {
+            "region1": broken_after_release,
+            "region2": broken,
+            "region3": mock.Mock(
+                side_effect=RuntimeError("error from region3")
+            ),
+        },
+    )
+
+    with pytest.raises(RuntimeError) as excinfo:
+        db.query(TableName="test")
+
+    # All errors are chained.
+    messages = []
+    exc = excinfo.value
+    while exc:
+        messages.append(str(exc))
+        exc = exc.__cause__
+    assert sorted(messages) == [
+        "error from region1",
+        "error from region2",
+        "error from region3",
+    ]
+
+
+def test_hedge_delay_percentile():
+    """Hedge delay can be taken from observed latencies."""
+
+    db = QueryHelper(
+        {"hedging": {"enabled": True, "delay_ms": 100, "percentile": 90}},
+        None,
+    )
+
+    # Not enough samples: use the configured delay.
+    assert db._hedge_delay("region1") == 0.1
+
+    db.health("region1").latencies.extend([i / 1000.0 for i in range(100)])
+    assert db._hedge_delay("region1") == 0.09
+
+
+def test_circuit_breaker_skips_region(monkeypatch):
+    """A region failing repeatedly is skipped until cooldown expires."""
+
+    region1 = mock.Mock(side_effect=RuntimeError("simulated error"))
+    monkeypatch.setattr("boto3.client", DynamoDbFakeClient)
+    monkeypatch.setattr(
+        DynamoDbFakeClient,
+        "BEHAVIORS",
+        {"region1": region1, "region2": answer("region2")},
+    )
+
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["region1", "region2"],
+            },
+            "circuit_breaker": {"failure_threshold": 2, "cooldown": 30},
+        },
+        None,
+    )
+
+    for _ in range(5):
+        assert db.query(TableName="test")["region"] == "region2"
+
+    # After tripping the breaker, region1 was no longer queried.
+    assert region1.call_count == 2
+    assert db.health("region1").state == "open"
+
+
+def test_circuit_breaker_probe_not_wasted(monkeypatch):
+    """A region recovered from a failure while the primary was healthy is
+    probed when the primary then fails."""
+
+    region1 = answer("region1")
+    region2 = mock.Mock(side_effect=RuntimeError("simulated error"))
+    monkeypatch.setattr("boto3.client", DynamoDbFakeClient)
+    monkeypatch.setattr(
+        DynamoDbFakeClient,
+        "BEHAVIORS",
+        {"region1": lambda: region1(), "region2": lambda: region2()},
+    )
+
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["region1", "region2"],
+            },
+            "circuit_breaker": {"failure_threshold": 1, "cooldown": 30},
+        },
+        None,
+    )
+    timer = mock.Mock(return_value=100.0)
+    db.health("region2")._timer = timer
+
+    # Trip region2's breaker.
+    with pytest.raises(RuntimeError):
+        db._query_region("region2", False, TableName="test")
+    assert db.health("region2").state == "open"
+
+    # Once the cooldown has passed, queries are still answered by region1,
+    # which doesn't use up region2's probe.
+    timer.return_value = 131.0
+    assert db.query(TableName="test")["region"] == "region1"
+    assert db.health("region2").state == "open"
+
+    # region1 now fails, and region2 (recovered) is probed.
+    region1 = mock.Mock(side_effect=RuntimeError("simulated error"))
+    region2 = answer("region2")
+    assert db.query(TableName="test")["region"] == "region2"
+    assert db.health("region2").state == "closed"
+
+
+def test_circuit_breaker_all_open(monkeypatch):
+    """If every region is unhealthy, all are tried anyway."""
+
+    monkeypatch.setattr("boto3.client", DynamoDbFakeClient)
+    monkeypatch.setattr(
+        DynamoDbFakeClient, "BEHAVIORS", {"region1": answer("region1")}
+    )
+
+    db = QueryHelper(
+        {"table": {"name": "test", "available_regions": ["region1"]}},
+        None,
+    )
+    db.health("region1").state = "open"
+    db.health("region1")._opened_at = time.monotonic()
+
+    assert db.query(TableName="test")["region"] == "region1"
+    assert db.health("region1").state == "closed"
+
+
+def ordering_helper(local_region=None, **table):
+    return QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": [
+                    "us-east-1",
+                    "eu-west-1",
+                    "ap-southeast-1",
+                ],
+                **table,
+            },
+            "region_ordering": "proximity",
+        },
+        None,
+        local_region=local_region,
+    )
+
+
+@pytest.mark.parametrize(
+    "local_region, expected",
+    [
+        ("ap-south-1", ["ap-southeast-1", "eu-west-1", "us-east-1"]),
+        ("eu-central-1", ["eu-west-1", "us-east-1", "ap-southeast-1"]),
+        ("us-west-2", ["us-east-1", "eu-west-1", "ap-southeast-1"]),
+        # Unknown or missing local region keeps configured order.
+        ("moon-east-1", ["us-east-1", "eu-west-1", "ap-southeast-1"]),
+        (None, ["us-east-1", "eu-west-1", "ap-southeast-1"]),
+    ],
+)
+def test_proximity_ordering(local_region, expected):
+    """Regions are ordered by distance from the local region."""
+
+    db = ordering_helper(local_region)
+
+    assert db._available_regions("test") == expected
+
+
+def test_proximity_ordering_config_default():
+    """Regions are tried in configured order unless proximity is enabled."""
+
+    db = ordering_helper("ap-south-1")
+    db._conf["region_ordering"] = "config"
+
+    assert db._available_regions("test") == [
+        "us-east-1",
+        "eu-west-1",
+        "ap-southeast-1",
+    ]
+
+
+def test_proximity_ordering_observed_latency():
+    """Observed latencies take precedence over distance estimates, once
+    every region has been observed."""
+
+    db = ordering_helper("ap-south-1")
+
+    # Nearest region turns out to be slow.
+    for _ in range(5):
+        db.health("ap-southeast-1").record_success(0.5)
+    db.health("us-east-1").record_success(0.05)
+    db.health("eu-west-1").record_success(0.2)
+
+    assert db._available_regions("test") == [
+        "us-east-1",
+        "eu-west-1",
+        "ap-southeast-1",
+    ]
+
+    # As it speeds up again, the moving average brings it back to the front.
+    for _ in range(20):
+        db.health("ap-southeast-1").record_success(0.01)
+
+    assert db._available_regions("test")[0] == "ap-southeast-1"
+
+
+def test_proximity_ordering_partly_observed():
+    """Observed latencies, which include time spent in DynamoDB, aren't
+    compared with distance estimates."""
+
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["us-east-1", "us-east-2"],
+            },
+            "region_ordering": "proximity",
+        },
+        None,
+        local_region="us-east-1",
+    )
+
+    # A typical query to the local region, slower than the estimate for a
+    # nearby region.
+    db.health("us-east-1").record_success(0.012)
+    assert db._available_regions("test") == ["us-east-1", "us-east-2"]
+
+    # Once both have been observed, their averages are compared.
+    db.health("us-east-2").record_success(0.02)
+    assert db._available_regions("test") == ["us-east-1", "us-east-2"]
+    for _ in range(20):
+        db.health("us-east-1").record_success(0.05)
+    assert db._available_regions("test") == ["us-east-2", "us-east-1"]
+
+
+def test_proximity_ordering_primary_region():
+    """A table's primary_region is always tried first."""
+
+    db = ordering_helper("ap-south-1", primary_region="us-east-1")
+
+    assert db._available_regions("test") == [
+        "us-east-1",
+        "ap-southeast-1",
+        "eu-west-1",
+    ]
+
+
+def deadline_helper(monkeypatch, behaviors, **conf):
+    monkeypatch.setattr("boto3.client", DynamoDbFakeClient)
+    monkeypatch.setattr(DynamoDbFakeClient, "BEHAVIORS", behaviors)
+
+    return QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["region1", "region2"],
+            },
+            **conf,
+        },
+        None,
+    )
+
+
+def test_deadline_unlimited(monkeypatch):
+    """Without a budget, queries aren't limited."""
+
+    db = deadline_helper(monkeypatch, {"region1": answer("region1")})
+
+    with db.request() as stats:
+        assert db.query(TableName="test")["region"] == "region1"
+
+    assert stats.remaining() is None
+
+
+def test_deadline_failover(monkeypatch):
+    """A slow region only gets a share of the budget, leaving time to fail
+    over to the next region."""
+
+    release = threading.Event()
+    db = deadline_helper(
+        monkeypatch,
+        {"region1": answer("region1", release), "region2": answer("region2")},
+    )
+
+    try:
+        with db.request(budget=0.4):
+            out = db.query(TableName="test")
+    finally:
+        release.set()
+
+    assert out["region"] == "region2"
+
+
+def test_deadline_exceeded(monkeypatch):
+    """DeadlineExceeded is raised if no region answers in time."""
+
+    release = threading.Event()
+    db = deadline_helper(
+        monkeypatch,
+        {
+            "region1": answer("region1", release),
+            "region2": answer("region2", release),
+        },
+    )
+
+    try:
+        with db.request(budget=0.5):
+            with pytest.raises(DeadlineExceeded) as excinfo:
+                db.query(TableName="test")
+    finally:
+        release.set()
+
+    # Attempt in the first region is part of the chain.
+    assert isinstance(excinfo.value.__cause__, TimeoutError)
+
+
+def test_deadline_already_passed(monkeypatch):
+    """No queries are attempted once the deadline has passed."""
+
+    region1 = mock.Mock()
+    db = deadline_helper(monkeypatch, {"region1": region1})
+
+    with db.request(budget=0):
+        with pytest.raises(DeadlineExceeded):
+            db.query(TableName="test")
+
+    region1.assert_not_called()
+
+
+def test_deadline_attempts_bounded(monkeypatch):
+    """Attempts run in other threads are limited in number, after which
+    they run in the calling thread."""
+
+    release = threading.Event()
+    db = deadline_helper(
+        monkeypatch,
+        {"region1": answer("region1", release), "region2": answer("region2")},
+        max_pool_connections=1,
+    )
+
+    try:
+        with db.request(budget=1):
+            assert db.query(TableName="test")["region"] == "region2"
+
+        # The timed out attempt is still using the only thread.
+        assert db._attempt_executor._max_workers == 1
+        assert not db._attempt_slots.acquire(blocking=False)
+    finally:
+        release.set()
+
+
+def test_deadline_attempt_cancelled(monkeypatch):
+    """An attempt which hasn't started when it times out is cancelled."""
+
+    db = deadline_helper(monkeypatch, {})
+    executor = mock.Mock()
+    executor.submit.side_effect = lambda fn: Future()
+    monkeypatch.setattr(db, "_get_attempt_executor", lambda: executor)
+
+    with db.request(budget=0.4):
+        with pytest.raises(DeadlineExceeded):
+            db.query(TableName="test")
+
+    assert executor.submit.call_count == 2
+    # Slots were given back.
+    for _ in range(10):
+        assert db._attempt_slots.acquire(blocking=False)
+
+
+def test_deadline_hedged(monkeypatch):
+    """Hedged queries are also limited by the deadline."""
+
+    release = threading.Event()
+    db = deadline_helper(
+        monkeypatch,
+        {
+            "region1": answer("region1", release),
+            "region2": answer("region2", release),
+        },
+        hedging={"enabled": True, "delay_ms": 10, "max_per_request": 0},
+    )
+
+    try:
+        with db.request(budget=0.1) as stats:
+            with pytest.raises(DeadlineExceeded):
+                db.query(TableName="test")
+    finally:
+        release.set()
+
+    # Deadline reached before hedging was possible.
+    assert stats.hedges == 0
+
+
+class FakeRaw:
+    # Minimal stand-in for a urllib3 response.
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self):
+        yield self._body
+
+
+def fake_http(client, statuses):
+    # Makes the client respond to each HTTP request with the next status
+    # from statuses, without sending anything.
+    statuses = iter(statuses)
+
+    def send(request, **_kwargs):
+        status = next(statuses)
+        body = b'{"Items": [], "Count": 0}'
+        if status != 200:
+            body = (
+                b'{"__type": "com.amazonaws.dynamodb.v20120810'
+                b'#InternalServerError", "message": "simulated error"}'
+            )
+        return AWSResponse(request.url, status, {}, FakeRaw(body))
+
+    client.meta.events.register("before-send.dynamodb.Query", send)
+
+
+def retry_helper(monkeypatch, regions, retries):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "fake")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "fake")
+    # Don't actually back off.
+    monkeypatch.setattr("botocore.endpoint.time.sleep", lambda _: None)
+
+    db = QueryHelper(
+        {
+            "table": {"name": "test", "available_regions": list(regions)},
+            **({"retries": retries} if retries is not None else {}),
+        },
+        "https://dynamodb.example.com",
+    )
+    for region, statuses in regions.items():
+        fake_http(db._client(region), statuses)
+    return db
+
+
+def test_retry_policy_prefers_failover(monkeypatch):
+    """With a retry policy, a region isn't retried if another region is
+    available."""
+
+    db = retry_helper(
+        monkeypatch,
+        {"us-east-1": [500], "us-east-2": [200]},
+        {"mode": "standard", "max_attempts": 3},
+    )
+
+    with db.request() as stats:
+        assert db.query(TableName="test")["Count"] == 0
+
+    assert stats.attempts == 2
+    assert stats.retries == 0
+
+
+def test_retry_policy_last_region(monkeypatch):
+    """The last available region is retried according to the policy."""
+
+    db = retry_helper(
+        monkeypatch,
+        {"us-east-1": [500, 500, 200]},
+        {"mode": "standard", "max_attempts": 3},
+    )
+
+    with db.request() as stats:
+        assert db.query(TableName="test")["Count"] == 0
+
+    assert stats.attempts == 3
+    assert stats.retries == 2
+    assert stats.backoff >= 0
+
+
+def test_retry_policy_request_budget(monkeypatch):
+    """Retries are limited across the whole request."""
+
+    db = retry_helper(
+        monkeypatch,
+        {"us-east-1": [500, 500, 500, 200]},
+        {"mode": "standard", "max_attempts": 4, "max_per_request": 1},
+    )
+
+    with db.request() as stats:
+        with pytest.raises(ClientError):
+            db.query(TableName="test")
+
+    assert stats.attempts == 2
+    assert stats.retries == 1
+
+
+def test_retry_default_policy(monkeypatch):
+    """Without a retry policy, botocore's retries apply as usual but are
+    still accounted for."""
+
+    db = retry_helper(
+        monkeypatch, {"us-east-1": [500, 200, 200], "us-east-2": []}, None
+    )
+
+    with db.request() as stats:
+        assert db.query(TableName="test")["Count"] == 0
+
+    assert stats.attempts == 2
+    assert stats.retries == 1
+
+    # Queries outside of any request can still be made.
+    assert db.query(TableName="test")["Count"] == 0
+
+
+@pytest.mark.parametrize("error", [None, RuntimeError("simulated error")])
+@mock.patch("boto3.client")
+def test_prewarm(mocked_boto3_client, error, caplog):
+    """Prewarming creates a client and connects to each region in the
+    background, tolerating errors."""
+
+    caplog.set_level(logging.DEBUG)
+    mocked_boto3_client().describe_endpoints.side_effect = error
+    mocked_boto3_client.reset_mock()
+
+    db = QueryHelper(
+        {
+            "table": {
+                "name": "test",
+                "available_regions": ["region1", "region2"],
+            },
+            "config_table": {
+                "name": "config",
+                "available_regions": ["region2", "region3"],
+            },
+        },
+        None,
+    )
+
+    threads = db.prewarm(["test", "config"])
+    for thread in threads:
+        thread.join()
+
+    assert sorted(t.name for t in threads) == [
+        "prewarm-region1",
+        "prewarm-region2",
+        "prewarm-region3",
+    ]
+    assert sorted(db._clients) == ["region1", "region2", "region3"]
+    assert mocked_boto3_client.call_count == 3
+    assert mocked_boto3_client().describe_endpoints.call_count == 3
+    assert "Prewarmed region region3 in" in caplog.text
+    assert ("Error prewarming region region1" in caplog.text) == bool(error)
+
+
+class WaitedLock:
+    # A lock which notes when something starts waiting for it.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = threading.Event()
+
+    def __enter__(self):
+        self.waiting.set()
+        return self.lock.__enter__()
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+
+def test_client_creation_lock():
+    """Creating a client doesn't block other use of the helper, and each
+    region's client is created only once."""
+
+    creating = threading.Event()
+    release = threading.Event()
+
+    def make_client(*_args, **_kwargs):
+        creating.set()
+        assert release.wait(5)
+        return mock.Mock()
+
+    db = QueryHelper({}, None)
+    region_lock = db._client_locks["region1"] = WaitedLock()
+    with mock.patch("boto3.client", side_effect=make_client) as factory:
+        first = threading.Thread(target=db._client, args=("region1",))
+        first.start()
+        assert creating.wait(5)
+
+        # Not held up by the client being created.
+        assert db.health("region1").available()
+        assert db.connection_stats() == {}
+
+        # Another thread waits for the same client rather than creating
+        # one of its own.
+        region_lock.waiting.clear()
+        second = threading.Thread(target=db._client, args=("region1",))
+        second.start()
+        assert region_lock.waiting.wait(5)
+
+        release.set()
+        first.join()
+        second.join()
+
+    assert factory.call_count == 1
+
+
+def test_consumed_capacity():
+    """Consumed capacity is requested and added up by table and region."""
+
+    db = QueryHelper(
+        {
+            "table": {"name": "content-table", "available_regions": ["r1"]},
+            "config_table": {
+                "name": "config-table",
+                "available_regions": ["r1"],
+            },
+            "consumed_capacity": True,
+        },
+        None,
+    )
+
+    def query(TableName, **kwargs):
+        assert kwargs["ReturnConsumedCapacity"] == "TOTAL"
+        if TableName == "content-table":
+            return {"ConsumedCapacity": {"CapacityUnits": 1.0}}
+        if TableName == "config-table":
+            return {"ConsumedCapacity": {"ReadCapacityUnits": 0.5}}
+        return {"ConsumedCapacity": {"TableName": TableName}}
+
+    db._clients["r1"] = mock.Mock(query=query)
+    db._clients["r2"] = mock.Mock(query=query)
+
+    with db.request() as stats:
+        db.query(TableName="content-table")
+        db.query(TableName="content-table")
+        db.query(TableName="config-table")
+        db._query_region(
+            "r2",
+            False,
+            TableName="content-table",
+            ReturnConsumedCapacity="TOTAL",
+        )
+        db._query_region(
+            "r1",
+            False,
+            TableName="other-table",
+            ReturnConsumedCapacity="TOTAL",
+        )
+
+    assert stats.consumed_capacity == {
+        "content": {"r1": 2.0, "r2": 1.0},
+        "config": {"r1": 0.5},
+        "other-table": {"r1": 0},
+    }
+
+
+def coalesce_helper(**conf):
+    db = QueryHelper(
+        {"table": {"name": "test", "available_regions": ["r1"]}, **conf},
+        None,
+    )
+    started = threading.Event()
+    release = threading.Event()
+
+    def query(**kwargs):
+        started.set()
+        release.wait()
+        return {"Items": [], "Uri": kwargs["ExpressionAttributeValues"]}
+
+    db._clients["r1"] = mock.Mock(**{"query.side_effect": query})
+    return db, started, release
+
+
+def uri_query(uri, date):
+    return {
+        "TableName": "test",
+        "ExpressionAttributeValues": {":u": {"S": uri}, ":d": {"S": date}},
+    }
+
+
+def test_coalesced_queries():
+    """Identical queries from concurrent threads are made only once, even
+    if they're at different times."""
+
+    db, started, release = coalesce_helper()
+    results = []
+
+    def run(uri, date):
+        with db.request() as stats:
+            results.append((db.query(**uri_query(uri, date)), stats))
+
+    threads = [threading.Thread(target=run, args=("/a", "d1"))]
+    threads[0].start()
+    started.wait()
+    threads.extend(
+        threading.Thread(target=run, args=args)
+        for args in [("/a", "d2"), ("/b", "d1")]
+    )
+    for thread in threads[1:]:
+        thread.start()
+    # Give the other threads a chance to start their queries.
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert db._clients["r1"].query.call_count == 2
+    assert sorted(
+        (out["Uri"][":u"]["S"], stats.coalesced) for out, stats in results
+    ) == [("/a", 0), ("/a", 1), ("/b", 0)]
+
+
+def test_coalesce_disabled():
+    """Queries aren't coalesced if coalesce_queries is false."""
+
+    db, _, release = coalesce_helper(coalesce_queries=False)
+    release.set()
+
+    with mock.patch.object(db, "coalesce") as coalesce:
+        db.query(**uri_query("/a", "d1"))
+
+    coalesce.assert_not_called()
+    assert db._clients["r1"].query.call_count == 1
+
+
+def test_coalesce_leader_deadline():
+    """A query waiting on an identical query which runs out of time makes
+    the query itself, within its own deadline."""
+
+    db, started, release = coalesce_helper()
+    leader_done = threading.Event()
+
+    def leader():
+        with db.request(budget=0.1):
+            with pytest.raises(DeadlineExceeded):
+                db.query(**uri_query("/a", "d1"))
+        leader_done.set()
+        # Later queries are answered straight away.
+        release.set()
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+
+    try:
+        with db.request(budget=10):
+            out = db.query(**uri_query("/a", "d1"))
+    finally:
+        release.set()
+        thread.join()
+
+    assert leader_done.is_set()
+    assert out["Uri"][":u"]["S"] == "/a"
+    assert db._clients["r1"].query.call_count == 2
+
+
+def test_coalesce_deadline():
+    """A query waiting on an identical query in progress is still limited
+    by its own request's deadline."""
+
+    db, started, release = coalesce_helper()
+    thread = threading.Thread(target=db.query, kwargs=uri_query("/a", "d1"))
+    thread.start()
+    started.wait()
+
+    try:
+        with db.request(budget=0.05):
+            with pytest.raises(DeadlineExceeded, match="in progress"):
+                db.query(**uri_query("/a", "d1"))
+    finally:
+        release.set()
+        thread.join()
+
+    assert db._clients["r1"].query.call_count == 1
@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from exodus_lambda.functions.singleflight import SingleFlight
+
+
+def start(fn):
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_shared_result():
+    """Concurrent callers of the same key share a single call."""
+
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    leader = []
+    thread = start(lambda: leader.append(flights.do("key", fn)))
+    started.wait()
+
+    waiters = []
+    threads = [
+        start(lambda: waiters.append(flights.do("key", fn))) for _ in range(3)
+    ]
+    release.set()
+    for t in [thread, *threads]:
+        t.join()
+
+    assert calls == [1]
+    assert leader == [("result", False)]
+    assert waiters == [("result", True)] * 3
+
+    # Once complete, the next call for the key is made again.
+    assert flights.do("key", lambda: "again") == ("again", False)
+
+
+def test_shared_error():
+    """Errors raised by the call are raised in all callers sharing it."""
+
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fn():
+        started.set()
+        release.wait()
+        raise RuntimeError("oops")
+
+    def call():
+        try:
+            flights.do("key", fn)
+        except RuntimeError as error:
+            errors.append(error)
+
+    threads = [start(call)]
+    started.wait()
+    threads.append(start(call))
+    # Give the waiter a chance to start waiting.
+    threading.Event().wait(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_timeout():
+    """Waiters give up after the timeout; other keys don't wait at all."""
+
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait()
+
+    thread = start(lambda: flights.do("key", fn))
+    started.wait()
+
+    try:
+        with pytest.raises(TimeoutError, match="'key'"):
+            flights.do("key", fn, timeout=0.01)
+        assert flights.do("other", lambda: 1, timeout=0) == (1, False)
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_retry_on():
+    """Callers sharing a call which failed with an error in retry_on make
+    the call themselves."""
+
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            started.set()
+            release.wait()
+            raise TimeoutError("leader out of time")
+        return "result"
+
+    def leader():
+        with pytest.raises(TimeoutError):
+            flights.do("key", fn, retry_on=(TimeoutError,))
+
+    thread = start(leader)
+    started.wait()
+
+    waiter = []
+    waiter_thread = start(
+        lambda: waiter.append(
+            flights.do("key", fn, timeout=5, retry_on=(TimeoutError,))
+        )
+    )
+    release.set()
+    for t in [thread, waiter_thread]:
+        t.join()
+
+    assert waiter in ([("result", False)], [("result", True)])
+    assert len(calls) == 2
@@ -0,0 +1,275 @@
+import gzip
+import json
+import logging
+import os
+
+import mock
+import pytest
+
+from exodus_lambda.functions import snapshot as snapshot_module
+from exodus_lambda.functions.backend import DynamoDbBackend, InMemoryBackend
+from exodus_lambda.functions.origin_request import OriginRequest
+from exodus_lambda.functions.snapshot import (
+    Snapshot,
+    SnapshotBackend,
+    read_items,
+    write_snapshot,
+)
+
+from ..test_utils.utils import generate_test_config
+
+TEST_CONF = generate_test_config()
+REFTEST_DIR = os.path.join(os.path.dirname(__file__), "../../support/reftest")
+
+
+def item(web_uri, from_date, object_key, content_type=None):
+    out = {
+        "web_uri": {"S": web_uri},
+        "from_date": {"S": from_date},
+        "object_key": {"S": object_key},
+    }
+    if content_type:
+        out["content_type"] = {"S": content_type}
+    return out
+
+
+ITEMS = [
+    item("/b", "2024-03-01", "b3", "text/plain"),
+    item("/a", "2024-01-01", "a1", "text/plain"),
+    item("/b", "2024-01-01", "b1"),
+    item("/b", "2024-02-01", "b2", "text/html"),
+    item("/c/ünïcode", "2024-01-01", "c1"),
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    assert write_snapshot(path, ITEMS) == 5
+    out = Snapshot(path)
+    yield out
+    out.close()
+
+
+@pytest.mark.parametrize(
+    "web_uri, as_of, expected",
+    [
+        ("/a", "2024-06-01", item("/a", "2024-01-01", "a1", "text/plain")),
+        ("/a", "2023-12-31", None),
+        ("/b", "2024-01-15", item("/b", "2024-01-01", "b1")),
+        ("/b", "2024-02-01", item("/b", "2024-02-01", "b2", "text/html")),
+        ("/b", "2024-06-01", item("/b", "2024-03-01", "b3", "text/plain")),
+        ("/c/ünïcode", "2024-06-01", item("/c/ünïcode", "2024-01-01", "c1")),
+        ("/c", "2024-06-01", None),
+        ("/", "2024-06-01", None),
+    ],
+)
+def test_snapshot_latest_item(snapshot, web_uri, as_of, expected):
+    """Latest item with from_date <= as_of is found."""
+
+    assert snapshot.latest_item(web_uri, as_of) == expected
+
+
+@pytest.mark.parametrize(
+    "web_uri, after, expected",
+    [
+        ("/b", "2023-01-01", "2024-01-01"),
+        ("/b", "2024-01-01", "2024-02-01"),
+        ("/b", "2024-03-01", None),
+        ("/a", "2024-01-01", None),
+        ("/d", "2024-01-01", None),
+    ],
+)
+def test_snapshot_next_from_date(snapshot, web_uri, after, expected):
+    """Earliest from_date after a given date is found."""
+
+    assert snapshot.next_from_date(web_uri, after) == expected
+
+
+def test_snapshot_many_items(tmp_path):
+    """Every item can be found among many, including on hash collisions."""
+
+    path = str(tmp_path / "snapshot.bin")
+    items = [item(f"/path/{i}", "2024-01-01", str(i)) for i in range(5000)]
+
+    write_snapshot(path, items)
+    snapshot = Snapshot(path)
+
+    assert len(snapshot) == 5000
+    for i in range(5000):
+        found = snapshot.latest_item(f"/path/{i}", "2024-01-01")
+        assert found["object_key"]["S"] == str(i)
+    assert "/path/5000" not in snapshot
+
+    # Same again, with every key having the same hash.
+    with mock.patch.object(snapshot_module.zlib, "crc32", return_value=7):
+        write_snapshot(path, items[:50])
+        snapshot = Snapshot(path)
+        for i in range(50):
+            assert f"/path/{i}" in snapshot
+        assert "/path/50" not in snapshot
+
+
+def test_snapshot_invalid(tmp_path):
+    """Files which aren't snapshots are rejected."""
+
+    path = tmp_path / "snapshot.bin"
+    path.write_bytes(b"not a snapshot at all")
+
+    with pytest.raises(ValueError, match="Not a snapshot file"):
+        Snapshot(str(path))
+
+
+def test_read_items_export(tmp_path):
+    """Items are read from a DynamoDB table export."""
+
+    for i, name in enumerate(["a.json.gz", "b.json.gz"]):
+        with gzip.open(str(tmp_path / name), "wt") as export:
+            export.write(json.dumps({"Item": ITEMS[i]}) + "\n\n")
+    (tmp_path / "manifest-summary.json").write_text("{}")
+
+    assert list(read_items(str(tmp_path))) == ITEMS[:2]
+
+
+def test_read_items_fixture():
+    """Items are read from a fixture."""
+
+    items = list(read_items(os.path.join(REFTEST_DIR, "data.yml")))
+
+    assert len(items) > 10
+    assert all(item["web_uri"]["S"].startswith("/") for item in items)
+
+
+def test_read_items_fixture_config(tmp_path):
+    """Config in a fixture isn't read as a content item."""
+
+    path = tmp_path / "fixture.json"
+    path.write_text(
+        json.dumps(
+            {
+                "items": [{"web_uri": "/a", "object_key": "a1"}],
+                "config": {"listing": {}},
+            }
+        )
+    )
+
+    items = list(read_items(str(path)))
+    assert [item["web_uri"]["S"] for item in items] == ["/a"]
+    assert write_snapshot(str(tmp_path / "snapshot.bin"), items) == 1
+
+
+def test_write_snapshot_no_web_uri(tmp_path):
+    """Items without a web_uri aren't written."""
+
+    items = [item("/a", "2024-01-01", "a1"), {"object_key": {"S": "x"}}]
+
+    assert write_snapshot(str(tmp_path / "snapshot.bin"), items) == 1
+
+
+def test_snapshot_backend(snapshot):
+    """Lookups not answered by the snapshot go to the fallback."""
+
+    fallback = InMemoryBackend()
+    fallback.load_items(
+        "content",
+        "web_uri",
+        [
+            item("/a", "2020-01-01", "old-a"),
+            item("/x", "2024-01-01", "x1"),
+            item("/x", "2024-05-01", "x2"),
+        ],
+    )
+    fallback.load_items("other", "web_uri", [item("/a", "2020", "other-a")])
+    fallback.put_item(
+        "config", "exodus-config", item("exodus-config", "2020", "")
+    )
+    backend = SnapshotBackend(snapshot, fallback, "content")
+
+    def object_key(table, web_uri, as_of):
+        return backend.latest_item(table, web_uri, as_of)["object_key"]["S"]
+
+    assert object_key("content", "/a", "2024-06-01") == "a1"
+    # No item in effect yet according to the snapshot.
+    assert object_key("content", "/a", "2023-01-01") == "old-a"
+    assert object_key("content", "/x", "2024-06-01") == "x2"
+    assert object_key("other", "/a", "2024-06-01") == "other-a"
+
+    assert backend.next_from_date("content", "/a", "2023-01-01") == (
+        "2024-01-01"
+    )
+    assert backend.next_from_date("content", "/x", "2024-01-01") == (
+        "2024-05-01"
+    )
+    assert backend.latest_config("config", "exodus-config", "2024")
+    assert backend.latest_config_date("config", "exodus-config", "2024") == (
+        "2020"
+    )
+
+
+def test_snapshot_mutable_paths(tmp_path):
+    """Items for mutable paths are neither written to a snapshot nor
+    served from one."""
+
+    repomd = "/content/os/repodata/repomd.xml"
+    items = [
+        item(repomd, "2024-01-01", "old-repomd"),
+        item("/content/os/listing", "2024-01-01", "old-listing"),
+        item("/content/os/Packages/a.rpm", "2024-01-01", "rpm"),
+    ]
+    path = str(tmp_path / "snapshot.bin")
+    assert write_snapshot(path, items) == 1
+
+    # A snapshot written before mutable paths were left out.
+    with mock.patch.object(snapshot_module, "_is_mutable", return_value=False):
+        write_snapshot(path, items)
+    snapshot = Snapshot(path)
+    assert repomd in snapshot
+
+    fallback = InMemoryBackend()
+    fallback.load_items(
+        "content",
+        "web_uri",
+        [
+            item(repomd, "2024-01-01", "old-repomd"),
+            item(repomd, "2024-05-01", "new-repomd"),
+        ],
+    )
+    backend = SnapshotBackend(snapshot, fallback, "content")
+
+    assert backend.latest_item("content", repomd, "2024-06-01") == item(
+        repomd, "2024-05-01", "new-repomd"
+    )
+    assert backend.next_from_date("content", repomd, "2024-01-01") == (
+        "2024-05-01"
+    )
+    assert (
+        backend.latest_item("content", "/content/os/Packages/a.rpm", "2025")[
+            "object_key"
+        ]["S"]
+        == "rpm"
+    )
+    snapshot.close()
+
+
+def test_origin_request_snapshot(snapshot, tmp_path, caplog):
+    """OriginRequest looks up items in the snapshot if configured."""
+
+    conf = TEST_CONF.copy()
+    conf["snapshot_file"] = str(tmp_path / "snapshot.bin")
+    fallback = InMemoryBackend()
+
+    req = OriginRequest(conf_file=conf, backend=fallback)
+
+    assert req.lookup_item(conf["table"]["name"], "/a") == (
+        "a1",
+        "text/plain",
+    )
+    assert req.lookup_item(conf["table"]["name"], "/other") is None
+
+    # A snapshot which can't be loaded is not used.
+    conf["snapshot_file"] = str(tmp_path / "missing.bin")
+    with caplog.at_level(logging.WARNING):
+        req = OriginRequest(conf_file=conf)
+
+    assert isinstance(req._backend, DynamoDbBackend)
+    assert "Can't load snapshot" in caplog.text